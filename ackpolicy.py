@@ -0,0 +1,78 @@
+DELACK = 0.04  # longest an ACK is held back, in seconds. RFC 9293 allows up to 0.5
+ACKEVERY = 2  # full-sized segments covered by one ACK of in-order data
+
+
+class AckPolicy:
+    """
+    Decides when the segments we receive are acknowledged (RFC 9293 3.8.6.3, RFC 5681 4.2).
+
+    In-order data is acknowledged once every `every` full-sized segments, or when the delayed ACK timer expires `delay`
+    seconds after the first unacknowledged segment arrived. Segments the sender needs to hear about quickly are
+    acknowledged right away: out of order data, whose duplicate ACKs trigger fast retransmit, data that fills a hole,
+    a FIN, and duplicate or out of window segments. An ACK carried by one of our data segments counts as well.
+
+    The size of a full segment is the largest payload received so far, which is what the server's MSS works out to
+    once its options are taken off.
+    """
+
+    def __init__(self, mss=536, every=ACKEVERY, delay=DELACK):
+        """
+        mss (int) - size of a full segment until a larger one is received
+        every (int) - full-sized segments acknowledged by one ACK. 1 acknowledges every segment
+        delay (float) - longest an ACK is delayed, in seconds
+        """
+        self.mss = mss
+        self.every = every
+        self.delay = delay
+
+        self.pending = False  # whether a received segment has not been acknowledged yet
+        self.unacked = 0  # payload bytes received since the last ACK
+        self.deadline = None  # time at which the delayed ACK must be sent, or None if nothing is pending
+
+        self.segments = 0  # received segments that had to be acknowledged
+        self.acks = 0  # ACKs sent for them, including the ones carried by data segments
+        self.immediate = 0  # segments acknowledged right away because of reordering, a FIN or an unacceptable segment
+        self.delayed = 0  # ACKs sent when the delayed ACK timer expired
+
+    @property
+    def saved(self):
+        """Number of ACKs not sent compared to acknowledging every segment"""
+        return self.segments - self.acks
+
+    def received(self, nbytes, now, immediate=False):
+        """
+        Records a received segment that occupies sequence space
+
+        nbytes (int) - its payload length
+        now (float) - current time
+        immediate (bool) - whether it must be acknowledged right away
+
+        return (bool) - whether an ACK must be sent now. Otherwise, it must be sent by the deadline
+        """
+        self.segments += 1
+        self.unacked += nbytes
+        self.mss = max(self.mss, nbytes)
+        self.pending = True
+
+        if immediate:
+            self.immediate += 1
+            return True
+        if self.unacked >= self.every * self.mss:
+            return True
+
+        if self.deadline is None:
+            self.deadline = now + self.delay
+        return False
+
+    def due(self, now):
+        """Returns whether the delayed ACK timer has expired"""
+        return self.pending and self.deadline is not None and now >= self.deadline
+
+    def acked(self):
+        """Called whenever we send a segment that acknowledges everything received so far"""
+        if not self.pending:
+            return
+        self.acks += 1
+        self.pending = False
+        self.unacked = 0
+        self.deadline = None
@@ -0,0 +1,81 @@
+"""
+Microbenchmark for utils.checksum16. Compares the bulk checksum engine against the original word-at-a-time loop and
+against incrementally patching the checksum of a segment whose seq/ack/window changed.
+
+usage: python3 bench/checksumbench.py
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ip
+import tcp
+import utils
+
+SIZES = [20, 40, 576, 1460, 9000, 65535]
+MINTIME = 0.2  # seconds each measurement runs for
+
+
+def legacy_checksum16(bytevec):
+    """The original checksum loop, kept here as a baseline"""
+    if len(bytevec) % 2 != 0:
+        bytevec = bytevec + b'\x00'
+
+    sum = int.from_bytes(bytevec[0:2], byteorder='big')
+    for idx in range(2, len(bytevec) - 1, 2):
+        sum += int.from_bytes(bytevec[idx:idx+2], byteorder='big')
+        if sum > 0xffff:
+            sum = sum - 0x10000 + 1
+
+    return ~sum & 0xffff
+
+
+def measure(func, arg):
+    """Runs func(arg) repeatedly for at least MINTIME seconds. Returns the number of seconds per call"""
+    iters = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < MINTIME:
+        for _ in range(100):
+            func(arg)
+        iters += 100
+        elapsed = time.perf_counter() - start
+
+    return elapsed / iters
+
+
+def mbps(size, secs):
+    return size / secs / 1e6
+
+
+def main():
+    print('{:>8} {:>14} {:>14} {:>9}'.format('bytes', 'legacy MB/s', 'bulk MB/s', 'speedup'))
+    for size in SIZES:
+        buf = bytearray(os.urandom(size))
+        assert legacy_checksum16(bytearray(buf)) == utils.checksum16(buf)
+
+        legacy = measure(legacy_checksum16, buf)
+        bulk = measure(utils.checksum16, buf)
+        print('{:>8} {:>14.1f} {:>14.1f} {:>8.1f}x'.format(size, mbps(size, legacy), mbps(size, bulk), legacy / bulk))
+
+    # patching seq/ack/window of a full-sized segment vs recomputing its checksum
+    seg = tcp.TCP(seq=1000, ack=2000, flags='A', data=bytearray(os.urandom(1460)))
+    ippkt = ip.IP(proto=6, len=20 + 20 + 1460)
+    seg.compute_checksum(ippkt)
+
+    def recompute(pkt):
+        pkt.seq += 1460
+        pkt.compute_checksum(ippkt)
+
+    def patch(pkt):
+        pkt.update(seq=pkt.seq + 1460, ack=pkt.ack + 1, window=pkt.window ^ 1)
+
+    full = measure(recompute, seg)
+    incr = measure(patch, seg)
+    print()
+    print('1460 byte segment: full recompute {:.2f} us, incremental update {:.2f} us'.format(full * 1e6, incr * 1e6))
+
+
+if __name__ == '__main__':
+    main()
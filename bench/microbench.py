@@ -0,0 +1,181 @@
+"""
+Microbenchmarks for the per-packet hot paths: checksums, serializing and deserializing IP and TCP headers, building
+headers from a template, reassembling fragments, delivering out of order segments in the TransportLayer and parsing HTTP
+responses.
+
+usage: python3 bench/microbench.py [name ...]
+"""
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import eventloop
+import httpcode
+import ip
+import networklayer
+import simnet
+import simserver
+import tcp
+import transportlayer
+import utils
+from checksumbench import measure, mbps
+
+SRC = utils.addrtoint('10.0.0.2')
+DST = utils.addrtoint('10.0.0.1')
+MSS = 1460
+
+
+def fullsegment():
+    """Returns a full-sized TCP segment from the server and the IP packet carrying it, with valid checksums"""
+    seg = tcp.TCP(sport=80, dport=40000, seq=1000, ack=2000, flags='A', window=65535,
+                  data=bytearray(os.urandom(MSS)))
+    ippkt = ip.IP(src=SRC, dst=DST, proto=6, len=20 + 20 + MSS)
+    seg.compute_checksum(ippkt)
+    ippkt.data = seg.serialize()
+    return seg, ippkt
+
+
+def bench_checksum():
+    buf = bytearray(os.urandom(MSS))
+    big = bytearray(os.urandom(65535))
+    return {'us': measure(utils.checksum16, buf) * 1e6,
+            'MBps_1460': mbps(MSS, measure(utils.checksum16, buf)),
+            'MBps_65535': mbps(len(big), measure(utils.checksum16, big))}
+
+
+def bench_serialize():
+    seg, ippkt = fullsegment()
+    return {'tcp_us': measure(tcp.TCP.serialize, seg) * 1e6,
+            'ip_us': measure(ip.IP.serialize, ippkt) * 1e6}
+
+
+def bench_deserialize():
+    _, ippkt = fullsegment()
+    datagram = bytes(ippkt.serialize())
+    segment = memoryview(datagram)[20:]
+
+    def both(buf):
+        tcp.deserialize_tcp(ip.deserialize_ip(buf).data)
+
+    return {'ip_us': measure(ip.deserialize_ip, datagram) * 1e6,
+            'tcp_us': measure(tcp.deserialize_tcp, segment) * 1e6,
+            'packets_per_s': 1 / measure(both, datagram)}
+
+
+def bench_template():
+    template = networklayer.HeaderTemplate(SRC, DST, 80, 40000)
+    data = os.urandom(MSS)
+    state = {'seq': 0}
+
+    def build(_):
+        state['seq'] = (state['seq'] + MSS) & 0xffffffff
+        template.build(1, state['seq'], 2000, tcp.ACK, 65535, None, data)
+
+    return {'us': measure(build, None) * 1e6}
+
+
+def bench_fragments():
+    """Reassembles 64 KiB datagrams from 45 fragments each, arriving in random order"""
+    loop = eventloop.EventLoop()
+    ntwk = networklayer.NetworkLayer(loop=loop)
+    payload = bytearray(os.urandom(65535 - 20))
+    step = 1480
+    rng = random.Random(0)
+    state = {'id': 0}
+
+    frags = []
+    for offset in range(0, len(payload), step):
+        more = 'M' if offset + step < len(payload) else ''
+        part = payload[offset:offset + step]
+        frags.append(ip.IP(src=SRC, dst=DST, proto=6, len=20 + len(part), flags=more, frag=offset // 8, data=part))
+
+    def reassemble(_):
+        state['id'] = (state['id'] + 1) & 0xffff
+        order = frags[:]
+        rng.shuffle(order)
+        for frag in order:
+            frag.idnum = state['id']
+            out = ntwk.handle_fragment(frag)
+        assert out is not None and len(out.data) == len(payload)
+
+    secs = measure(reassemble, None)
+    loop.close()
+    return {'datagram_us': secs * 1e6, 'fragment_us': secs * 1e6 / len(frags), 'MBps': mbps(len(payload), secs)}
+
+
+def bench_outoforder():
+    """
+    Delivers windows of 32 full-sized segments to an established TransportLayer, in batches of 8, with the first
+    segment of each window arriving last, so that every other segment is queued out of order until the hole is filled
+    """
+    loop = simnet.SimLoop()
+    link = simnet.SimLink(loop)
+    simserver.SimServer(link, '10.0.0.2', timestamps=False)
+    ntwk = networklayer.NetworkLayer(loop=loop, link=link)
+    ntwk.connect(('10.0.0.1', 40000), ('10.0.0.2', 80))
+    trans = transportlayer.TransportLayer(ntwk, 40000, 80)
+    trans.send(b'')  # performs the handshake
+
+    template = networklayer.HeaderTemplate(SRC, DST, 80, 40000)
+    data = os.urandom(MSS)
+    window = 32
+
+    def deliver(_):
+        seqs = [(trans.ack + i * MSS) % tcp.SEQMOD for i in range(window)]
+        seqs = seqs[1:] + seqs[:1]
+        for i in range(0, window, 8):
+            batch = []
+            for seq in seqs[i:i + 8]:
+                datagram = template.build(1, seq, trans.seq, tcp.ACK, 65535, None, data) + data
+                batch.append(ip.deserialize_ip(datagram))
+            ntwk.deliver(batch)
+        assert len(trans.recv()) == window * MSS
+        loop.run_until(lambda: False, 0.001)  # lets the link carry our ACKs
+
+    secs = measure(deliver, None)
+    loop.close()
+    return {'segment_us': secs * 1e6 / window, 'MBps': mbps(window * MSS, secs)}
+
+
+def bench_http():
+    """Parses a 1 MiB response with a Content-Length and one with chunked framing, fed in 1460 byte slices"""
+    body = os.urandom(1 << 20)
+    plain = b'HTTP/1.1 200 OK\r\nContent-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body
+    chunked = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+    for i in range(0, len(body), 8192):
+        chunked += '{:x}\r\n'.format(len(body[i:i + 8192])).encode() + body[i:i + 8192] + b'\r\n'
+    chunked += b'0\r\n\r\n'
+
+    def parse(response):
+        parser = httpcode.HTTPResponse()
+        view = memoryview(response)
+        for i in range(0, len(view), MSS):
+            parser.feed(view[i:i + MSS])
+
+    return {'content_length_MBps': mbps(len(body), measure(parse, plain)),
+            'chunked_MBps': mbps(len(body), measure(parse, chunked))}
+
+
+BENCHMARKS = [
+    ('checksum16', bench_checksum),
+    ('serialize', bench_serialize),
+    ('deserialize', bench_deserialize),
+    ('headertemplate', bench_template),
+    ('handle_fragment', bench_fragments),
+    ('outoforder', bench_outoforder),
+    ('httpparse', bench_http),
+]
+
+
+def main():
+    names = sys.argv[1:]
+    for name, func in BENCHMARKS:
+        if names and name not in names:
+            continue
+        metrics = func()
+        print('{:<16} {}'.format(name, '  '.join('{} {:.2f}'.format(k, v) for k, v in metrics.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Runs the microbenchmarks and the transfer benchmarks, and saves their results as JSON so that runs can be compared, for
+example before and after upgrading Python or changing the stack.
+
+usage: python3 bench/suite.py [-o results.json] [-c baseline.json] [-r capture.pcap] [name ...]
+
+-o writes the results to a file, -c prints the change of every metric against an earlier results file, -r replays the
+first connection of a capture (see replay.py) as an additional benchmark named after the file, and names restrict the
+run to the benchmarks and scenarios with those names.
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import microbench
+import replay
+import transferbench
+
+# metrics whose names contain one of these get better as they grow; all others, times, get better as they shrink
+HIGHER = ('MBps', 'per_s', 'Mbps')
+
+
+def gitcommit():
+    """Returns the commit the tree is at, or None if it is not a git checkout"""
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.decode().strip()
+
+
+def run(names=(), captures=()):
+    """
+    Runs the benchmarks and returns their results
+
+    names (list) - names of the benchmarks and scenarios to run. All are run if empty
+    captures (list) - paths of captures to replay
+    """
+    results = {'meta': {'python': platform.python_version(),
+                        'implementation': platform.python_implementation(),
+                        'platform': platform.platform(),
+                        'commit': gitcommit(),
+                        'time': datetime.datetime.now().isoformat(timespec='seconds')},
+               'micro': dict(),
+               'transfer': dict(),
+               'replay': dict()}
+
+    for name, func in microbench.BENCHMARKS:
+        if not names or name in names:
+            results['micro'][name] = func()
+            show(name, results['micro'][name])
+
+    for name, client, linkargs in transferbench.SCENARIOS:
+        if not names or name in names:
+            results['transfer'][name] = transferbench.run(client, linkargs)
+            show(name, results['transfer'][name])
+
+    for path in captures:
+        name = os.path.basename(path)
+        results['replay'][name] = replay.replay(path)
+        show(name, results['replay'][name])
+
+    return results
+
+
+def show(name, metrics):
+    print('{:<16} {}'.format(name, '  '.join('{} {:.2f}'.format(k, v) for k, v in metrics.items())))
+
+
+def change(metric, old, new):
+    """Returns the change from old to new in percent, positive when the metric got better"""
+    if old == 0:
+        return 0.0
+    percent = (new - old) / old * 100
+    return percent if any(word in metric for word in HIGHER) else -percent
+
+
+def compare(base, results):
+    """Prints every metric of results next to its value in base, the results of an earlier run"""
+    print()
+    print('against {} ({}, python {})'.format((base['meta'].get('commit') or 'unknown')[:10], base['meta'].get('time'),
+                                              base['meta'].get('python')))
+    print('{:<16} {:<20} {:>12} {:>12} {:>9}'.format('benchmark', 'metric', 'base', 'now', 'better'))
+    for group in ('micro', 'transfer', 'replay'):
+        for name, metrics in results[group].items():
+            old = base.get(group, dict()).get(name, dict())
+            for metric, value in metrics.items():
+                if metric not in old:
+                    continue
+                print('{:<16} {:<20} {:>12.2f} {:>12.2f} {:>8.1f}%'.format(name, metric, old[metric], value,
+                                                                         change(metric, old[metric], value)))
+
+
+def main():
+    args = sys.argv[1:]
+    outfile = None
+    basefile = None
+    captures = []
+    while len(args) >= 2 and args[0] in ('-o', '-c', '-r'):
+        if args[0] == '-o':
+            outfile = args[1]
+        elif args[0] == '-c':
+            basefile = args[1]
+        else:
+            captures.append(args[1])
+        args = args[2:]
+
+    base = None
+    if basefile is not None:
+        with open(basefile) as f:
+            base = json.load(f)
+
+    results = run(args, captures)
+    if outfile is not None:
+        with open(outfile, 'w') as f:
+            json.dump(results, f, indent=2)
+    if base is not None:
+        compare(base, results)
+
+
+if __name__ == '__main__':
+    main()
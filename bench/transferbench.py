@@ -0,0 +1,133 @@
+"""
+End-to-end transfer benchmarks over a simulated network (simnet.py), which runs the whole stack without root or a
+server: a SimServer serves files from memory over a SimLink, and our client downloads them.
+
+Each scenario reports how fast the Python code runs (MB/s and packets/s of wall clock time, CPU seconds per MB) and how
+well the transfer went on the simulated link (goodput in Mbit/s of virtual time, retransmissions). The wall clock and
+CPU numbers include the simulated server, which takes a share of the time comparable to the client's, so they compare
+runs with each other rather than measuring the client alone.
+
+usage: python3 bench/transferbench.py [name ...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import eventloop
+import httpcode
+import httppool
+import links
+import networklayer
+import rawhttpget
+import simnet
+import simserver
+import transportlayer
+
+SERVER = '10.0.0.2'
+CLIENT = '10.0.0.1'
+SIZE = 8 << 20  # bytes downloaded by the single file scenarios
+
+
+def fetch(loop, link):
+    """Downloads /file with one TransportLayer and returns the length of the body"""
+    ntwk = networklayer.NetworkLayer(loop=loop, link=link)
+    ntwk.connect((CLIENT, 40000), (SERVER, 80))
+    trans = transportlayer.TransportLayer(ntwk, 40000, 80)
+    trans.send(b'GET /file HTTP/1.1\r\nHost: 10.0.0.2\r\n\r\n')
+
+    parser = httpcode.HTTPResponse()
+    received = 0
+    done = False
+    while not done:
+        data = trans.recv()
+        for event, value in parser.feed(data) if data is not None else parser.close():
+            if event == httpcode.Event.BODY:
+                received += len(value)
+            done = done or event == httpcode.Event.END or data is None
+    trans.shutdown()
+    return received
+
+
+def rangeget(loop, link):
+    """Downloads /file with rawhttpget over 4 connections, as the command line tool does"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            rawhttpget.rawhttpget('http://{}/file'.format(SERVER), 4)
+            return os.path.getsize('file')
+        finally:
+            os.chdir(cwd)
+
+
+def pool(loop, link):
+    """Fetches 100 small files over 2 persistent, pipelined connections"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            reqs = httppool.fetchmany(['http://{}/small{}'.format(SERVER, i) for i in range(100)], CLIENT, 2)
+            assert all(req.status == 200 for req in reqs)
+            return sum(os.path.getsize('small{}'.format(i)) for i in range(100))
+        finally:
+            os.chdir(cwd)
+
+
+FILES = {'/file': bytes(SIZE)}
+FILES.update(('/small{}'.format(i), bytes(16 << 10)) for i in range(100))
+
+# name -> (client, link arguments)
+SCENARIOS = [
+    ('clean', fetch, dict()),
+    ('lossy', fetch, dict(loss=0.01)),
+    ('reorder', fetch, dict(reorder=0.02, duplicate=0.01)),
+    ('bottleneck', fetch, dict(bandwidth=20e6, latency=0.04, queue=128 << 10)),
+    ('ranges', rangeget, dict(loss=0.002)),
+    ('pool', pool, dict()),
+]
+
+
+def run(client, linkargs, seed=1):
+    """Runs a scenario and returns its metrics"""
+    loop = simnet.SimLoop()
+    link = simnet.SimLink(loop, seed=seed, **linkargs)
+    server = simserver.SimServer(link, SERVER, FILES)
+
+    # rawhttpget and the pool use the thread's default loop and link
+    oldloop, oldlink = eventloop.getloop(), links.getlink()
+    eventloop.setloop(loop)
+    links.setlink(link)
+    try:
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        received = client(loop, link)
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+    finally:
+        eventloop.setloop(oldloop)
+        links.setlink(oldlink)
+    loop.close()
+
+    packets = link.up.sent + link.down.sent
+    mb = received / 1e6
+    return {'MBps': mb / wall,
+            'packets_per_s': packets / wall,
+            'cpu_s_per_MB': cpu / mb,
+            'goodput_Mbps': received * 8 / loop.time() / 1e6,
+            'virtual_s': loop.time(),
+            'retransmits': server.retransmits}
+
+
+def main():
+    names = sys.argv[1:]
+    for name, client, linkargs in SCENARIOS:
+        if names and name not in names:
+            continue
+        metrics = run(client, linkargs)
+        print('{:<11} {}'.format(name, '  '.join('{} {:.2f}'.format(k, v) for k, v in metrics.items())))
+
+
+if __name__ == '__main__':
+    main()
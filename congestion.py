@@ -0,0 +1,222 @@
+from tcp import seqle
+
+DUPTHRESH = 3  # duplicate ACKs that trigger a fast retransmit
+MAXWINDOW = 1 << 30  # initial ssthresh, i.e. no threshold until the first loss
+
+# CUBIC constants (RFC 8312)
+CUBIC_C = 0.4
+CUBIC_BETA = 0.7
+
+
+def initialwindow(mss):
+    """Returns the initial congestion window in bytes for the given maximum segment size (RFC 5681 3.1)"""
+    return min(4 * mss, max(2 * mss, 4380))
+
+
+class CongestionController:
+    """
+    Interface of the congestion control algorithm of a connection. All windows are in bytes.
+
+    The transport layer calls ack() for every ACK it receives and timeout() when the retransmission timer expires, and
+    never has more than cwnd bytes in flight. Subclasses decide how the window grows (grow()) and how it is reduced on a
+    loss (loss()). Duplicate ACK counting and fast retransmit (RFC 5681) are shared, as is recovery, which follows
+    NewReno (RFC 6582) unless newreno is False.
+    """
+    name = None
+    newreno = True  # whether partial ACKs keep us in fast recovery and retransmit the next hole
+
+    def __init__(self, mss):
+        """
+        mss (int) - maximum segment size we send, in bytes
+        """
+        self.mss = mss
+        self.cwnd = initialwindow(mss)
+        self.ssthresh = MAXWINDOW
+        self.dupacks = 0
+        self.inrecovery = False
+        self.recover = None  # highest sequence number sent when recovery started
+        self.rtt = None  # smoothed round trip time, kept up to date by the transport layer
+
+    def setmss(self, mss):
+        """
+        Changes the segment size once the handshake has told us the server's MSS. The initial window is recomputed if
+        nothing has been acknowledged yet
+        """
+        if self.cwnd == initialwindow(self.mss):
+            self.cwnd = initialwindow(mss)
+        self.mss = mss
+
+    def window(self):
+        """Returns the congestion window in bytes"""
+        return int(self.cwnd)
+
+    def ack(self, acknum, acked, isdup, flight, sndnxt, now):
+        """
+        Updates the window for a received ACK
+
+        acknum (int) - ack field of the segment
+        acked (int) - bytes of new data it acknowledged
+        isdup (bool) - whether it is a duplicate ACK as defined by RFC 5681: nothing new acknowledged, no data, same
+                       window, and data outstanding
+        flight (int) - bytes in flight before this ACK
+        sndnxt (int) - sequence number of the next byte we will send
+        now (float) - current time
+
+        return (bool) - whether the oldest unacknowledged segment must be retransmitted right away
+        """
+        if acked == 0:
+            if not isdup:
+                return False
+
+            self.dupacks += 1
+            if self.inrecovery:
+                # every duplicate ACK means a segment left the network
+                self.cwnd += self.mss
+                return False
+
+            if self.dupacks == DUPTHRESH:
+                self.inrecovery = True
+                self.recover = sndnxt
+                self.loss(flight, now)
+                self.cwnd = self.ssthresh + DUPTHRESH * self.mss
+                return True
+            return False
+
+        self.dupacks = 0
+        if self.inrecovery:
+            if seqle(self.recover, acknum) or not self.newreno:
+                # full acknowledgement: deflate the window (RFC 6582 3.2 step 3)
+                self.inrecovery = False
+                self.cwnd = min(self.ssthresh, max(flight - acked, self.mss) + self.mss)
+                return False
+
+            # partial acknowledgement: the next hole was lost as well
+            self.cwnd = max(self.cwnd - acked + self.mss, self.mss)
+            return True
+
+        self.grow(acked, now)
+        return False
+
+    def timeout(self, flight, now):
+        """
+        Collapses the window after the retransmission timer expired (RFC 5681 3.1)
+
+        flight (int) - bytes in flight
+        """
+        self.loss(flight, now)
+        self.cwnd = self.mss
+        self.dupacks = 0
+        self.inrecovery = False
+
+    def slowstart(self, acked):
+        """Grows the window by at most one segment per ACK (RFC 5681 3.1)"""
+        self.cwnd += min(acked, self.mss)
+
+    def grow(self, acked, now):
+        """Grows the window after new data was acknowledged outside of recovery"""
+        raise NotImplementedError
+
+    def loss(self, flight, now):
+        """Sets ssthresh after a loss was detected"""
+        raise NotImplementedError
+
+
+class Reno(CongestionController):
+    """Reno: slow start, then one segment per window of acknowledged data. Recovery ends at the first new ACK"""
+    name = 'reno'
+    newreno = False
+
+    def __init__(self, mss):
+        super().__init__(mss)
+        self.acked = 0  # bytes acknowledged since the window last grew in congestion avoidance
+
+    def grow(self, acked, now):
+        if self.cwnd < self.ssthresh:
+            self.slowstart(acked)
+            return
+
+        # appropriate byte counting (RFC 3465): one segment once a full window has been acknowledged
+        self.acked += acked
+        if self.acked >= self.cwnd:
+            self.acked -= self.cwnd
+            self.cwnd += self.mss
+
+    def loss(self, flight, now):
+        self.ssthresh = max(flight // 2, 2 * self.mss)
+        self.acked = 0
+
+
+class NewReno(Reno):
+    """NewReno (RFC 6582): Reno whose fast recovery lasts until everything sent before the loss is acknowledged"""
+    name = 'newreno'
+    newreno = True
+
+
+class Cubic(CongestionController):
+    """
+    CUBIC (RFC 8312): after a loss, the window follows a cubic function of the time since the loss, which grows fast
+    far from the window at which the loss happened and slowly close to it. The window never grows slower than Reno's
+    would (TCP-friendly region).
+    """
+    name = 'cubic'
+
+    def __init__(self, mss, fastconvergence=True):
+        super().__init__(mss)
+        self.fastconvergence = fastconvergence
+        self.wmax = 0  # window before the last reduction, in bytes
+        self.epoch = None  # start of the current congestion avoidance epoch
+        self.k = 0  # time in seconds the cubic function takes to reach wmax again
+        self.origin = 0  # window at which the cubic function is centered, in bytes
+        self.west = 0  # window Reno would have, in bytes
+
+    def grow(self, acked, now):
+        if self.cwnd < self.ssthresh:
+            self.slowstart(acked)
+            return
+
+        mss = self.mss
+        if self.epoch is None:
+            self.epoch = now
+            if self.cwnd < self.wmax:
+                self.k = ((self.wmax - self.cwnd) / mss / CUBIC_C) ** (1 / 3)
+                self.origin = self.wmax
+            else:
+                self.k = 0
+                self.origin = self.cwnd
+            self.west = self.cwnd
+
+        rtt = self.rtt if self.rtt is not None else 0
+        t = now - self.epoch + rtt
+        target = self.origin + CUBIC_C * (t - self.k) ** 3 * mss
+
+        # Reno's window for the same ACKs, in the TCP-friendly region
+        self.west += 3 * (1 - CUBIC_BETA) / (1 + CUBIC_BETA) * acked / self.cwnd * mss
+
+        if target > self.cwnd:
+            self.cwnd += (target - self.cwnd) * acked / self.cwnd
+        self.cwnd = max(self.cwnd, self.west)
+
+    def loss(self, flight, now):
+        self.epoch = None
+        if self.cwnd < self.wmax and self.fastconvergence:
+            # release bandwidth to new flows (RFC 8312 4.6)
+            self.wmax = self.cwnd * (1 + CUBIC_BETA) / 2
+        else:
+            self.wmax = self.cwnd
+        self.ssthresh = max(int(self.cwnd * CUBIC_BETA), 2 * self.mss)
+
+
+ALGORITHMS = {cls.name: cls for cls in [Reno, NewReno, Cubic]}
+
+
+def getcontroller(name, mss):
+    """
+    Returns a new congestion controller
+
+    name (str) - 'reno', 'newreno' or 'cubic'
+    mss (int) - maximum segment size
+    """
+    cls = ALGORITHMS.get(name)
+    if cls is None:
+        raise RuntimeError('unknown congestion control algorithm: {}'.format(name))
+    return cls(mss)
@@ -0,0 +1,134 @@
+import struct
+import threading
+
+import eventloop
+import ip
+import links
+
+PORTS = struct.Struct('!HH')  # TCP source and destination ports, at the start of the TCP header
+
+
+class Demux:
+    """
+    Receive socket shared by many connections.
+
+    Every raw IPPROTO_TCP socket receives a copy of every TCP packet arriving at the host, so giving each connection its
+    own socket multiplies the copies made by the kernel and the packets parsed in Python by the number of connections.
+    A demux reads from a single raw socket, parses the IP header of each packet once, peeks at the TCP ports and passes
+    the packet to the network layer registered for its (src, sport, dst, dport) tuple. Packets for other sockets of the
+    host are dropped after a single dict lookup.
+
+    Fragments carry no TCP header, so they are reassembled by a network layer registered for their address pair before
+    the reassembled datagram is dispatched by its ports.
+    """
+
+    def __init__(self, loop=None, sock=None, link=None):
+        """
+        loop (EventLoop) - event loop to register the socket with. Defaults to the event loop of the calling thread
+        sock (socket) - socket to receive from. By default, the link starts receiving when the first connection
+                        registers and stops when the last one unregisters
+        link (RawLink or SimLink) - network the connections use. Defaults to the default link of the calling thread,
+                                    or to the host's network if loop is not the thread's event loop
+        """
+        self.loop = loop if loop is not None else eventloop.getloop()
+        if link is None:
+            link = links.getlink() if self.loop is eventloop.getloop() else links.RawLink(self.loop)
+        self.link = link
+        self.connections = dict()  # maps (src, sport, dst, dport) of received packets -> NetworkLayer
+        self.addrpairs = dict()  # maps (src, dst) -> list of NetworkLayers, used to reassemble fragments
+
+        self.ownsock = sock is None
+        self.listener = None
+        if sock is not None:
+            self.listener = links.RawListener(self.loop, sock, self.dispatch)
+
+    def register(self, ntwk):
+        """
+        Starts delivering the packets of the connection of a network layer to it
+
+        ntwk (NetworkLayer) - network layer whose addresses and ports are set
+        """
+        key = (ntwk.remote_addr, ntwk.remote_port, ntwk.local_addr, ntwk.local_port)
+        if key in self.connections:
+            raise RuntimeError('a connection from port {} to port {} is already registered'.format(ntwk.local_port,
+                                                                                                 ntwk.remote_port))
+
+        if self.listener is None:
+            self.listener = self.link.listen(self.dispatch)
+
+        self.connections[key] = ntwk
+        self.addrpairs.setdefault((ntwk.remote_addr, ntwk.local_addr), []).append(ntwk)
+
+    def unregister(self, ntwk):
+        """Stops delivering packets to the given network layer"""
+        key = (ntwk.remote_addr, ntwk.remote_port, ntwk.local_addr, ntwk.local_port)
+        if self.connections.pop(key, None) is None:
+            return
+
+        pair = (ntwk.remote_addr, ntwk.local_addr)
+        self.addrpairs[pair].remove(ntwk)
+        if not self.addrpairs[pair]:
+            del self.addrpairs[pair]
+
+        if not self.connections and self.ownsock:
+            self.listener.close()
+            self.listener = None
+
+    def __lookup(self, ip_pkt):
+        """Returns the network layer of the connection the given packet belongs to, or None"""
+        if ip_pkt.data is None or len(ip_pkt.data) < PORTS.size:
+            return None
+        sport, dport = PORTS.unpack_from(ip_pkt.data)
+        return self.connections.get((ip_pkt.src, sport, ip_pkt.dst, dport))
+
+    def dispatch(self, datagrams):
+        """
+        Parses the given datagrams and delivers them to their connections, one batch per connection
+
+        datagrams (list) - bytes-like datagrams starting with the IP header
+        """
+        batches = dict()  # maps NetworkLayer -> list of packets, in the order they were received
+
+        for data in datagrams:
+            ip_pkt = ip.deserialize_ip(data)
+
+            # fragments are reassembled before their ports can be looked at
+            if ip_pkt.flags & ip.MF or ip_pkt.frag > 0:
+                owners = self.addrpairs.get((ip_pkt.src, ip_pkt.dst))
+                if owners is None:
+                    continue
+                ip_pkt = owners[0].accept(ip_pkt)
+                if ip_pkt is None:
+                    continue
+                ntwk = self.__lookup(ip_pkt)
+            else:
+                ntwk = self.__lookup(ip_pkt)
+                if ntwk is not None:
+                    ip_pkt = ntwk.accept(ip_pkt)
+
+            if ntwk is None or ip_pkt is None:
+                continue
+
+            batch = batches.get(ntwk)
+            if batch is None:
+                batches[ntwk] = [ip_pkt]
+            else:
+                batch.append(ip_pkt)
+
+        for ntwk, batch in batches.items():
+            ntwk.deliver(batch)
+
+
+local = threading.local()
+
+
+def getdemux():
+    """
+    Returns the default demux of the calling thread, which uses the thread's default event loop and link. A new one is
+    created if those have been changed since
+    """
+    demux = getattr(local, 'demux', None)
+    if demux is None or demux.loop is not eventloop.getloop() or demux.link is not links.getlink():
+        demux = Demux()
+        local.demux = demux
+    return demux
@@ -0,0 +1,143 @@
+import heapq
+import itertools
+import selectors
+import threading
+import time
+
+
+class Timer:
+    """A callback scheduled to run at a given time of the event loop's clock"""
+    __slots__ = ('when', 'callback', 'cancelled')
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        """Prevents the callback from running. Cancelled timers are discarded when they reach the front of the heap"""
+        self.cancelled = True
+
+
+class EventLoop:
+    """
+    Single-threaded event loop that waits for readable sockets with selectors (epoll on Linux) and runs timers with
+    millisecond resolution.
+
+    Every connection driven by one loop makes progress whenever the loop runs, whichever connection the caller is
+    waiting on, so one thread can drive many connections. Loops are not thread-safe; use one loop per thread (see
+    getloop).
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.timers = []  # heap of (when, sequence number, Timer)
+        self.counter = itertools.count()  # breaks ties between timers scheduled for the same time
+
+    def time(self):
+        """Returns the current time of the loop's clock in seconds"""
+        return time.monotonic()
+
+    def call_at(self, when, callback):
+        """
+        Schedules callback() to run at the given time of the loop's clock
+
+        return (Timer) - handle that can be used to cancel the callback
+        """
+        timer = Timer(when, callback)
+        heapq.heappush(self.timers, (when, next(self.counter), timer))
+        return timer
+
+    def call_later(self, delay, callback):
+        """Schedules callback() to run after the given number of seconds"""
+        return self.call_at(self.time() + delay, callback)
+
+    def add_reader(self, fileobj, callback):
+        """Calls callback() whenever fileobj (a socket or file descriptor) is readable"""
+        self.selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fileobj):
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def __next_deadline(self):
+        """Returns the time of the earliest pending timer, or None"""
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        return self.timers[0][0] if self.timers else None
+
+    def _wait(self, timeout):
+        """Waits up to timeout seconds (forever if None) for I/O and returns the callbacks of the ready objects"""
+        if not self.selector.get_map():
+            if timeout is None:
+                raise RuntimeError('event loop has no sockets or timers to wait for')
+            if timeout > 0:
+                time.sleep(timeout)
+            return []
+        return [key.data for key, events in self.selector.select(timeout)]
+
+    def run_once(self, timeout=None):
+        """
+        Waits for I/O until the next timer is due, or at most timeout seconds, then runs the callbacks of ready objects
+        and of due timers
+
+        timeout (float) - longest time to wait in seconds, or None to wait until something happens
+        """
+        deadline = self.__next_deadline()
+        if deadline is not None:
+            wait = max(deadline - self.time(), 0)
+            timeout = wait if timeout is None else min(timeout, wait)
+
+        for callback in self._wait(timeout):
+            callback()
+
+        now = self.time()
+        while self.timers and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)[2]
+            if not timer.cancelled:
+                timer.callback()
+
+    def run_until(self, cond, timeout=None):
+        """
+        Runs the loop until cond() returns a true value
+
+        cond (function) - condition checked before each iteration
+        timeout (float) - maximum number of seconds to run for, or None for no limit
+
+        return - the last value returned by cond(), which is false if the timeout was reached
+        """
+        deadline = None if timeout is None else self.time() + timeout
+        while True:
+            result = cond()
+            if result:
+                return result
+
+            if deadline is None:
+                self.run_once()
+            else:
+                remaining = deadline - self.time()
+                if remaining <= 0:
+                    return result
+                self.run_once(remaining)
+
+    def close(self):
+        self.selector.close()
+
+
+local = threading.local()
+
+
+def getloop():
+    """Returns the default event loop of the calling thread, creating it if necessary"""
+    loop = getattr(local, 'loop', None)
+    if loop is None:
+        loop = EventLoop()
+        local.loop = loop
+    return loop
+
+
+def setloop(loop):
+    """Makes the given loop the default event loop of the calling thread, e.g. a simnet.SimLoop"""
+    local.loop = loop
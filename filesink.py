@@ -0,0 +1,195 @@
+import mmap
+import os
+import queue
+import threading
+
+BUFSIZE = 1 << 20  # bytes collected before they are written to disk
+MAXQUEUED = 64 << 20  # most bytes the background writer may have waiting before write() blocks
+
+
+def pwriteall(fd, buf, offset):
+    """Writes all of buf at the given offset of fd, retrying after partial writes"""
+    view = memoryview(buf)
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+class FileSink:
+    """
+    Binary output file optimized for receiving a download in many small pieces.
+
+    Pieces are copied into a coalescing buffer and written to disk in BUFSIZE blocks. Once the final size is known the
+    file can be preallocated, and optionally mapped into memory so that writes become memory copies. Otherwise full
+    buffers may be handed to a background writer thread, so that the thread receiving from the network never waits for
+    the disk unless more than maxqueued bytes are waiting to be written.
+    """
+
+    def __init__(self, path, background=False, usemmap=False, bufsize=BUFSIZE, maxqueued=MAXQUEUED):
+        """
+        path (str) - file to write to. It is created or truncated
+        background (bool) - whether to write full buffers from a background thread
+        usemmap (bool) - whether to write through a memory map once preallocate() has been called
+        bufsize (int) - size of the coalescing buffer
+        maxqueued (int) - memory bound for the background writer, in bytes
+        """
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)  # mmap needs read access
+        self.usemmap = usemmap
+        self.bufsize = bufsize
+
+        self.buf = bytearray()
+        self.bufoffset = 0  # file offset of the first byte in buf
+        self.offset = 0  # file offset of the next sequential write
+        self.size = None  # preallocated size of the file
+        self.mm = None
+
+        self.writer = None
+        if background:
+            self.writer = BackgroundWriter(self.fd, maxqueued)
+
+    def preallocate(self, size):
+        """
+        Reserves disk space for a file of the given size (e.g. from Content-Length) so that later writes do not have to
+        extend the file, and maps the file if requested
+
+        size (int) - final size of the file in bytes
+        """
+        self.size = size
+        if size == 0:
+            return
+
+        try:
+            os.posix_fallocate(self.fd, 0, size)
+        except (AttributeError, OSError):
+            # not supported by this platform or file system. fall back to setting the size
+            os.ftruncate(self.fd, size)
+
+        if self.usemmap:
+            self.flush()
+            if self.writer is not None:
+                self.writer.wait()
+            self.mm = mmap.mmap(self.fd, size)
+
+    def write(self, data):
+        """
+        Appends data to the file
+
+        data (bytes-like) - bytes to write. They are copied, so the caller may reuse the buffer afterwards
+        """
+        self.pwrite(self.offset, data)
+
+    def pwrite(self, offset, data):
+        """
+        Writes data at the given offset of the file
+
+        offset (int) - file offset
+        data (bytes-like) - bytes to write. They are copied, so the caller may reuse the buffer afterwards
+        """
+        n = len(data)
+        if self.mm is not None and offset + n <= len(self.mm):
+            self.mm[offset:offset + n] = data
+        else:
+            # coalesce writes that continue the current buffer
+            if offset != self.bufoffset + len(self.buf):
+                self.flush()
+                self.bufoffset = offset
+            self.buf += data
+            if len(self.buf) >= self.bufsize:
+                self.flush()
+
+        self.offset = max(self.offset, offset + n)
+
+    def flush(self):
+        """Writes out the coalescing buffer"""
+        if not self.buf:
+            return
+
+        if self.writer is not None:
+            self.writer.put(self.bufoffset, self.buf)
+            self.buf = bytearray()  # the writer owns the old buffer now
+        else:
+            pwriteall(self.fd, self.buf, self.bufoffset)
+            self.buf.clear()
+
+        self.bufoffset = self.offset
+
+    def close(self):
+        """
+        Writes out everything, waits for the background writer and closes the file. If writing failed, the error is
+        raised once the file has been closed
+        """
+        try:
+            self.flush()
+        finally:
+            try:
+                if self.writer is not None:
+                    self.writer.close()
+            finally:
+                if self.mm is not None:
+                    self.mm.close()
+
+                # drop preallocated space that was never written, e.g. if the transfer was cut short
+                try:
+                    if self.size is not None and self.offset < self.size:
+                        os.ftruncate(self.fd, self.offset)
+                finally:
+                    os.close(self.fd)
+
+
+class BackgroundWriter:
+    """Thread that writes (offset, buffer) pairs to a file descriptor, holding at most maxqueued bytes at once"""
+
+    def __init__(self, fd, maxqueued=MAXQUEUED):
+        self.fd = fd
+        self.maxqueued = maxqueued
+        self.queued = 0
+        self.error = None
+
+        self.cond = threading.Condition()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def put(self, offset, buf):
+        """Queues buf to be written at offset. Blocks while more than maxqueued bytes are waiting"""
+        with self.cond:
+            while self.queued > 0 and self.queued + len(buf) > self.maxqueued and self.error is None:
+                self.cond.wait()
+            if self.error is not None:
+                raise self.error
+            self.queued += len(buf)
+
+        self.queue.put((offset, buf))
+
+    def wait(self):
+        """Waits until everything queued so far has been written"""
+        with self.cond:
+            while self.queued > 0 and self.error is None:
+                self.cond.wait()
+            if self.error is not None:
+                raise self.error
+
+    def close(self):
+        """Writes everything that is queued, then stops the thread"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            offset, buf = item
+            try:
+                if self.error is None:
+                    pwriteall(self.fd, buf, offset)
+            except OSError as e:
+                self.error = e
+
+            with self.cond:
+                self.queued -= len(buf)
+                self.cond.notify_all()
@@ -0,0 +1,202 @@
+import threading
+from collections import OrderedDict
+
+import eventloop
+import ip
+
+REASMTIMEOUT = 30  # seconds an incomplete datagram is kept, like Linux's ipfrag_time
+MAXBYTES = 4 << 20  # memory all incomplete datagrams together may use
+MAXDATAGRAM = 65535  # largest IP datagram, header included
+INFINITY = 1 << 16  # end of the hole of a datagram whose last fragment has not arrived yet
+
+
+class Datagram:
+    """An incomplete datagram: the fragments received so far and the holes between them"""
+    __slots__ = ('key', 'created', 'holes', 'buffer', 'total', 'tos', 'ttl')
+
+    def __init__(self, key, created, first):
+        """
+        key (tuple) - (src, dst, proto, id) of the datagram
+        created (float) - time at which its first fragment arrived
+        first (IP) - first fragment received, whose header fields are used for the reassembled datagram
+        """
+        self.key = key
+        self.created = created
+        self.holes = [(0, INFINITY)]  # (first, last) byte offsets of the payload not received yet, inclusive
+        self.buffer = bytearray()  # payload received so far, at its offsets
+        self.total = None  # payload length, known once the last fragment arrived
+        self.tos = first.tos
+        self.ttl = first.ttl
+
+    def add(self, offset, data, last):
+        """
+        Copies a fragment into the holes it fills, following the hole descriptor algorithm of RFC 815. Bytes that were
+        already received are left as they are, so overlapping fragments cannot change data that arrived first
+
+        offset (int) - byte offset of the fragment's payload
+        data (bytes-like) - payload of the fragment
+        last (bool) - whether this is the last fragment, i.e. MF is not set
+
+        return (int) - number of bytes the buffer grew by
+        """
+        first = offset
+        end = offset + len(data) - 1  # last byte of the fragment
+        if last:
+            self.total = end + 1
+
+        grown = 0
+        holes = []
+        for hfirst, hlast in self.holes:
+            if first > hlast or end < hfirst:
+                if not last or hfirst <= end:
+                    holes.append((hfirst, hlast))
+                continue
+
+            # copy the part of the fragment that lies in this hole
+            cfirst = max(first, hfirst)
+            clast = min(end, hlast)
+            if len(self.buffer) <= clast:
+                grown += clast + 1 - len(self.buffer)
+                self.buffer.extend(bytes(clast + 1 - len(self.buffer)))
+            self.buffer[cfirst:clast + 1] = data[cfirst - first:clast + 1 - first]
+
+            if first > hfirst:
+                holes.append((hfirst, first - 1))
+            if end < hlast and not last:
+                holes.append((end + 1, hlast))
+        self.holes = holes
+        return grown
+
+    def complete(self):
+        return self.total is not None and not self.holes
+
+    def fits(self, offset, length):
+        """Returns whether a fragment that is not the last one lies within the payload length, if that is known"""
+        return self.total is None or offset + length <= self.total
+
+    def agrees(self, offset, length):
+        """
+        Returns whether the last fragment agrees with the fragments received so far: it sets the same payload length
+        as an earlier last fragment, and no data was received beyond it
+        """
+        end = offset + length
+        return end == self.total if self.total is not None else end >= len(self.buffer)
+
+
+class Reassembler:
+    """
+    Reassembles fragmented IP datagrams.
+
+    Incomplete datagrams are keyed by (src, dst, proto, id), as RFC 791 requires, so datagrams of different hosts or
+    protocols never mix. Each one keeps the holes in its payload as a list of hole descriptors (RFC 815), so duplicate
+    and overlapping fragments only fill what is missing. Datagrams that are not complete after timeout seconds are
+    dropped by a loop timer, and when the buffers of all incomplete datagrams would exceed maxbytes, the oldest ones
+    are dropped first, so lost fragments never hold on to memory. Fragments that contradict the payload length set by
+    the last fragment are dropped, and a datagram whose length changes is dropped with them.
+    """
+
+    def __init__(self, loop=None, timeout=REASMTIMEOUT, maxbytes=MAXBYTES):
+        """
+        loop (EventLoop) - event loop that runs the expiry timer. Defaults to the event loop of the calling thread
+        timeout (float) - seconds an incomplete datagram is kept
+        maxbytes (int) - most bytes buffered for all incomplete datagrams
+        """
+        self.loop = loop if loop is not None else eventloop.getloop()
+        self.timeout = timeout
+        self.maxbytes = maxbytes
+
+        self.datagrams = OrderedDict()  # maps (src, dst, proto, id) -> Datagram, oldest first
+        self.nbytes = 0  # bytes buffered for incomplete datagrams
+        self.timer = None
+
+        self.reassembled = 0  # datagrams completed
+        self.expired = 0  # datagrams dropped after the timeout
+        self.evicted = 0  # datagrams dropped to stay within maxbytes
+        self.oversized = 0  # fragments dropped because they would end beyond the largest possible datagram
+        self.inconsistent = 0  # fragments dropped because they contradicted the length of their datagram
+
+    def __len__(self):
+        return len(self.datagrams)
+
+    def add(self, ip_pkt):
+        """
+        Handles a received fragment
+
+        ip_pkt (IP) - a packet with MF set or a nonzero fragment offset. Its payload is copied
+
+        return (IP) - the reassembled datagram, or None if fragments are still missing
+        """
+        now = self.loop.time()
+        self.__expire(now)
+
+        offset = ip_pkt.frag * 8
+        data = ip_pkt.data if ip_pkt.data is not None else b''
+        if 20 + offset + len(data) > MAXDATAGRAM:
+            self.oversized += 1
+            return None
+
+        key = (ip_pkt.src, ip_pkt.dst, ip_pkt.proto, ip_pkt.idnum)
+        dgram = self.datagrams.get(key)
+        if dgram is None:
+            dgram = Datagram(key, now, ip_pkt)
+            self.datagrams[key] = dgram
+            self.__arm_timer()
+
+        last = not ip_pkt.flags & ip.MF
+        if not (dgram.agrees(offset, len(data)) if last else dgram.fits(offset, len(data))):
+            self.inconsistent += 1
+            # data past the end is ignored, but a datagram that has two lengths cannot be reassembled correctly
+            if last:
+                self.__drop(dgram)
+            return None
+
+        self.nbytes += dgram.add(offset, data, last)
+
+        if dgram.complete():
+            self.__drop(dgram)
+            self.reassembled += 1
+            src, dst, proto, idnum = key
+            return ip.IP(version=4, ihl=5, tos=dgram.tos, len=20 + dgram.total, id=idnum, flags=0, frag=0,
+                         ttl=dgram.ttl, proto=proto, src=src, dst=dst, data=dgram.buffer)
+
+        # evict the oldest datagrams, possibly this one, until the buffers fit again
+        while self.nbytes > self.maxbytes:
+            self.__drop(next(iter(self.datagrams.values())))
+            self.evicted += 1
+        return None
+
+    def __drop(self, dgram):
+        del self.datagrams[dgram.key]
+        self.nbytes -= len(dgram.buffer)
+
+    def __expire(self, now):
+        """Drops the datagrams that have been incomplete for too long"""
+        while self.datagrams:
+            dgram = next(iter(self.datagrams.values()))
+            if now < dgram.created + self.timeout:
+                return
+            self.__drop(dgram)
+            self.expired += 1
+
+    def __arm_timer(self):
+        if self.timer is not None or not self.datagrams:
+            return
+        oldest = next(iter(self.datagrams.values()))
+        self.timer = self.loop.call_at(oldest.created + self.timeout, self.__on_timer)
+
+    def __on_timer(self):
+        self.timer = None
+        self.__expire(self.loop.time())
+        self.__arm_timer()
+
+
+local = threading.local()
+
+
+def getreassembler():
+    """Returns the reassembler shared by the network layers of the calling thread, which uses its default event loop"""
+    reassembler = getattr(local, 'reassembler', None)
+    if reassembler is None or reassembler.loop is not eventloop.getloop():
+        reassembler = Reassembler()
+        local.reassembler = reassembler
+    return reassembler
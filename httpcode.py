@@ -1,3 +1,4 @@
+import re
 import sys
 from enum import Enum
 
@@ -7,128 +8,254 @@ HTTP_STATUS_CODES = {
 
 
 class ParseState(Enum):
-    RDNEW = 1  # reading a brand new http packet with headers
+    RDNEW = 1  # reading the status line of a brand new http response
     RDSIZE = 2  # reading the size from a chunked body
     RDCHUNK = 3  # reading a chunk from a chunked body
-    RDSTREAM = 4  # reading the entire body as part of a larger message
+    RDSTREAM = 4  # reading a body whose length is given by Content-Length
+    RDHEADERS = 5  # reading header lines
+    RDCHUNKEND = 6  # reading the CRLF that follows a chunk
+    RDTRAILERS = 7  # reading trailer lines after the last chunk
+    RDCLOSE = 8  # reading a body that is delimited by the server closing the connection
+
+
+class Event(Enum):
+    HEADERS = 1  # status line and headers have been parsed. value is the headers dict
+    BODY = 2  # value is a piece of the body, as a memoryview of the data given to feed()
+    END = 3  # the response is complete. value is None
 
 
 TRANSFER_ENCODING = 'Transfer-Encoding'
 CONTENT_TYPE = 'Content-Type'
 CONTENT_LENGTH = 'Content-Length'
 ACCEPT_RANGES = 'Accept-Ranges'
+CONTENT_RANGE = 'Content-Range'
 
+MAXLINE = 65536  # longest status, header or chunk size line we accept
 
-class HTTPResponse:
-    # class variables
-    parsestate = ParseState.RDNEW
-    total_length = 0
-    recvd_length = 0
-
-    # instance variables
-    version = None
-    status = None
-    headers = None
-    body = ''
-    ischunked = False
-    isbytes = False
-
-    debug = False
-
-    def __extractversionstatus(self, line):
-        """Extracts the HTTP version and status code"""
-        spl = line.split(' ')
-        self.version = float(spl[0].split('/')[1])
-        self.status = int(spl[1])
-
-    def extractheaders(self, lines):
-        self.headers = dict()
-        bodystartline = 1
-        bodystartbyte = len(lines[0]) + 2  # +2 for \r\n
-
-        for line in lines[1:]:
-            bodystartline += 1
-            bodystartbyte += len(line) + 2
 
-            if line == '':
-                break
-
-            spl = line.split(': ')
-            self.headers[spl[0]] = spl[1]
+class HTTPResponse:
+    """
+    Incremental parser for HTTP/1.1 responses.
 
-        # handle chunked encoding
-        if TRANSFER_ENCODING in self.headers and self.headers[TRANSFER_ENCODING] == 'chunked':
-            self.ischunked = True
+    Data can be given to feed() in slices of any size, and each call returns the list of (Event, value) pairs it
+    produced. Only the status line, headers and chunk framing are looked at; the body is never decoded or copied, it is
+    returned as views of the data that was fed. Content-Length, chunked (including chunk extensions and trailers) and
+    close-delimited bodies are supported. After an END event the parser expects the next response on the connection.
+    """
 
-        return bodystartline, bodystartbyte
+    def __init__(self, slz=None):
+        """
+        slz (bytes) - if given, it is fed to the parser and the body bytes it contains are stored in self.body
+        """
+        self.parsestate = ParseState.RDNEW
+        self.linebuf = bytearray()  # partial line carried over from the previous call to feed
+
+        self.version = None
+        self.status = None
+        self.headers = None
+        self.trailers = None
+        self.ischunked = False
+        self.isbytes = False  # whether the server accepts byte range requests
+        self.total_length = None  # Content-Length of the body, if given
+        self.recvd_length = 0  # body bytes received so far
+        self.remaining = 0  # bytes left in the current chunk or Content-Length body
+
+        self.body = b''
+        self.debug = False
+
+        if slz is not None:
+            self.body = b''.join([value for event, value in self.feed(slz) if event == Event.BODY])
+
+    def header(self, name, default=None):
+        """Returns the value of the given header, ignoring case"""
+        name = name.lower()
+        for key, value in self.headers.items():
+            if key.lower() == name:
+                return value
+        return default
+
+    def content_range(self):
+        """
+        Returns the byte range of the file contained in a 206 response, as a (first byte, last byte, file size) tuple.
+        The file size is None if the server does not know it. Returns None if there is no valid Content-Range header
+        """
+        value = self.header(CONTENT_RANGE)
+        if value is None or not value.startswith('bytes '):
+            return None
+
+        try:
+            byterange, size = value[6:].split('/', 1)
+            first, last = byterange.split('-', 1)
+            return int(first), int(last), None if size.strip() == '*' else int(size)
+        except ValueError:
+            return None
+
+    def feed(self, data):
+        """
+        Parses the next slice of the response stream
 
-    def __bodyfsm(self, lines):
-        for i in range(len(lines)):
-            if HTTPResponse.parsestate == ParseState.RDSIZE:
-                if int(lines[i], 16) == 0:
-                    # terminating chunk, we're done
-                    HTTPResponse.parsestate = ParseState.RDNEW
-                    return
+        data (bytes-like) - next bytes received from the server
 
-                # otherwise, skip the size, start reading the chunk
-                HTTPResponse.parsestate = ParseState.RDCHUNK
+        return - list of (Event, value) tuples
+        """
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+
+        events = []
+        view = memoryview(data)
+        pos = 0
+        end = len(data)
+
+        while pos < end:
+            state = self.parsestate
+
+            if state == ParseState.RDSTREAM or state == ParseState.RDCHUNK:
+                n = min(self.remaining, end - pos)
+                events.append((Event.BODY, view[pos:pos + n]))
+                pos += n
+                self.remaining -= n
+                self.recvd_length += n
+
+                if self.remaining == 0:
+                    if state == ParseState.RDSTREAM:
+                        self.__finish(events)
+                    else:
+                        self.parsestate = ParseState.RDCHUNKEND
+
+            elif state == ParseState.RDCLOSE:
+                events.append((Event.BODY, view[pos:end]))
+                self.recvd_length += end - pos
+                pos = end
 
-            elif HTTPResponse.parsestate == ParseState.RDCHUNK:
-                self.body += lines[i]
+            else:
+                line, pos = self.__readline(data, pos)
+                if line is None:
+                    break
+                self.__handle_line(line, events)
 
-                # if chunk was followed by a CRLF and isn't the last line in the body, then it's followed by a size
-                # if it is the last line in the body, then there will be another
-                if i != len(lines) - 1:
-                    HTTPResponse.parsestate = ParseState.RDSIZE
+        return events
 
-    def __handle_bytestream(self, slz):
+    def close(self):
         """
-        Handles an HTTP response that is a part of a byte stream split across multiple messages
+        Tells the parser that the server closed the connection
 
-        slz (bytearray) - body of the HTTP response
+        return - list of (Event, value) tuples, i.e. the END of a close-delimited body
         """
-
-        # just write body in raw bytes form.
-        self.body = slz
-        HTTPResponse.recvd_length += len(self.body)
-
-        if HTTPResponse.recvd_length == HTTPResponse.total_length:
-            HTTPResponse.parsestate = ParseState.RDNEW
-            HTTPResponse.total_length = 0
-            HTTPResponse.recvd_length = 0
-            self.isbytes = False
-
-    def __init__(self, slz):
+        events = []
+        if self.parsestate == ParseState.RDCLOSE:
+            self.__finish(events)
+        elif self.parsestate != ParseState.RDNEW or self.linebuf:
+            raise RuntimeError('connection closed in the middle of an HTTP response')
+        return events
+
+    def __readline(self, data, pos):
         """
-        slz (bytes) - HTTP response extracted from a TCP packet
+        Returns the next line in data starting at pos, without its line terminator, and the position after it. If data
+        does not contain the end of the line, it is saved for the next call and (None, len(data)) is returned
         """
-        slzstr = slz.decode('utf-8', 'replace')  # 'replace' allows us to decode bytes 0x80-0xff
-        lines = slzstr.split('\r\n')
-
-        if HTTPResponse.parsestate == ParseState.RDNEW:
-            # extract code from first line
-            self.__extractversionstatus(lines[0])
-
-            # extract headers then the body
-            bodystartline, bodystartbyte = self.extractheaders(lines)
+        idx = data.find(b'\n', pos)
+        if idx < 0:
+            self.linebuf += data[pos:]
+            if len(self.linebuf) > MAXLINE:
+                raise RuntimeError('HTTP line too long')
+            return None, len(data)
+
+        line = data[pos:idx + 1]
+        if self.linebuf:
+            line = bytes(self.linebuf) + line
+            self.linebuf.clear()
+
+        line = line[:-2] if line.endswith(b'\r\n') else line[:-1]
+        # the check above only covers lines still missing their end, so complete lines are checked here
+        if len(line) > MAXLINE:
+            raise RuntimeError('HTTP line too long')
+        return line, idx + 1
+
+    def __handle_line(self, line, events):
+        state = self.parsestate
+
+        if state == ParseState.RDNEW:
+            if line == b'':
+                return  # tolerate blank lines between responses
+            self.__extractversionstatus(line)
+            self.headers = dict()
+            self.trailers = dict()
+            self.parsestate = ParseState.RDHEADERS
+
+        elif state == ParseState.RDHEADERS:
+            if line == b'':
+                self.__startbody(events)
+            else:
+                self.__extractheader(line, self.headers)
+
+        elif state == ParseState.RDSIZE:
+            # chunk extensions follow a semicolon and are ignored. int() alone would also take signs, 0x prefixes and
+            # underscores, and a negative size would make feed() move backwards
+            field = line.split(b';', 1)[0].strip()
+            if not re.fullmatch(rb'[0-9A-Fa-f]+', field):
+                raise RuntimeError('invalid chunk size: {}'.format(line))
+            size = int(field, 16)
+            if size == 0:
+                self.parsestate = ParseState.RDTRAILERS
+            else:
+                self.remaining = size
+                self.parsestate = ParseState.RDCHUNK
 
-            if self.ischunked:
-                HTTPResponse.parsestate = ParseState.RDSIZE
-                self.__bodyfsm(lines[bodystartline:])
+        elif state == ParseState.RDCHUNKEND:
+            if line != b'':
+                raise RuntimeError('chunk not followed by CRLF')
+            self.parsestate = ParseState.RDSIZE
 
-            elif ACCEPT_RANGES in self.headers and self.headers[ACCEPT_RANGES] == 'bytes' and CONTENT_LENGTH in self.headers:
-                self.isbytes = True
-                HTTPResponse.total_length = int(self.headers[CONTENT_LENGTH])
-                HTTPResponse.parsestate = ParseState.RDSTREAM
+        elif state == ParseState.RDTRAILERS:
+            if line == b'':
+                self.__finish(events)
+            else:
+                self.__extractheader(line, self.trailers)
 
-                self.__handle_bytestream(slz[bodystartbyte:])
+    def __extractversionstatus(self, line):
+        """Extracts the HTTP version and status code"""
+        spl = line.decode('latin-1').split(' ')
+        if len(spl) < 2 or not spl[0].startswith('HTTP/'):
+            raise RuntimeError('invalid HTTP status line: {}'.format(line))
+        self.version = float(spl[0].split('/')[1])
+        self.status = int(spl[1])
 
-            else:
-                self.body = slzstr[bodystartbyte:]
-        elif HTTPResponse.parsestate == ParseState.RDSTREAM:
-            self.__handle_bytestream(slz)
+    def __extractheader(self, line, headers):
+        spl = line.decode('latin-1').split(':', 1)
+        if len(spl) != 2:
+            raise RuntimeError('invalid HTTP header line: {}'.format(line))
+        headers[spl[0].strip()] = spl[1].strip()
+
+    def __startbody(self, events):
+        """Determines how the body is delimited once all headers have been read"""
+        events.append((Event.HEADERS, self.headers))
+
+        self.recvd_length = 0
+        self.total_length = None
+        self.ischunked = 'chunked' in self.header(TRANSFER_ENCODING, '').lower()
+        self.isbytes = self.header(ACCEPT_RANGES, '').lower() == 'bytes'
+
+        length = self.header(CONTENT_LENGTH)
+        if length is not None:
+            if not re.fullmatch(r'[0-9]+', length):
+                raise RuntimeError('invalid Content-Length: {}'.format(length))
+            self.total_length = int(length)
+
+        if self.status // 100 == 1 or self.status in [204, 304]:
+            self.__finish(events)
+        elif self.ischunked:
+            self.parsestate = ParseState.RDSIZE
+        elif self.total_length is not None:
+            self.remaining = self.total_length
+            self.parsestate = ParseState.RDSTREAM
+            if self.remaining == 0:
+                self.__finish(events)
         else:
-            self.__bodyfsm(lines)
+            self.parsestate = ParseState.RDCLOSE
+
+    def __finish(self, events):
+        events.append((Event.END, None))
+        self.parsestate = ParseState.RDNEW
 
 
 # Extract body from the server response string
@@ -0,0 +1,322 @@
+import random
+from collections import deque
+
+import demux
+import filesink
+import httpcode
+import networklayer
+import transportlayer
+from utils import spliturl, dnslookup, filenamefromurl
+
+MAXPIPELINE = 16  # most requests sent on a connection before their responses arrive
+SHUTDOWNTIMEOUT = 5  # how long to wait for each server FIN when the pool is closed
+
+
+class Request:
+    """A GET request for one URL, whose response body is written to a file"""
+    __slots__ = ('url', 'domain', 'path', 'outfn', 'sink', 'status', 'done')
+
+    def __init__(self, url, outfn=None):
+        """
+        url (str) - url of the file
+        outfn (str) - file to write the body to. Defaults to the name of the file in the url
+        """
+        self.url = url
+        self.domain, self.path = spliturl(url)
+        if self.path == '':
+            self.path = '/'
+        self.outfn = outfn if outfn is not None else filenamefromurl(url)
+        self.sink = None
+        self.status = None  # HTTP status of the response, once received
+        self.done = False
+
+
+class HTTPConnection:
+    """
+    Persistent HTTP/1.1 connection to one host that pipelines requests.
+
+    Up to maxpipeline requests are sent back to back without waiting for their responses, so that a batch of small
+    objects costs a single round trip instead of one handshake and teardown each. Responses arrive in the order of the
+    requests and are delimited by Content-Length or chunked framing. If the server closes the connection, or announces
+    that it will with Connection: close, the requests it has not answered are handed back to the pool.
+    """
+
+    def __init__(self, pool, domain, remote_addr, sport):
+        self.pool = pool
+        self.domain = domain
+        self.remote_addr = remote_addr
+        self.sport = sport
+
+        self.ntwk = networklayer.NetworkLayer(demux=pool.demux)
+        self.trans = None
+        self.parser = httpcode.HTTPResponse()
+
+        self.pending = deque()  # requests not sent yet
+        self.inflight = deque()  # requests sent and not answered yet, in order
+        self.closing = False  # whether the server will close the connection after the current response
+        self.closed = False  # whether the connection stopped answering requests
+        self.shut = False  # whether the transport has been shut down
+
+    def connect(self):
+        pool = self.pool
+        self.ntwk.connect((pool.local_ip, self.sport), (self.remote_addr, pool.dport))
+        self.trans = transportlayer.TransportLayer(self.ntwk, self.sport, pool.dport, pool.debug)
+        self.trans.onrecv = self.__on_recv
+
+    def idle(self):
+        return not self.pending and not self.inflight
+
+    def outstanding(self):
+        return len(self.pending) + len(self.inflight)
+
+    def submit(self, req, send=True):
+        """
+        Queues a request and sends it as soon as the pipeline has room
+
+        send (bool) - whether to send right away. If False, the request is sent by the next call to pump(), so that
+                      requests submitted together go out in one segment
+        """
+        self.pending.append(req)
+        if send:
+            self.pump()
+
+    def pump(self):
+        """Sends as many pending requests as the pipeline allows, all in one write"""
+        if self.closing or self.closed:
+            return
+
+        getstr = ''
+        while self.pending and len(self.inflight) < self.pool.maxpipeline:
+            req = self.pending.popleft()
+            self.inflight.append(req)
+            getstr += 'GET ' + req.path + ' HTTP/1.1\r\nHost: ' + self.domain + '\r\n\r\n'
+
+        if getstr:
+            self.trans.send(bytearray(getstr, encoding='ascii'))
+
+    def shutdown(self):
+        if self.shut:
+            return
+        self.trans.onrecv = None
+        self.trans.timeout = SHUTDOWNTIMEOUT
+        self.trans.shutdown()
+        self.shut = True
+
+    def __on_recv(self):
+        """Called by the transport layer when data or the server's FIN arrived"""
+        if self.closed:
+            return
+
+        data = self.trans.recv()
+        if data is None:
+            self.closed = True
+            try:
+                events = self.parser.close()
+            except RuntimeError:
+                events = []  # the response was cut short and will be requested again
+        else:
+            events = self.parser.feed(data)
+
+        for event, value in events:
+            if event == httpcode.Event.HEADERS:
+                self.__on_headers()
+            elif event == httpcode.Event.BODY:
+                req = self.inflight[0]
+                if req.sink is not None:
+                    req.sink.write(value)
+            elif event == httpcode.Event.END:
+                self.__on_end()
+                if self.closing:
+                    break  # the server will not answer anything else
+
+        if self.closed or self.closing and self.parser.parsestate == httpcode.ParseState.RDNEW:
+            self.__fail()
+        else:
+            self.pump()
+            if self.idle():
+                self.pool.release(self)
+
+    def __on_headers(self):
+        parser = self.parser
+        req = self.inflight[0]
+        req.status = parser.status
+
+        if parser.header('Connection', '').lower() == 'close' or parser.version < 1.1:
+            self.closing = True
+
+        if parser.status == 200:
+            req.sink = filesink.FileSink(req.outfn)
+            if parser.total_length is not None:
+                req.sink.preallocate(parser.total_length)
+        else:
+            print('Received HTTP status {} for {}'.format(parser.status, req.url))
+
+    def __on_end(self):
+        req = self.inflight.popleft()
+        if req.sink is not None:
+            req.sink.close()
+        req.done = True
+        self.pool.complete(req)
+
+    def __fail(self):
+        """Hands the requests the server will not answer back to the pool"""
+        self.closed = True
+        retry = list(self.inflight) + list(self.pending)
+        self.inflight.clear()
+        self.pending.clear()
+
+        # a response that was cut short is requested again from the start
+        for req in retry:
+            if req.sink is not None:
+                req.sink.close()
+                req.sink = None
+            req.status = None
+
+        self.parser = httpcode.HTTPResponse()
+        self.pool.connection_closed(self, retry)
+
+
+class ConnectionPool:
+    """
+    Keeps persistent connections per host so that many URLs can be fetched without a handshake and teardown each.
+
+    Requests for a host are spread over at most maxconns connections to it. Connections stay open when they become idle
+    and are reused by later fetches until close() is called. All connections share one demux and event loop.
+    """
+
+    def __init__(self, local_ip, dport=80, maxconns=1, maxpipeline=MAXPIPELINE, debug=False):
+        """
+        local_ip (str) - local IP address to send from
+        dport (int) - port of the servers
+        maxconns (int) - most connections to one host
+        maxpipeline (int) - most requests in flight on one connection
+        """
+        self.local_ip = local_ip
+        self.dport = dport
+        self.maxconns = maxconns
+        self.maxpipeline = maxpipeline
+        self.debug = debug
+
+        self.demux = demux.getdemux()
+        self.loop = self.demux.loop
+        self.addrs = dict()  # maps domain -> IP address
+        self.conns = dict()  # maps domain -> list of open HTTPConnections
+        self.closedconns = []  # connections that stopped answering and still have to be shut down
+        self.idleconns = dict()  # maps domain -> list of open HTTPConnections with nothing to do
+        self.ports = set()  # source ports in use
+        self.remaining = 0  # submitted requests that are not done yet
+
+    def submit(self, req, send=True):
+        """
+        Sends a request over a connection to its host, opening one if needed
+
+        return (HTTPConnection) - connection the request was given to
+        """
+        self.remaining += 1
+        return self.__dispatch(req, send)
+
+    def __dispatch(self, req, send=True):
+        idle = self.idleconns.get(req.domain)
+        if idle:
+            conn = idle.pop()
+        else:
+            conns = self.conns.setdefault(req.domain, [])
+            if len(conns) < self.maxconns:
+                conn = self.__open(req.domain)
+            else:
+                conn = min(conns, key=HTTPConnection.outstanding)
+        conn.submit(req, send)
+        return conn
+
+    def __open(self, domain):
+        addr = self.addrs.get(domain)
+        if addr is None:
+            addr = dnslookup('http://' + domain)
+            self.addrs[domain] = addr
+
+        sport = random.randint(1024, 65535)
+        while sport in self.ports:
+            sport = random.randint(1024, 65535)
+        self.ports.add(sport)
+
+        conn = HTTPConnection(self, domain, addr, sport)
+        self.conns.setdefault(domain, []).append(conn)
+        conn.connect()
+        return conn
+
+    def release(self, conn):
+        """Called by a connection that has answered all its requests"""
+        idle = self.idleconns.setdefault(conn.domain, [])
+        if conn not in idle:
+            idle.append(conn)
+
+    def complete(self, req):
+        """Called by a connection when a response is complete"""
+        self.remaining -= 1
+
+    def connection_closed(self, conn, retry):
+        """
+        Called by a connection the server closed, with the requests it did not answer
+
+        retry (list) - requests to send again over another connection
+        """
+        self.__forget(conn)
+        self.closedconns.append(conn)
+
+        # the retry is deferred to a timer that fires right away, because opening a connection waits for its handshake
+        # in a nested run of the event loop, which must not start from within this connection's receive callback
+        if retry:
+            self.loop.call_later(0, lambda: self.__dispatchall(retry))
+
+    def __dispatchall(self, reqs):
+        """Gives each request to a connection, then sends the requests of each connection together"""
+        conns = []
+        for req in reqs:
+            conn = self.__dispatch(req, send=False)
+            if conn not in conns:
+                conns.append(conn)
+        for conn in conns:
+            conn.pump()
+
+    def __forget(self, conn):
+        self.conns[conn.domain].remove(conn)
+        idle = self.idleconns.get(conn.domain)
+        if idle and conn in idle:
+            idle.remove(conn)
+
+    def fetch(self, urls):
+        """
+        Downloads every url to its file and returns the list of requests once all responses have arrived
+
+        urls (list) - urls to fetch. Urls on the same host share its connections
+        """
+        reqs = [Request(url) for url in urls]
+        self.remaining += len(reqs)
+        self.__dispatchall(reqs)
+
+        self.loop.run_until(lambda: self.remaining == 0)
+        return reqs
+
+    def close(self):
+        """Shuts down every connection"""
+        for conns in list(self.conns.values()):
+            for conn in list(conns):
+                self.__forget(conn)
+                self.closedconns.append(conn)
+
+        for conn in self.closedconns:
+            conn.shutdown()
+            self.ports.discard(conn.sport)
+        self.closedconns = []
+
+
+def fetchmany(urls, local_ip, maxconns=1, debug=False):
+    """
+    Downloads a list of urls over persistent, pipelined connections
+
+    return (list) - the Request of each url, whose status is the HTTP status of its response
+    """
+    pool = ConnectionPool(local_ip, maxconns=maxconns, debug=debug)
+    reqs = pool.fetch(urls)
+    pool.close()
+    return reqs
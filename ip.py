@@ -1,3 +1,5 @@
+import struct
+
 import tcp
 import utils
 
@@ -27,19 +29,54 @@ Flags:
 DF = 0x4000
 MF = 0x2000
 
+# string form of the 3 flag bits of an IP header, indexed by their value
+FLAGSTRS = ['', 'M', 'D', 'DM', '', 'M', 'D', 'DM']
+
+# version/ihl, (tos skipped), total length, id, flags/fragment offset, ttl, protocol, checksum, source, destination
+IPHDR = struct.Struct('!BxHHHBBHII')
+
+LAZY = object()  # placeholder for header fields that are decoded from the raw buffer on first access
+
+
+def parseflags(flags):
+    """
+    Converts IP flags given as a string (any combination of 'D' and 'M') into the bitmask used by the IP class.
+    Bitmasks are returned unchanged
+    """
+    if isinstance(flags, int):
+        if flags & ~(DF | MF) != 0:
+            raise RuntimeError('invalid IP flags field provided: {}'.format(hex(flags)))
+        return flags
+
+    if flags not in ['', 'D', 'M', 'DM', 'MD']:
+        raise RuntimeError('invalid IP flags field provided: {}'.format(flags))
+
+    out = 0
+    if 'D' in flags:
+        out |= DF
+    if 'M' in flags:
+        out |= MF
+    return out
+
 
 def deserialize_ip(slz):
     """
-    Deserializes an IP object from the given bytearray, or throws an exception if serialization failed
+    Deserializes an IP object from the given bytes-like object, or throws an exception if serialization failed
 
     At present, deserialization only supports IPv4 and only allows the underlying protocol to be TCP.
+
+    No header fields are copied out of slz: the fixed fields are decoded with a single struct call, tos and options are
+    only decoded when first read, and the payload is exposed as a memoryview of slz. slz must therefore not be modified
+    while the returned packet is in use.
     """
-    if len(slz) < 20:
-        raise RuntimeError('IP buffer length too small: {}'.format(len(slz)))
+    buf = memoryview(slz)
+    if len(buf) < 20:
+        raise RuntimeError('IP buffer length too small: {}'.format(len(buf)))
 
-    pkt = IP()
+    version_ihl, totlen, idnum, flags_fragoffset, ttl, proto, chksum, src, dst = IPHDR.unpack_from(buf)
 
-    version_ihl = slz[0]
+    pkt = IP.__new__(IP)  # skip __init__, which would compute a checksum we are about to overwrite
+    pkt.raw = buf
 
     pkt.version = version_ihl >> 4
     if pkt.version != 4:
@@ -49,65 +86,94 @@ def deserialize_ip(slz):
     if pkt.ihl < 5:
         raise RuntimeError('IP header length too small: {}'.format(pkt.ihl))
 
-    pkt.tos = slz[1]
-
-    pkt.len = utils.deserializeint(slz[2:4])
-    if pkt.len != len(slz):
-        raise RuntimeError('IP total length does not match buffer size: {} vs {}'.format(pkt.tos, len(slz)))
-
-    pkt.idnum = utils.deserializeint(slz[4:6])
-    flags_fragoffset = utils.deserializeint(slz[6:8])
-
-    if flags_fragoffset & DF != 0:
-        pkt.flags += 'D'
-
-    if flags_fragoffset & MF != 0:
-        pkt.flags += 'M'
+    pkt.len = totlen
+    if pkt.len != len(buf):
+        raise RuntimeError('IP total length does not match buffer size: {} vs {}'.format(pkt.len, len(buf)))
 
+    pkt.idnum = idnum
+    pkt.flags = flags_fragoffset & (DF | MF)
     pkt.frag = flags_fragoffset & 0x1FFF
 
-    pkt.ttl = slz[8]
-    pkt.proto = slz[9]
+    pkt.ttl = ttl
+    pkt.proto = proto
     if pkt.proto not in [0, 6]:
-        raise RuntimeError('IP underlying protocol not supported: {}'.format(pkt.tos))
+        raise RuntimeError('IP underlying protocol not supported: {}'.format(pkt.proto))
 
-    pkt.chksum = utils.deserializeint(slz[10:12])
-    pkt.src = utils.bytearraytoaddr(slz[12:16])
-    pkt.dst = utils.bytearraytoaddr(slz[16:20])
+    pkt.chksum = chksum
+    pkt.src = src
+    pkt.dst = dst
 
-    if pkt.ihl > 5:
-        pkt.options = slz[20:pkt.ihl*4]
+    pkt._tos = LAZY
+    pkt._options = LAZY if pkt.ihl > 5 else None
 
-    if pkt.ihl*4 != len(slz):
-        pkt.data = slz[pkt.ihl*4:len(slz)]
+    hdrlen = pkt.ihl*4
+    if hdrlen > len(buf):
+        raise RuntimeError('IP header length larger than buffer: {}'.format(hdrlen))
+    pkt.data = buf[hdrlen:] if hdrlen != len(buf) else None
 
     return pkt
 
 
 class IP:
-    """Serializer and deserializer class for IP datagrams"""
+    """
+    Serializer and deserializer class for IP datagrams
+
+    Flags are stored as a bitmask of DF and MF, and addresses as 32-bit integers. Both may be given to the constructor
+    in their string forms ('DM', '127.0.0.1') for convenience.
+    """
+    __slots__ = ('version', 'ihl', '_tos', 'len', 'idnum', 'flags', 'frag', 'chksum', 'ttl', 'proto', 'src', 'dst',
+                 '_options', 'data', 'raw')
 
     def __init__(self, version=4, ihl=5, tos=0x0, len=20,
-                 id=1, flags='', frag=0, ttl=64, proto=0,
+                 id=1, flags=0, frag=0, ttl=64, proto=0,
                  src='127.0.0.1', dst='127.0.0.1',
                  options=None, data=None):
-        self.__checkflags(flags)
-
         self.version = version
         self.ihl = ihl
         self.tos = tos
         self.len = len
         self.idnum = id
-        self.flags = flags
+        self.flags = parseflags(flags)
         self.frag = frag
         self.chksum = 0x0000
         self.ttl = ttl
         self.proto = proto
-        self.src = src
-        self.dst = dst
+        self.src = utils.addrtoint(src) if isinstance(src, str) else src
+        self.dst = utils.addrtoint(dst) if isinstance(dst, str) else dst
         self.options = options
         self.data = data
+        self.raw = None  # buffer this packet was deserialized from, if any
+        self.compute_checksum()
+
+    @property
+    def tos(self):
+        if self._tos is LAZY:
+            self._tos = self.raw[1]
+        return self._tos
+
+    @tos.setter
+    def tos(self, value):
+        self._tos = value
+
+    @property
+    def options(self):
+        if self._options is LAZY:
+            self._options = self.raw[20:self.ihl*4]
+        return self._options
+
+    @options.setter
+    def options(self, value):
+        self._options = value
+
+    def valid_checksum(self):
+        """Returns whether the checksum of this packet is correct"""
+        if self.raw is not None:
+            # summing a header that includes its own valid checksum yields 0xffff, whose complement is 0
+            return utils.checksum16(self.raw[0:self.ihl*4]) == 0
+
+        given_checksum = self.chksum
         self.compute_checksum()
+        return given_checksum == self.chksum
 
     def show(self):
         print('###[ IP ]###')
@@ -116,21 +182,17 @@ class IP:
         print(' tos = {}'.format(self.tos))
         print(' len = {}'.format(self.len))
         print(' id = {}'.format(self.idnum))
-        print(' flags = {}'.format(self.flags))
+        print(' flags = {}'.format(FLAGSTRS[self.flags >> 13]))
         print(' frag = {}'.format(self.frag))
         print(' ttl = {}'.format(self.ttl))
         print(' proto = {}'.format(self.proto))
         print(' chksum = {}'.format(self.chksum))
-        print(' src = {}'.format(self.src))
-        print(' dst = {}'.format(self.dst))
+        print(' src = {}'.format(utils.inttoaddr(self.src)))
+        print(' dst = {}'.format(utils.inttoaddr(self.dst)))
 
         if isinstance(self.data, tcp.TCP):
             self.data.show()
 
-    def __checkflags(self, flags):
-        if flags not in ['', 'D', 'M', 'DM']:
-            raise RuntimeError('invalid IP flags field provided: {}'.format(flags))
-            
     def compute_checksum(self):
         datagram = self.serialize()[0:self.ihl*4]
         # zero out checksum before computing
@@ -144,17 +206,7 @@ class IP:
         slz = bytearray()
 
         version_ihl = (self.version << 4) | self.ihl
-
-        flags_fragoffset = self.frag
-        self.__checkflags(self.flags)
-        for c in range(0, len(self.flags)):
-            if self.flags[c] == 'D':
-                flags_fragoffset |= DF
-            elif self.flags[c] == 'M':
-                flags_fragoffset |= MF
-
-        src_bytes = utils.addrtobytearray(self.src)
-        dst_bytes = utils.addrtobytearray(self.dst)
+        flags_fragoffset = self.frag | parseflags(self.flags)
 
         # append all header values to the bytearray
         slz.append(version_ihl)
@@ -165,8 +217,8 @@ class IP:
         slz.append(self.ttl)
         slz.append(self.proto)
         slz.extend(utils.serialize16(self.chksum))
-        slz.extend(src_bytes)
-        slz.extend(dst_bytes)
+        slz.extend(utils.serialize32(self.src))
+        slz.extend(utils.serialize32(self.dst))
 
         # append options and data if necessary
         if self.options is not None:
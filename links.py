@@ -0,0 +1,116 @@
+import socket
+import threading
+
+import eventloop
+import pmtu
+import recvbatch
+import utils
+
+
+class RawListener:
+    """
+    Reads the datagrams arriving at a non-blocking socket in batches and passes each batch to a callback, while the
+    socket's event loop runs
+    """
+
+    def __init__(self, loop, sock, callback, size=recvbatch.BUFSIZE):
+        """
+        loop (EventLoop) - event loop to register the socket with
+        sock (socket) - socket to read from. It is closed by close()
+        callback (function) - called with each list of received datagrams. They are views of the receive buffers and
+                              are only valid during the call
+        size (int) - largest datagram that can be received
+        """
+        self.loop = loop
+        self.sock = sock
+        self.callback = callback
+        self.sock.setblocking(False)
+        self.receiver = recvbatch.BatchReceiver(self.sock, size=size)
+        self.loop.add_reader(self.sock, self.__on_readable)
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.loop.remove_reader(self.sock)
+        self.sock.close()
+        self.sock = None
+        self.receiver = None
+
+    def __on_readable(self):
+        while self.sock is not None:
+            datagrams = self.receiver.drain()
+            if not datagrams:
+                return
+
+            self.callback(datagrams)
+
+            # a short batch means the socket has been drained
+            if self.receiver is not None and len(datagrams) < self.receiver.count:
+                return
+
+
+class RawLink:
+    """
+    The host's network, reached through raw sockets, which requires root.
+
+    A link is what a NetworkLayer sends its datagrams through and receives them from. connect() returns a socket-like
+    object that datagrams starting with the IP header are sent to, and listen() delivers the TCP datagrams arriving at
+    the host to a callback. The path MTUs of the link's destinations are kept in paths. simnet.SimLink is a link that
+    runs in memory instead.
+    """
+
+    def __init__(self, loop=None):
+        """
+        loop (EventLoop) - event loop that receive sockets are registered with. Defaults to the event loop of the
+                           calling thread
+        """
+        self.loop = loop if loop is not None else eventloop.getloop()
+        self.paths = pmtu.getpathcache()  # the kernel's routes are shared by the whole process
+
+    def connect(self, remoteaddrpair):
+        """
+        Returns a socket that sends datagrams, IP header included, to the given remote IP address
+
+        remoteaddrpair - 2-tuple with format (ip_address as a string, port as an int)
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
+        sock.connect(remoteaddrpair)
+        return sock
+
+    def listen(self, callback, localaddrpair=None, size=recvbatch.BUFSIZE):
+        """
+        Starts passing the TCP datagrams arriving at the host to callback, in batches
+
+        callback (function) - called with each list of received datagrams, which are only valid during the call
+        localaddrpair - 2-tuple with format (ip_address as a string, port as an int). If given, only datagrams sent to
+                        that address are received
+        size (int) - largest datagram that can be received
+
+        return (RawListener) - stops receiving when closed
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
+        if localaddrpair is not None:
+            sock.bind(localaddrpair)
+        return RawListener(self.loop, sock, callback, size)
+
+    def getmtu(self, addr):
+        """Returns the MTU of the route to the given IP address (given as a dot-separated string)"""
+        return utils.getmtu(addr)
+
+
+local = threading.local()
+
+
+def getlink():
+    """Returns the default link of the calling thread, which is the host's network unless setlink() was called"""
+    link = getattr(local, 'link', None)
+    # the host's network is reached through the thread's current event loop
+    if link is None or isinstance(link, RawLink) and link.loop is not eventloop.getloop():
+        link = RawLink()
+        local.link = link
+    return link
+
+
+def setlink(link):
+    """Makes the given link the default link of the calling thread, e.g. a simulated network"""
+    local.link = link
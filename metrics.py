@@ -0,0 +1,48 @@
+class Counters:
+    """
+    Set of counters that start at 0.
+
+    Counters are plain slotted attributes, so counting an event costs one attribute increment and can stay enabled on
+    the per-packet paths, unlike debug output. snapshot() copies them into a dict that can be serialized as JSON and
+    aggregated across connections.
+    """
+    __slots__ = ()
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def snapshot(self):
+        """Returns a dict mapping the name of each counter -> its value"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class NetworkMetrics(Counters):
+    """Counters of a NetworkLayer"""
+    __slots__ = ('datagrams_out',  # datagrams sent, each fragment counted once
+                 'bytes_out',  # bytes of the datagrams sent, including headers
+                 'datagrams_in',  # datagrams received from the remote server, each fragment counted once
+                 'bytes_in',
+                 'foreign',  # datagrams received for other addresses, e.g. other connections of the host
+                 'badchecksum',  # datagrams from the remote server dropped because of their IP header checksum
+                 'fragments_in',  # fragments received
+                 'reassembled')  # datagrams reassembled from those fragments
+
+
+class TransportMetrics(Counters):
+    """Counters of a TransportLayer"""
+    __slots__ = ('segments_out',  # segments sent, including retransmissions and pure ACKs
+                 'bytes_out',  # payload bytes sent, including retransmissions
+                 'acks_out',  # pure ACKs sent
+                 'segments_in',  # segments received for the connection
+                 'bytes_in',  # payload bytes received, including duplicates
+                 'retransmits',  # segments sent again, after a timeout or by fast retransmit
+                 'fastretransmits',
+                 'timeouts',  # expirations of the retransmission timer
+                 'dupacks',  # duplicate ACKs received
+                 'duplicates',  # segments whose payload had already been received in full
+                 'outofwindow',  # segments whose payload started beyond the window we advertised
+                 'outoforder',  # segments that arrived ahead of a hole
+                 'ooomax',  # most bytes queued out of order at once
+                 'paws',  # segments dropped as old duplicates by their timestamp
+                 'badsegments')  # segments dropped for the wrong protocol, ports or malformed options
@@ -1,29 +1,170 @@
+import errno
 import socket
+import struct
 import sys
-import time
+from collections import deque
 
+import eventloop
+import fragment
 import ip
-import io
+import links
+import metrics
+import pkttrace
+import utils
 
+# a 20 byte IP header followed by a 20 byte TCP header
+IPTCPHDR = struct.Struct('!BBHHHBBHIIHHIIHHHH')
+IPVARFIELDS = struct.Struct('!HH')  # IP total length and id, at offset 2
+TCPVARFIELDS = struct.Struct('!IIHHH')  # TCP seq, ack, data offset/flags, window and checksum, at offset 24
+IPFRAGFIELDS = struct.Struct('!HHHBBH')  # IP total length, id, flags/fragment offset, ttl, protocol and checksum
+IP_MTU = getattr(socket, 'IP_MTU', 14)  # socket option with the MTU of a connected socket's route (Linux)
 
-class NetworkLayer:
-    """Handles all functionality of the network layer and implements IP"""
-    # send and receive sockets
-    ssock = None
-    rsock = None
 
-    local_addr = None
-    remote_addr = None
+class HeaderTemplate:
+    """
+    Pre-serialized IP and TCP headers for one connection, i.e. one (src, sport, dst, dport) tuple.
 
-    connected = False  # whether the raw sockets have been created and bound/connected
-    firstrecv = True  # whether this is the first call to recv since we last received a packet
-    recvstarttime = None
+    Everything that is constant for the connection (version, ttl, protocol, addresses, ports) is serialized once, and
+    its one's complement sum is computed once for both the IP header checksum and the TCP pseudo-header checksum.
+    Building the headers of a segment then only packs the fields that change and adds them to the stored sums.
+    """
+
+    def __init__(self, src, dst, sport, dport, ttl=64, df=False):
+        """
+        src (int) - local IP address
+        dst (int) - remote IP address
+        sport (int) - local port
+        dport (int) - remote port
+        ttl (int) - time to live of all datagrams
+        df (bool) - whether to set the Don't Fragment flag
+        """
+        self.hdr = bytearray(IPTCPHDR.size)
+        IPTCPHDR.pack_into(self.hdr, 0,
+                           0x45, 0, 0, 0, ip.DF if df else 0, ttl, socket.IPPROTO_TCP, 0, src, dst,
+                           sport, dport, 0, 0, 0, 0, 0, 0)
+
+        # sum of the constant IP header fields (len, id and checksum are still 0, flags and offset are constant)
+        self.ipsum = utils.onessum16(self.hdr[0:20])
+
+        # sum of the pseudo-header without the TCP length, plus both ports
+        self.tcpsum = utils.onessum16(self.hdr[12:20], socket.IPPROTO_TCP)
+        self.tcpsum = utils.onessum16(self.hdr[20:24], self.tcpsum)
+
+    def build(self, idnum, seq, ack, flags, window, options=None, data=None):
+        """
+        Returns a bytearray with the IP and TCP headers (including TCP options) of a segment with the given fields.
+        Both checksums are filled in. The payload is not copied into the returned buffer.
+
+        idnum (int) - IP identification field
+        seq (int) - TCP sequence number
+        ack (int) - TCP acknowledgement number
+        flags (int) - TCP flags bitmask
+        window (int) - TCP window
+        options (bytes-like) - TCP options, padded to a multiple of 4 bytes, or None
+        data (bytes-like) - TCP payload, or None
+        """
+        optlen = len(options) if options is not None else 0
+        tcplen = 20 + optlen + (len(data) if data is not None else 0)
+
+        if optlen:
+            hdr = self.hdr + options
+        else:
+            hdr = self.hdr[:]
+
+        # IP header
+        ipsum = self.ipsum + 20 + tcplen + idnum
+        ipsum = (ipsum & 0xffff) + (ipsum >> 16)
+        ipsum = (ipsum & 0xffff) + (ipsum >> 16)
+        IPVARFIELDS.pack_into(hdr, 2, 20 + tcplen, idnum)
+        hdr[10:12] = (~ipsum & 0xffff).to_bytes(2, byteorder='big')
+
+        # TCP header
+        offset_flags = ((20 + optlen) << 10) | flags  # data offset in 32-bit words, shifted to the top 4 bits
+        tcpsum = self.tcpsum + tcplen + (seq >> 16) + (seq & 0xffff) + (ack >> 16) + (ack & 0xffff) + offset_flags + \
+            window
+        if optlen:
+            tcpsum += utils.onessum16(options)
+        if data is not None:
+            tcpsum += utils.onessum16(data)
+        tcpsum = (tcpsum & 0xffff) + (tcpsum >> 16)
+        tcpsum = (tcpsum & 0xffff) + (tcpsum >> 16)
+
+        TCPVARFIELDS.pack_into(hdr, 24, seq, ack, offset_flags, window, ~tcpsum & 0xffff)
+        return hdr
+
+
+class NetworkLayer:
+    """
+    Handles all functionality of the network layer and implements IP
+
+    Datagrams are sent and received through a link: the raw sockets of the host by default (links.RawLink), or e.g. a
+    simulated network (simnet.SimLink). The link passes received datagrams in batches, which are validated and
+    reassembled, and each batch of IP packets is passed to the onpackets callback, or queued for recv() if no callback
+    is set. Packets passed to onpackets are views of the receive buffers and are only valid during the call.
+
+    Alternatively, many network layers can share the receive socket of a demux.Demux, which parses each packet once and
+    passes it to the network layer of its connection.
+
+    Datagrams are sent with DF set, so that routers report a smaller MTU on the path instead of fragmenting them, and
+    the path MTU of each destination is kept in the path cache of the process (path MTU discovery, RFC 1191). The
+    transport layer sizes its segments from it. A datagram that is larger than the path MTU anyway, e.g. because it
+    was first sent before the path MTU dropped, is fragmented, as is every oversized datagram if df is turned off.
+
+    If capture is set, every datagram sent to or received from the remote server, including fragments and datagrams
+    that turn out to be invalid, is recorded to it, so that a transfer can be looked at and replayed later (replay.py).
+    What happened to the datagrams is counted in metrics, see snapshot().
+    """
+    ssock = None  # socket-like object of the link that datagrams are sent to
+    listener = None  # receives the datagrams of the link, unless a demux does
+
+    local_addr = None  # local IP address as a 32-bit int
+    remote_addr = None  # remote IP address as a 32-bit int
+    local_port = None
+    remote_port = None
 
-    fraginfo = dict()  # maps packet id -> info needed to manage fragmentation
+    connected = False  # whether the raw sockets have been created and bound/connected
+    lastrecv = None  # time at which we last received a packet from the remote server
+    idletimer = None
 
     MSS = 65535
     timeout = 180
 
+    df = True  # whether datagrams are sent with Don't Fragment set, for path MTU discovery
+    idnum = 0  # IP identification of the last datagram sent
+
+    capture = None  # pcap.PcapWriter recording the datagrams of every network layer, unless one is given to __init__
+
+    def __init__(self, loop=None, demux=None, link=None, capture=None):
+        """
+        loop (EventLoop) - event loop that drives this layer. Defaults to the event loop of the calling thread, or to the
+                           loop of demux
+        demux (Demux) - shared receive socket to register with instead of opening a receive socket of our own
+        link (RawLink or SimLink) - network to send through and receive from. Defaults to the link of demux, or to the
+                                    default link of the calling thread
+        capture (PcapWriter) - records the datagrams sent and received. Defaults to NetworkLayer.capture
+        """
+        if loop is None:
+            loop = demux.loop if demux is not None else eventloop.getloop()
+        if link is None:
+            if demux is not None:
+                link = demux.link
+            else:
+                link = links.getlink() if loop is eventloop.getloop() else links.RawLink(loop)
+        self.loop = loop
+        self.demux = demux
+        self.link = link
+        if capture is not None:
+            self.capture = capture
+        # fragments of every connection on the thread's loop share one reassembler, and with it its memory cap
+        self.reassembler = fragment.getreassembler() if loop is eventloop.getloop() else fragment.Reassembler(loop)
+        self.templates = dict()  # maps (sport, dport) -> HeaderTemplate
+        self.paths = link.paths  # path MTUs and IP ids per destination
+        self.fragments = 0  # fragments sent
+        self.metrics = metrics.NetworkMetrics()
+        self.trace = pkttrace.gettrace()
+        self.inbox = deque()  # received packets waiting for recv(), if onpackets is not set
+        self.onpackets = None  # function called with each list of received IP packets
+
     def connect(self, localaddrpair, remoteaddrpair):
         """
         Binds to the given local IP address and port and connects to the given remote IP address and port
@@ -31,171 +172,234 @@ class NetworkLayer:
         localaddrpair - 2-tuple with format (ip_address as a string, port as an int)
         remoteaddrpair - same as localaddrpair
         """
-        self.ssock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
-        self.ssock.connect(remoteaddrpair)
+        self.ssock = self.link.connect(remoteaddrpair)
+
+        self.local_addr = utils.addrtoint(localaddrpair[0])
+        self.remote_addr = utils.addrtoint(remoteaddrpair[0])
+        self.local_port = localaddrpair[1]
+        self.remote_port = remoteaddrpair[1]
 
-        self.rsock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
-        self.rsock.bind(localaddrpair)
-        self.rsock.settimeout(self.timeout)
+        if self.demux is not None:
+            self.demux.register(self)
+        else:
+            self.listener = self.link.listen(self.__on_datagrams, localaddrpair, size=self.MSS)
 
-        self.local_addr = localaddrpair[0]
-        self.remote_addr = remoteaddrpair[0]
+        # This enables the 3 minute timeout. Rather than moving a timer on every packet, the timer checks when it fires
+        # whether a packet arrived in the meantime and if so, re-arms itself for the remaining time.
+        self.lastrecv = self.loop.time()
+        self.idletimer = self.loop.call_later(self.timeout, self.__on_idle_timer)
 
         self.connected = True
 
     def shutdown(self):
+        if self.demux is not None:
+            self.demux.unregister(self)
+        else:
+            self.listener.close()
+        if self.idletimer is not None:
+            self.idletimer.cancel()
         self.ssock.close()
-        self.rsock.close()
+        self.connected = False
 
     def settimeout(self, timeo):
         """
-        Sets the timeout (in seconds) for receiving messages on rsock
+        Sets how long to wait (in seconds) for a packet from the remote server before the connection is assumed dead
         timeo (float) - timeout in seconds
         """
         self.timeout = timeo
-        self.rsock.settimeout(self.timeout)
+        if self.idletimer is not None:
+            self.idletimer.cancel()
+            self.idletimer = self.loop.call_at(self.lastrecv + self.timeout, self.__on_idle_timer)
+
+    def __on_idle_timer(self):
+        remaining = self.lastrecv + self.timeout - self.loop.time()
+        if remaining > 0:
+            self.idletimer = self.loop.call_later(remaining, self.__on_idle_timer)
+            return
 
-    def send(self, tcp, debug=False):
+        sys.exit('No response from server after {} seconds. Connection assumed dead'.format(self.timeout))
+
+    def snapshot(self):
+        """
+        Returns the counters of this layer as a dict, along with the fragments sent and the datagrams the reassembler
+        dropped. The reassembler is shared by the network layers of a thread, so its drops are those of all of them
+        """
+        snap = self.metrics.snapshot()
+        snap['fragments_out'] = self.fragments
+        snap['fragments_expired'] = self.reassembler.expired
+        snap['fragments_evicted'] = self.reassembler.evicted
+        snap['fragments_oversized'] = self.reassembler.oversized
+        snap['fragments_inconsistent'] = self.reassembler.inconsistent
+        snap['pathmtu'] = self.paths.mtu(self.remote_addr, self.loop.time()) if self.remote_addr is not None else None
+        return snap
+
+    def pathmtu(self, refresh=False):
         """
-        Sends the given tcp packet over the send socket
+        Returns the path MTU to the remote server
+
+        refresh (bool) - whether to ask the kernel again, which knows about "fragmentation needed" messages received
+                         since the last lookup
+        """
+        now = self.loop.time()
+        if refresh:
+            return self.paths.refresh(self.remote_addr, now).mtu
+        return self.paths.mtu(self.remote_addr, now)
+
+    def send(self, tcp):
+        """
+        Sends the given tcp packet over the send socket. The checksum field of the packet is updated
 
         tcp (TCP) - an unserialized TCP packet object to be send. Must be deserialized because the TCP checksum
             computation cannot be done without knowledge of the IP header
-        debug (bool) - debug mode enabled or not. if True, then the packets are printed before sending them
-        """
-        # serialize once to get right size
-        tcp_slz = tcp.serialize()
-        ippkt = ip.IP(src=self.local_addr, dst=self.remote_addr, proto=6, len=20 + len(tcp_slz))
-
-        # now compute checksum with new IP packet and send it
-        tcp.compute_checksum(ippkt)
-
-        if debug:
-            # set data to packet itself to print both IP and TCP
-            ippkt.data = tcp
-            print('sending')
-            ippkt.show()
-
-        ippkt.data = tcp.serialize()  # must reserialize to get correct checksum
-        self.ssock.sendall(ippkt.serialize())
-
-    def __valid_checksum(self, ip_pkt):
-        """Returns whether the checksum provided in the IP packet is correct"""
-        given_checksum = ip_pkt.chksum
-        ip_pkt.compute_checksum()
-        calculated_checksum = ip_pkt.chksum
-        return given_checksum == calculated_checksum
-
-    class FragObject:
-        """Class used to store fragmentation metadata"""
-        def __init__(self, buffer, seenoffsets, bytesrecvd, totalbytes, seenfinal, firstpkt):
-            self.buffer = buffer  # buffer containing reassembled data
-            self.seenoffsets = seenoffsets  # set of all offsets we've seen
-            self.bytesrecvd = bytesrecvd  # total unique bytes received
-            self.totalbytes = totalbytes  # total bytes in the entire datagram payload
-            self.seenfinal = seenfinal  # whether we've seen the final packet
-            self.firstpkt = firstpkt  # the first packet we received (store so we can make a new IP packet)
-
-    def handle_fragment(self, ip_pkt, debug=False):
+        """
+        tcp.chksum = self.send_segment(tcp.sport, tcp.dport, tcp.seq, tcp.ack, tcp.flags, tcp.window,
+                                       tcp.options, tcp.data)
+
+    def send_segment(self, sport, dport, seq, ack, flags, window, options=None, data=None):
+        """
+        Sends a TCP segment with the given fields, using the cached header template of the connection so that no
+        packet objects are created or serialized. The payload is sent from its own buffer with scatter-gather I/O
+
+        return (int) - the TCP checksum of the segment that was sent
+        """
+        template = self.templates.get((sport, dport))
+        if template is None:
+            template = HeaderTemplate(self.local_addr, self.remote_addr, sport, dport, df=self.df)
+            self.templates[(sport, dport)] = template
+
+        # ids are unique per destination, not per connection, since fragments are matched by (src, dst, proto, id)
+        self.idnum = self.paths.nextid(self.remote_addr, self.loop.time())
+        datagram = template.build(self.idnum, seq, ack, flags, window, options, data)
+        tcpchksum = int.from_bytes(datagram[36:38], byteorder='big')
+
+        if len(datagram) + (len(data) if data is not None else 0) > self.pathmtu():
+            self.__send_fragments(datagram, data)
+            return tcpchksum
+
+        # the headers and the payload are gathered by the kernel, so the payload is never copied into a new buffer
+        try:
+            if data is None:
+                self.ssock.send(datagram)
+            else:
+                self.ssock.sendmsg([datagram, data])
+        except OSError as e:
+            if e.errno != errno.EMSGSIZE:
+                raise
+            # the route's MTU is smaller than we thought. the kernel tells us which one it is
+            self.paths.update(self.remote_addr, self.ssock.getsockopt(socket.IPPROTO_IP, IP_MTU), self.loop.time())
+            self.__send_fragments(datagram, data)
+            return tcpchksum
+
+        self.metrics.datagrams_out += 1
+        self.metrics.bytes_out += len(datagram) + (len(data) if data is not None else 0)
+        if self.capture is not None:
+            self.capture.write([datagram] if data is None else [datagram, data])
+        return tcpchksum
+
+    def __send_fragments(self, datagram, data):
+        """
+        Sends a datagram that does not fit the path MTU as fragments (RFC 791 3.2). Each fragment gets a copy of the IP
+        header with DF cleared and its own length, offset and checksum
+
+        datagram (bytearray) - IP and TCP headers, as built by a HeaderTemplate
+        data (bytes-like) - TCP payload, or None
+        """
+        payload = memoryview(datagram[20:] + data if data is not None else datagram[20:])
+        _, idnum, _, ttl, proto, _ = IPFRAGFIELDS.unpack_from(datagram, 2)
+        step = (self.pathmtu() - 20) // 8 * 8  # fragment offsets are counted in units of 8 bytes
+
+        for offset in range(0, len(payload), step):
+            part = payload[offset:offset + step]
+            more = ip.MF if offset + len(part) < len(payload) else 0
+            hdr = bytearray(datagram[:20])
+            IPFRAGFIELDS.pack_into(hdr, 2, 20 + len(part), idnum, more | offset // 8, ttl, proto, 0)
+            hdr[10:12] = utils.checksum16(hdr).to_bytes(2, byteorder='big')
+            self.ssock.sendmsg([hdr, part])
+            self.fragments += 1
+            self.metrics.datagrams_out += 1
+            self.metrics.bytes_out += len(hdr) + len(part)
+            if self.capture is not None:
+                self.capture.write([hdr, part])
+
+    def handle_fragment(self, ip_pkt):
         """
         Handles a fragment of an IP datagram.
 
-        ip_pkt (IP) - IP packet that is part of a fragment
-        debug (bool) - whether to print debug information
+        ip_pkt (IP) - IP packet that is part of a fragment. Its payload is copied, so it may be a view of a buffer
 
         return - the fully reassembled IP packet or None if there are still fragments to be received
         """
+        self.metrics.fragments_in += 1
+        outpkt = self.reassembler.add(ip_pkt)
+        if outpkt is not None:
+            self.metrics.reassembled += 1
+            self.trace.record(self.loop.time(), pkttrace.IN, pkttrace.REASSEMBLED, self.local_port or 0,
+                              self.remote_port or 0, outpkt.idnum, length=outpkt.len)
+        return outpkt
+
+    def __on_datagrams(self, datagrams):
+        """Validates a batch of datagrams received by the link and delivers the valid ones"""
+        batch = []
+        for data in datagrams:
+            # deserialize packet. the payload of the packet is a view of data, so nothing is copied
+            ip_pkt = self.accept(ip.deserialize_ip(data))
+            if ip_pkt is not None:
+                batch.append(ip_pkt)
+
+        if batch:
+            self.deliver(batch)
+
+    def accept(self, ip_pkt):
+        """
+        Validates a received IP packet and reassembles fragments
+
+        ip_pkt (IP) - deserialized packet
+
+        return - the IP packet, or None if it is not for us, is invalid, or is a fragment of an incomplete datagram
+        """
+        # only return packets with the correct src/dst addresses and which have a valid checksum
+        if ip_pkt.src != self.remote_addr or ip_pkt.dst != self.local_addr:
+            self.metrics.foreign += 1
+            return None
 
-        # create new entry
-        if ip_pkt.idnum not in self.fraginfo:
-            self.fraginfo[ip_pkt.idnum] = self.FragObject(io.BytesIO(), {}, 0, -1, False, ip_pkt)
+        self.lastrecv = self.loop.time()
+        self.metrics.datagrams_in += 1
+        self.metrics.bytes_in += ip_pkt.len
+        if self.capture is not None:
+            self.capture.write([ip_pkt.raw])
 
-        # check for a reassembled packet that is too big
-        if 20 + ip_pkt.frag * 8 + len(ip_pkt.data) > 65535:
-            print('IP fragmentation overflow attempt')
+        if not ip_pkt.valid_checksum():
+            self.metrics.badchecksum += 1
+            self.trace.record(self.loop.time(), pkttrace.IN, pkttrace.BADCHECKSUM, self.local_port or 0,
+                              self.remote_port or 0, ip_pkt.idnum, length=ip_pkt.len)
             return None
 
-        # copy data into buffer if this is not a duplicate
-        entry = self.fraginfo[ip_pkt.idnum]
-        if ip_pkt.frag not in entry.seenoffsets:
-            entry.buffer.seek(ip_pkt.frag * 8)
-            entry.buffer.write(ip_pkt.data)
-            entry.bytesrecvd += len(ip_pkt.data)
-
-        # if this is the last fragment, then we now know the total size of the buffer
-        if ip_pkt.flags != 'M':
-            entry.seenfinal = True
-            entry.totalbytes = ip_pkt.frag * 8 + len(ip_pkt.data)
-
-        # if we have copied all the byte in the payload, construct a new IP datagram and deliver it to the upper layer
-        if entry.seenfinal and entry.bytesrecvd == entry.totalbytes:
-            del self.fraginfo[ip_pkt.idnum]
-            outpkt = ip.IP(version=4, ihl=5, tos=entry.firstpkt.tos, len=20 + entry.totalbytes, id=entry.firstpkt.idnum,
-                           flags='', frag=0, ttl=entry.firstpkt.ttl, proto=entry.firstpkt.proto,
-                           src=entry.firstpkt.src, dst=entry.firstpkt.dst,
-                           data=bytearray(entry.buffer.getvalue()))
-
-            if debug:
-                print('reassembled datagram')
-                outpkt.show()
-
-            return outpkt
-
-        # None signals that the packet is not fully assembled yet
-        return None
-
-    def recv(self, debug=False):
-        """
-        Receives data from the receive socket and deserializes it into an IP packet.
-
-        debug (bool) - debug mode enabled or not. if True, then the received bytes and deserialized packet are printed
-        """
-
-        # This code enables the 3 minute timeout
-        #
-        # On the first call to this function since we last received a packet addressed to us, save the current time.
-        #
-        # On subsequent calls, compare the current time to the time since we last received a packet.
-        #
-        # This check is necessary because the transport layer raises an exception if a packet is not received after a
-        # minute, which will interrupt this function. Since the network layer must time out after 3 minutes, we must
-        # track the time across multiple function calls.
-        ts = time.time()
-        if self.firstrecv:
-            self.recvstarttime = ts
-            self.firstrecv = False
-        elif ts - self.recvstarttime >= self.timeout:
-            sys.exit('No response from server after {} seconds. Connection assumed dead'.format(self.timeout))
-
-        # receive in a loop until we get a packet from the remote server addressed to us
-        while True:
-            # this will never be executed as long as the TCP connection is doing its own timeouts, but is necessary if
-            # a different transport layer protocol is used that still wants the 3-minute timeout from the network layer
-            try:
-                data = self.rsock.recv(self.MSS)
-            except socket.timeout:
-                sys.exit('Socket timeout after {} seconds. Connection assumed dead'.format(self.timeout))
-
-            # deserialize packet
-            ip_pkt = ip.deserialize_ip(bytearray(data))
-            if debug:
-                print('received')
-                ip_pkt.show()
-
-            # only return packets with the correct src/dst addresses and which have a valid checksum
-            if ip_pkt.src == self.remote_addr and ip_pkt.dst == self.local_addr:
-
-                # reset timer flag
-                self.firstrecv = True
-
-                if self.__valid_checksum(ip_pkt):
-                    # check for fragmentation
-                    if ip_pkt.flags == 'M' or ip_pkt.frag > 0:
-                        maybepkt = self.handle_fragment(ip_pkt, debug)
-                        if maybepkt is not None:
-                            return maybepkt
-                        else:
-                            continue
-                    return ip_pkt
-
-            print('incorrect addresses or checksum')
+        # check for fragmentation
+        if ip_pkt.flags & ip.MF or ip_pkt.frag > 0:
+            return self.handle_fragment(ip_pkt)
+        return ip_pkt
+
+    def deliver(self, batch):
+        """
+        Passes a batch of accepted packets to onpackets, or queues them for recv()
+
+        batch (list) - IP packets
+        """
+        if self.onpackets is not None:
+            self.onpackets(batch)
+        else:
+            # packets queued for recv() outlive the receive buffers, so they need their own copy. Reassembled
+            # datagrams already have one
+            for ip_pkt in batch:
+                if ip_pkt.raw is not None:
+                    ip_pkt = ip.deserialize_ip(bytes(ip_pkt.raw))
+                self.inbox.append(ip_pkt)
+
+    def recv(self):
+        """
+        Runs the event loop until a packet from the remote server arrives and returns it as an IP packet. Only works
+        while onpackets is not set
+        """
+        if not self.loop.run_until(lambda: self.inbox, self.timeout):
+            sys.exit('Socket timeout after {} seconds. Connection assumed dead'.format(self.timeout))
+        return self.inbox.popleft()
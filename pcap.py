@@ -0,0 +1,219 @@
+import struct
+import time
+
+# classic pcap, with nanosecond timestamps in the files we write
+NSMAGIC = 0xa1b23c4d
+USMAGIC = 0xa1b2c3d4
+FILEHDR = struct.Struct('=IHHiIII')  # magic, version major and minor, thiszone, sigfigs, snaplen, link type
+RECORDHDR = struct.Struct('=IIII')  # seconds, fraction of a second, captured length, original length
+
+# pcapng blocks (https://www.ietf.org/archive/id/draft-ietf-opsawg-pcapng-02.html)
+SHB = 0x0a0d0d0a  # section header
+IDB = 1  # interface description
+SPB = 3  # simple packet
+EPB = 6  # enhanced packet
+BYTEORDER = 0x1a2b3c4d
+IF_TSRESOL = 9  # option of an interface with the resolution of its timestamps
+
+# link types
+LINKTYPE_NULL = 0  # BSD loopback
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101  # the datagram starts with the IP header
+LINKTYPE_LINUX_SLL = 113  # tcpdump -i any
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+
+ETH_P_IP = 0x0800
+VLAN = (0x8100, 0x88a8)
+
+SNAPLEN = 65535
+BUFSIZE = 1 << 16  # bytes a writer collects before writing them to the file
+
+
+class PcapWriter:
+    """
+    Writes datagrams to a pcap file with nanosecond timestamps, which tcpdump and Wireshark read.
+
+    Records are collected in a buffer and written to the file once it holds bufsize bytes, so recording a transfer
+    costs one write system call per bufsize bytes rather than one per datagram. Call close(), or flush(), before reading
+    the file.
+    """
+
+    def __init__(self, file, snaplen=SNAPLEN, clock=time.time_ns, bufsize=BUFSIZE):
+        """
+        file (str or file) - path of the file to create, or a binary file object to write to
+        snaplen (int) - longest part of a datagram that is recorded
+        clock (function) - returns the timestamp of a datagram in nanoseconds. Defaults to the wall clock
+        bufsize (int) - bytes collected before they are written
+        """
+        self.ownsfile = isinstance(file, str)
+        self.file = open(file, 'wb') if self.ownsfile else file
+        self.snaplen = snaplen
+        self.clock = clock
+        self.bufsize = bufsize
+        self.buf = bytearray(FILEHDR.pack(NSMAGIC, 2, 4, 0, 0, snaplen, LINKTYPE_RAW))
+        self.packets = 0  # datagrams recorded
+
+    def write(self, buffers, timestamp=None):
+        """
+        Records one datagram
+
+        buffers (list) - bytes-like pieces that make up the datagram, e.g. its headers and its payload
+        timestamp (int) - time the datagram was sent or received in nanoseconds since the epoch. Defaults to clock()
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        length = sum(len(buf) for buf in buffers)
+        caplen = min(length, self.snaplen)
+
+        self.buf += RECORDHDR.pack(timestamp // 1000000000, timestamp % 1000000000, caplen, length)
+        left = caplen
+        for buf in buffers:
+            if left <= 0:
+                break
+            self.buf += buf[:left]
+            left -= len(buf)
+
+        self.packets += 1
+        if len(self.buf) >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered records to the file"""
+        if self.buf:
+            self.file.write(self.buf)
+            self.buf = bytearray()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.ownsfile:
+            self.file.close()
+
+
+def readpcap(file):
+    """
+    Reads the IPv4 datagrams of a pcap or pcapng file, in the order they were recorded. Link layer headers (Ethernet,
+    Linux cooked capture, BSD loopback) are removed, and other protocols are skipped
+
+    file (str or file) - path of the file, or a binary file object
+
+    return - generator of (timestamp in nanoseconds since the epoch, datagram as bytes) tuples
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            yield from readpcap(f)
+        return
+
+    data = file.read()
+    if len(data) < 4:
+        raise RuntimeError('not a pcap or pcapng file')
+
+    if struct.unpack_from('<I', data)[0] == SHB:
+        records = readpcapng(data)
+    else:
+        records = readclassic(data)
+
+    for timestamp, linktype, frame in records:
+        datagram = stripframe(linktype, frame)
+        if datagram is not None:
+            yield timestamp, datagram
+
+
+def readclassic(data):
+    """Yields (timestamp, link type, frame) for each record of a classic pcap file"""
+    for order in ('<', '>'):
+        magic = struct.unpack_from(order + 'I', data)[0]
+        if magic in (NSMAGIC, USMAGIC):
+            break
+    else:
+        raise RuntimeError('not a pcap or pcapng file')
+
+    filehdr = struct.Struct(order + FILEHDR.format[1:])
+    recordhdr = struct.Struct(order + RECORDHDR.format[1:])
+    linktype = filehdr.unpack_from(data)[6] & 0xffff  # the upper bits may hold FCS information
+    scale = 1 if magic == NSMAGIC else 1000
+
+    pos = filehdr.size
+    while pos + recordhdr.size <= len(data):
+        secs, frac, caplen, _ = recordhdr.unpack_from(data, pos)
+        pos += recordhdr.size
+        yield secs * 1000000000 + frac * scale, linktype, data[pos:pos + caplen]
+        pos += caplen
+
+
+def readpcapng(data):
+    """Yields (timestamp, link type, frame) for each packet of a pcapng file, which may have several sections"""
+    order = '<'
+    interfaces = []  # (link type, function converting a timestamp to nanoseconds) of the current section
+    timestamp = 0  # simple packet blocks have no timestamp of their own
+
+    pos = 0
+    while pos + 12 <= len(data):
+        if struct.unpack_from('<I', data, pos)[0] == SHB:
+            # each section has its own byte order
+            order = '<' if struct.unpack_from('<I', data, pos + 8)[0] == BYTEORDER else '>'
+            interfaces = []
+        blocktype, length = struct.unpack_from(order + 'II', data, pos)
+        if length < 12:
+            raise RuntimeError('corrupt pcapng block at offset {}'.format(pos))
+        body = data[pos + 8:pos + length - 4]
+        pos += length
+
+        if blocktype == IDB:
+            linktype = struct.unpack_from(order + 'H', body)[0]
+            interfaces.append((linktype, tsresolution(body[8:], order)))
+        elif blocktype == EPB:
+            iface, high, low, caplen, _ = struct.unpack_from(order + 'IIIII', body)
+            linktype, tons = interfaces[iface]
+            timestamp = tons(high << 32 | low)
+            yield timestamp, linktype, body[20:20 + caplen]
+        elif blocktype == SPB and interfaces:
+            linktype, _ = interfaces[0]
+            yield timestamp, linktype, body[4:]
+
+
+def tsresolution(options, order):
+    """Returns a function converting the timestamps of an interface to nanoseconds, given the interface's options"""
+    resol = 6  # microseconds unless the interface says otherwise
+    pos = 0
+    while pos + 4 <= len(options):
+        code, length = struct.unpack_from(order + 'HH', options, pos)
+        if code == 0:
+            break
+        if code == IF_TSRESOL and length >= 1:
+            resol = options[pos + 4]
+        pos += 4 + (length + 3) // 4 * 4
+
+    if resol & 0x80:
+        return lambda ts: ts * 1000000000 >> (resol & 0x7f)
+    if resol <= 9:
+        return lambda ts: ts * 10 ** (9 - resol)
+    return lambda ts: ts // 10 ** (resol - 9)
+
+
+def stripframe(linktype, frame):
+    """Returns the IPv4 datagram in a captured frame, without link layer padding, or None if it carries none"""
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4):
+        datagram = frame
+    elif linktype == LINKTYPE_ETHERNET:
+        pos = 12
+        ethertype = int.from_bytes(frame[pos:pos + 2], byteorder='big')
+        while ethertype in VLAN:
+            pos += 4
+            ethertype = int.from_bytes(frame[pos:pos + 2], byteorder='big')
+        datagram = frame[pos + 2:] if ethertype == ETH_P_IP else None
+    elif linktype == LINKTYPE_LINUX_SLL:
+        datagram = frame[16:] if int.from_bytes(frame[14:16], byteorder='big') == ETH_P_IP else None
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        datagram = frame[20:] if int.from_bytes(frame[0:2], byteorder='big') == ETH_P_IP else None
+    elif linktype == LINKTYPE_NULL:
+        # the address family is in the byte order of the capturing host. AF_INET is 2 everywhere
+        datagram = frame[4:] if frame[0:4] in (b'\x02\x00\x00\x00', b'\x00\x00\x00\x02') else None
+    else:
+        raise RuntimeError('unsupported link type {}'.format(linktype))
+
+    if datagram is None or len(datagram) < 20 or datagram[0] >> 4 != 4:
+        return None
+    # frames are padded to a minimum size, and the datagram may end before the frame does
+    return bytes(datagram[:int.from_bytes(datagram[2:4], byteorder='big')])
@@ -0,0 +1,193 @@
+import signal
+import struct
+import sys
+import threading
+import time
+
+import tcp
+
+MAGIC = b'PKTTRACE'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIQdd')  # magic, version, record size, capacity, records written, wall and monotonic time
+# time, direction, event, local port, remote port, seq, ack, TCP flags, window, length
+RECORD = struct.Struct('<dBBHHIIHHI')
+CAPACITY = 1 << 16  # records kept by a trace, i.e. 2 MiB
+
+IN = 0
+OUT = 1
+DIRECTIONS = ['in', 'out']
+
+# events. seq, ack, flags and window are those of the segment unless noted
+SEGMENT = 0  # a segment was sent or received
+RETRANSMIT = 1  # a segment was sent again after a timeout
+FASTRETRANSMIT = 2  # a segment was sent again after duplicate ACKs
+TIMEOUT = 3  # the retransmission timer expired. seq is the oldest unacknowledged byte, length the bytes in flight
+DUPACK = 4  # the received segment was a duplicate ACK
+OUTOFORDER = 5  # the received segment arrived ahead of a hole
+DUPLICATE = 6  # the payload of the received segment had already been received
+OUTOFWINDOW = 7  # the payload of the received segment started beyond our window
+PAWS = 8  # the received segment was dropped as an old duplicate by its timestamp
+BADSEGMENT = 9  # a segment was dropped for its protocol, ports or options
+PMTU = 10  # the path MTU dropped. length is the new MSS
+BADCHECKSUM = 11  # a datagram was dropped for its IP header checksum. seq is its IP id, length its length
+REASSEMBLED = 12  # a datagram was reassembled from fragments. seq is its IP id, length its length
+EVENTS = ['segment', 'retransmit', 'fastretransmit', 'timeout', 'dupack', 'outoforder', 'duplicate', 'outofwindow',
+          'paws', 'badsegment', 'pmtu', 'badchecksum', 'reassembled']
+
+
+class Trace:
+    """
+    Fixed-size ring of compact binary records of the packets and events of the connections of a thread.
+
+    Recording packs one record into a preallocated buffer, overwriting the oldest one once the ring is full, so tracing
+    can stay on all the time, unlike printing every packet, which slows a transfer down enough to change what is being
+    debugged. The last capacity records are written to a file by dump() when something went wrong, and decoded with
+    python3 pkttrace.py. In debug mode, echo makes every record print as it is recorded, in the decoder's format.
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        """
+        capacity (int) - number of records kept
+        """
+        self.capacity = capacity
+        self.buf = bytearray(capacity * RECORD.size)
+        self.pos = 0  # offset of the next record in buf
+        self.count = 0  # records written since the trace was created
+        self.echo = None  # if set, a text file every record is also printed to, e.g. sys.stdout in debug mode
+
+    def record(self, now, direction, event, sport, dport, seq=0, ack=0, flags=0, window=0, length=0):
+        """
+        Adds a record, overwriting the oldest one if the ring is full
+
+        now (float) - time of the event in seconds, as given by the clock of the connection's event loop
+        direction (int) - IN or OUT
+        event (int) - one of the event codes, e.g. SEGMENT
+        sport (int) - local port of the connection
+        dport (int) - remote port of the connection
+        """
+        pos = self.pos
+        RECORD.pack_into(self.buf, pos, now, direction, event, sport, dport, seq, ack, flags, window, length)
+        pos += RECORD.size
+        self.pos = pos if pos < len(self.buf) else 0
+        self.count += 1
+        if self.echo is not None:
+            print(describe((now, direction, event, sport, dport, seq, ack, flags, window, length)), file=self.echo)
+
+    def records(self):
+        """Returns the records in the ring as bytes, oldest first"""
+        if self.count < self.capacity:
+            return bytes(self.buf[:self.pos])
+        return bytes(self.buf[self.pos:] + self.buf[:self.pos])
+
+    def dump(self, file):
+        """
+        Writes the records in the ring to a file, oldest first, after a header with the times at which the dump was
+        made, which relate the loop's clock to the wall clock
+
+        file (str or file) - path of the file to create, or a binary file object
+        """
+        if isinstance(file, str):
+            with open(file, 'wb') as f:
+                self.dump(f)
+            return
+        file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.capacity, self.count, time.time(), time.monotonic()))
+        file.write(self.records())
+
+
+local = threading.local()
+
+
+def gettrace():
+    """Returns the trace of the calling thread, which the network and transport layers on the thread record to"""
+    trace = getattr(local, 'trace', None)
+    if trace is None:
+        trace = Trace()
+        local.trace = trace
+    return trace
+
+
+def dumponsignal(path, signum=signal.SIGUSR1):
+    """
+    Makes the given signal dump the trace of the calling thread to path, e.g. to look at a transfer that is slow while
+    it is still running. Only works on the main thread
+    """
+    trace = gettrace()
+    signal.signal(signum, lambda signum, frame: trace.dump(path))
+
+
+def load(file):
+    """
+    Reads a dump written by Trace.dump()
+
+    file (str or file) - path of the dump, or a binary file object
+
+    return - tuple of the header, as a dict, and the list of records, each a tuple of (time, direction, event, sport,
+             dport, seq, ack, flags, window, length)
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            return load(f)
+
+    data = file.read()
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        raise RuntimeError('not a packet trace')
+    _, version, size, capacity, count, walltime, monotime = HEADER.unpack_from(data)
+    if version != VERSION or size != RECORD.size:
+        raise RuntimeError('unsupported packet trace version {}'.format(version))
+
+    records = list(RECORD.iter_unpack(data[HEADER.size:HEADER.size + (len(data) - HEADER.size) // size * size]))
+    header = {'capacity': capacity, 'count': count, 'lost': count - len(records), 'walltime': walltime,
+              'monotime': monotime}
+    return header, records
+
+
+def describe(record, start=0.0):
+    """Returns a line describing a record, with its time relative to start"""
+    now, direction, event, sport, dport, seq, ack, flags, window, length = record
+    arrow = '>' if direction == OUT else '<'
+    line = '{:12.6f} {:<3} {:5} {} {:<5} {:<14}'.format(now - start, DIRECTIONS[direction], sport, arrow, dport,
+                                                       EVENTS[event] if event < len(EVENTS) else event)
+    if event in (BADCHECKSUM, REASSEMBLED):
+        return line + ' id {} len {}'.format(seq, length)
+    if event == PMTU:
+        return line + ' mss {}'.format(length)
+    if event == TIMEOUT:
+        return line + ' una {} flight {}'.format(seq, length)
+    return line + ' {:<6} seq {} ack {} win {} len {}'.format(tcp.FLAGCOMBOS[flags & 0x3f], seq, ack, window, length)
+
+
+def main():
+    args = sys.argv[1:]
+    ports = set()
+    events = set()
+    last = None
+    while len(args) >= 2 and args[0] in ('-p', '-e', '-n'):
+        if args[0] == '-p':
+            ports.add(int(args[1]))
+        elif args[0] == '-e':
+            for name in args[1].split(','):
+                if name not in EVENTS:
+                    sys.exit('unknown event {}. Events are {}'.format(name, ', '.join(EVENTS)))
+                events.add(EVENTS.index(name))
+        else:
+            last = int(args[1])
+        args = args[2:]
+
+    if len(args) != 1:
+        sys.exit('usage: pkttrace.py [-p port] [-e event[,event...]] [-n last] trace.bin')
+
+    header, records = load(args[0])
+    start = records[0][0] if records else 0.0
+    selected = [rec for rec in records
+                if (not ports or rec[3] in ports or rec[4] in ports) and (not events or rec[2] in events)]
+    if last is not None:
+        selected = selected[-last:]
+
+    print('{} records, {} older ones overwritten. times are relative to the first record'.format(
+        len(records), header['lost']))
+    for rec in selected:
+        print(describe(rec, start))
+
+
+if __name__ == '__main__':
+    main()
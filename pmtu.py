@@ -0,0 +1,107 @@
+import random
+import threading
+
+import utils
+
+MINMTU = 68  # smallest MTU every IPv4 link must support (RFC 791)
+PMTUEXPIRES = 600  # seconds after which a lowered path MTU is probed again, like Linux's mtu_expires (RFC 1191 6.3)
+
+
+class Path:
+    """What we know about the path to one destination"""
+    __slots__ = ('mtu', 'expires', 'idnum')
+
+    def __init__(self, mtu, expires):
+        self.mtu = mtu
+        self.expires = expires
+        self.idnum = random.getrandbits(16)  # IP identification of the last datagram sent to the destination
+
+
+class PathCache:
+    """
+    Path MTUs and IP identification counters per destination, shared by all connections of the process.
+
+    The first lookup of a destination asks the kernel for the MTU of its route, i.e. the MTU of the outgoing interface.
+    Our datagrams carry DF, so a router whose next hop has a smaller MTU drops them and answers with an ICMP
+    "fragmentation needed" message, which the kernel applies to its route to the destination. update() lowers the
+    cached MTU when a sender finds out, and after PMTUEXPIRES seconds the kernel is asked again, so that the MTU can
+    grow back once the path changes (RFC 1191).
+
+    Fragments are matched by (src, dst, proto, id), so the id of a datagram must not repeat while fragments of an
+    earlier one with the same id may still be around. Every connection to a destination therefore draws its ids from
+    one counter.
+    """
+
+    def __init__(self, expires=PMTUEXPIRES, probe=None):
+        """
+        expires (float) - seconds after which the MTU of a path is looked up again
+        probe (function) - returns the MTU of the route to the given IP address. Defaults to utils.getmtu
+        """
+        self.expires = expires
+        self.probe = probe if probe is not None else utils.getmtu
+        self.paths = dict()  # maps dst -> Path
+        self.lock = threading.Lock()
+
+    def mtu(self, dst, now):
+        """
+        Returns the path MTU to the given destination
+
+        dst (int) - destination IP address
+        now (float) - current time
+        """
+        path = self.paths.get(dst)
+        if path is None or now >= path.expires:
+            path = self.refresh(dst, now)
+        return path.mtu
+
+    def refresh(self, dst, now):
+        """Looks up the MTU of the route to the given destination again and returns its Path"""
+        mtu = max(self.probe(utils.inttoaddr(dst)), MINMTU)
+        with self.lock:
+            path = self.paths.get(dst)
+            if path is None:
+                path = Path(mtu, now + self.expires)
+                self.paths[dst] = path
+            else:
+                path.mtu = mtu
+                path.expires = now + self.expires
+            return path
+
+    def update(self, dst, mtu, now):
+        """
+        Lowers the path MTU to the given destination, e.g. after the kernel refused a datagram as too large
+
+        dst (int) - destination IP address
+        mtu (int) - MTU the path is known to support
+        now (float) - current time
+        """
+        mtu = max(mtu, MINMTU)
+        with self.lock:
+            path = self.paths.get(dst)
+            if path is None:
+                self.paths[dst] = Path(mtu, now + self.expires)
+            elif mtu < path.mtu:
+                path.mtu = mtu
+                path.expires = now + self.expires
+
+    def nextid(self, dst, now):
+        """Returns the IP identification of the next datagram to the given destination"""
+        path = self.paths.get(dst)
+        if path is None:
+            path = self.refresh(dst, now)
+        with self.lock:
+            path.idnum = (path.idnum + 1) & 0xffff
+            return path.idnum
+
+
+cache = None
+cachelock = threading.Lock()
+
+
+def getpathcache():
+    """Returns the path cache shared by all connections of the process"""
+    global cache
+    with cachelock:
+        if cache is None:
+            cache = PathCache()
+        return cache
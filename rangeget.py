@@ -0,0 +1,348 @@
+import sys
+from collections import deque
+
+import demux
+import filesink
+import httpcode
+import networklayer
+import transportlayer
+
+PIECESIZE = 1 << 20  # most bytes asked for by one range request
+STALLTIME = 2  # seconds without progress after which the rest of a connection's range is given to another connection
+MINSTEAL = 64 << 10  # smallest range split off a connection that is still making progress
+SHUTDOWNTIMEOUT = 5  # how long to wait for each server FIN once the download is complete
+
+
+class Range:
+    """Bytes [start, end) of the file that have not been written yet. start advances as the range is received"""
+    __slots__ = ('start', 'end', 'lastprogress')
+
+    def __init__(self, start, end, now=0):
+        self.start = start
+        self.end = end
+        self.lastprogress = now  # time at which data of this range was last received
+
+    def __len__(self):
+        return max(self.end - self.start, 0)
+
+
+class RangeScheduler:
+    """
+    Hands out byte ranges of a file to the connections of a download and rebalances them.
+
+    The file is cut into pieces of at most piecesize bytes, which are handed out in order. Once every piece is taken, a
+    connection that needs work steals from the others: a stalled range is taken over entirely, otherwise the second
+    half of the largest range is split off. The victim's range is truncated, so it discards the bytes it receives past
+    its new end.
+    """
+
+    def __init__(self, start, end, piecesize=PIECESIZE, minsteal=MINSTEAL, stalltime=STALLTIME):
+        """
+        start (int) - first byte of the file still to be requested
+        end (int) - size of the file
+        """
+        self.piecesize = piecesize
+        self.minsteal = minsteal
+        self.stalltime = stalltime
+
+        self.pending = deque()  # ranges not handed out yet
+        for offset in range(start, end, piecesize):
+            self.pending.append(Range(offset, min(offset + piecesize, end)))
+        self.active = []  # ranges handed out and not finished yet
+
+    def take(self, now):
+        """
+        Returns the next range a connection should request, or None if there is nothing worth taking
+
+        now (float) - current time
+        """
+        if self.pending:
+            rng = self.pending.popleft()
+        else:
+            rng = self.__steal(now)
+            if rng is None:
+                return None
+
+        rng.lastprogress = now
+        self.active.append(rng)
+        return rng
+
+    def __steal(self, now):
+        stalled = [rng for rng in self.active if len(rng) > 0 and now - rng.lastprogress >= self.stalltime]
+        if stalled:
+            victim = max(stalled, key=len)
+            rng = Range(victim.start, victim.end)
+            victim.end = victim.start
+            return rng
+
+        if not self.active:
+            return None
+
+        victim = max(self.active, key=len)
+        if len(victim) < 2 * self.minsteal:
+            return None
+
+        mid = victim.start + len(victim) // 2
+        rng = Range(mid, victim.end)
+        victim.end = mid
+        return rng
+
+    def finish(self, rng):
+        """
+        Returns a range handed out by take(). If the connection did not receive all of it, the rest is handed out again
+
+        rng (Range) - range returned by take()
+        """
+        self.active.remove(rng)
+        if len(rng) > 0:
+            self.pending.appendleft(Range(rng.start, rng.end))
+
+    def stalled(self, now):
+        """Returns whether a range is stalled and could be taken over"""
+        return any(len(rng) > 0 and now - rng.lastprogress >= self.stalltime for rng in self.active)
+
+
+class RangeConnection:
+    """
+    One connection of a parallel download. It requests one range at a time over a persistent HTTP connection and writes
+    the body of each response straight into its offset of the output file
+    """
+
+    def __init__(self, download, sport):
+        self.download = download
+        self.sport = sport
+        self.ntwk = networklayer.NetworkLayer(demux=download.demux)
+        self.trans = None
+        self.parser = httpcode.HTTPResponse()
+
+        self.range = None  # range being received, or None while idle
+        self.offset = 0  # file offset of the next body byte of the current response
+        self.closed = False  # whether the server closed the connection
+
+    def connect(self):
+        download = self.download
+        self.ntwk.connect((download.local_ip, self.sport), (download.remote_addr, download.dport))
+        self.trans = transportlayer.TransportLayer(self.ntwk, self.sport, download.dport, download.debug)
+        self.trans.onrecv = self.__on_recv
+
+    def request(self, rng):
+        """
+        Asks the server for the given range
+
+        rng (Range) - range to request, or None to request the whole file
+        """
+        self.range = rng
+        getstr = 'GET ' + self.download.path + ' HTTP/1.1\r\nHost: ' + self.download.domain + '\r\n'
+        if rng is not None:
+            getstr += 'Range: bytes={}-{}\r\n'.format(rng.start, rng.end - 1)
+        getstr += '\r\n'
+        self.trans.send(bytearray(getstr, encoding='ascii'))
+
+    def shutdown(self):
+        self.trans.timeout = SHUTDOWNTIMEOUT
+        self.trans.shutdown()
+
+    def __on_recv(self):
+        """Called by the transport layer when data or the server's FIN arrived"""
+        if self.closed:
+            return
+
+        data = self.trans.recv()
+        if data is None:
+            self.closed = True
+            events = self.parser.close()
+        else:
+            events = self.parser.feed(data)
+
+        for event, value in events:
+            if event == httpcode.Event.HEADERS:
+                self.__on_headers()
+            elif event == httpcode.Event.BODY:
+                self.__on_body(value)
+            elif event == httpcode.Event.END:
+                self.__on_end()
+
+        if self.closed:
+            self.download.connection_closed(self)
+
+    def __on_headers(self):
+        parser = self.parser
+        if parser.status == 206:
+            crange = parser.content_range()
+            if crange is None:
+                sys.exit('Received a partial response without a valid Content-Range')
+            self.offset = crange[0]
+            self.download.learn_size(self, crange[2])
+        elif parser.status == 200:
+            # the server ignored the range and sends the whole file
+            self.offset = 0
+            self.download.learn_size(self, parser.total_length, noranges=True)
+        else:
+            sys.exit('Received HTTP status {}'.format(parser.status))
+
+    def __on_body(self, data):
+        rng = self.range
+        if rng is None:
+            # the whole file over this connection, with no known size
+            self.download.write(self.offset, data)
+            self.offset += len(data)
+            return
+
+        # only write the part that is still ours. the rest may have been handed to another connection
+        start = max(self.offset, rng.start)
+        end = min(self.offset + len(data), rng.end)
+        if start < end:
+            self.download.write(start, data[start - self.offset:end - self.offset])
+            rng.start = end
+            rng.lastprogress = self.download.loop.time()
+        self.offset += len(data)
+
+    def __on_end(self):
+        rng = self.range
+        self.range = None
+        if rng is not None:
+            if self.download.scheduler is not None:
+                self.download.scheduler.finish(rng)
+        elif self.download.size is None:
+            # a response without a known size is complete once it ends
+            self.download.size = self.download.written
+
+        if not self.closed:
+            self.download.assign(self)
+
+
+class RangeDownload:
+    """
+    Downloads a file over several parallel connections with HTTP range requests.
+
+    A single connection's throughput is bounded by its window divided by the round trip time, so on high-latency links
+    the file is split into ranges that are fetched over nconns connections at once, each with its own source port. All
+    connections share one demux and event loop. The first range request tells us the size of the file, which is
+    preallocated and mapped into memory, and the bodies of the responses are written at their offsets as they arrive.
+    If the server does not support ranges, the whole file is downloaded over the first connection.
+    """
+
+    def __init__(self, domain, path, local_ip, remote_addr, outfn, sports, dport=80, debug=False):
+        """
+        domain (str) - value of the Host header
+        path (str) - path of the file on the server
+        local_ip (str) - local IP address to send from
+        remote_addr (str) - IP address of the server
+        outfn (str) - file to write to
+        sports (list) - source ports of the connections, one per connection
+        dport (int) - port of the server
+        """
+        self.domain = domain
+        self.path = path
+        self.local_ip = local_ip
+        self.remote_addr = remote_addr
+        self.outfn = outfn
+        self.sports = sports
+        self.dport = dport
+        self.debug = debug
+
+        self.demux = demux.getdemux()
+        self.loop = self.demux.loop
+        self.sink = None
+        self.scheduler = None
+        self.connections = []
+
+        self.size = None  # size of the file, once known
+        self.written = 0  # bytes written to the file so far
+        self.stalltimer = None
+
+    def run(self):
+        """Downloads the file and returns once it has been written completely"""
+        self.sink = filesink.FileSink(self.outfn, usemmap=True)
+
+        # the first range also tells us the size of the file
+        first = RangeConnection(self, self.sports[0])
+        self.connections.append(first)
+        first.connect()
+        first.request(Range(0, PIECESIZE, self.loop.time()))
+        self.loop.run_until(lambda: self.scheduler is not None or self.complete() or first.closed)
+
+        if self.scheduler is not None:
+            for sport in self.sports[1:]:
+                conn = RangeConnection(self, sport)
+                self.connections.append(conn)
+                conn.connect()
+                self.assign(conn)
+            self.stalltimer = self.loop.call_later(STALLTIME / 2, self.__on_stall_timer)
+
+        self.loop.run_until(lambda: self.complete() or all(conn.closed for conn in self.connections))
+        if self.stalltimer is not None:
+            self.stalltimer.cancel()
+        self.sink.close()
+
+        if not self.complete():
+            sys.exit('Connections closed after {} bytes of the file were received'.format(self.written))
+
+        # stop writing before any connection runs the loop to shut down
+        for conn in self.connections:
+            conn.trans.onrecv = None
+        for conn in self.connections:
+            if not conn.closed:
+                conn.shutdown()
+
+    def complete(self):
+        return self.size is not None and self.written >= self.size
+
+    def learn_size(self, conn, size, noranges=False):
+        """
+        Called with the size of the file given by the first response
+
+        size (int) - size of the file, or None if unknown
+        noranges (bool) - whether the server sent the whole file instead of a range
+        """
+        if self.size is not None or self.scheduler is not None:
+            return
+
+        if noranges:
+            # the whole file arrives over this connection
+            if size is None:
+                conn.range = None
+            else:
+                conn.range.end = size
+                self.size = size
+                self.sink.preallocate(size)
+            return
+
+        if size is None:
+            sys.exit('Server did not report the size of the file')
+
+        conn.range.end = min(conn.range.end, size)
+        self.size = size
+        self.sink.preallocate(size)
+        self.scheduler = RangeScheduler(conn.range.end, size)
+        self.scheduler.active.append(conn.range)
+
+    def write(self, offset, data):
+        self.sink.pwrite(offset, data)
+        self.written += len(data)
+
+    def assign(self, conn):
+        """Gives an idle connection its next range, if there is one"""
+        if self.scheduler is None or self.complete():
+            return
+
+        rng = self.scheduler.take(self.loop.time())
+        if rng is not None:
+            conn.request(rng)
+
+    def connection_closed(self, conn):
+        """Hands the rest of the range of a connection the server closed to the other connections"""
+        if conn.range is not None and self.scheduler is not None:
+            self.scheduler.finish(conn.range)
+            conn.range = None
+            for other in self.connections:
+                if other.range is None and not other.closed:
+                    self.assign(other)
+
+    def __on_stall_timer(self):
+        """Gives the rest of stalled ranges to idle connections"""
+        if self.scheduler.stalled(self.loop.time()):
+            for conn in self.connections:
+                if conn.range is None and not conn.closed and conn.trans.established:
+                    self.assign(conn)
+        self.stalltimer = self.loop.call_later(STALLTIME / 2, self.__on_stall_timer)
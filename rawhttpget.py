@@ -1,14 +1,22 @@
+import json
 import random
 import sys
 
+import demux
+import filesink
 import httpcode
+import httppool
 import networklayer
+import pcap
+import pkttrace
+import rangeget
 import transportlayer
-from utils import spliturl, dnslookup, getlocalip, filenamefromurl
+from utils import addscheme, spliturl, dnslookup, getlocalip, filenamefromurl
 
 SRCPORT = random.randint(1024, 65535)
 DSTPORT = 80
 DEBUG = False
+TRACEFILE = 'rawhttpget.trace'  # where the packet trace is dumped when a transfer fails, unless -t names a file
 
 
 class Socket:
@@ -23,9 +31,10 @@ class Socket:
         localaddrpair - 2-tuple with format (ip_address as a string, port as an int)
         remoteaddrpair - same as localaddrpair
         """
-        self.ntwk = networklayer.NetworkLayer()
+        # all sockets of this thread share one raw receive socket
+        self.ntwk = networklayer.NetworkLayer(demux=demux.getdemux())
         self.ntwk.connect(localaddrpair, remoteaddrpair)
-        self.trans = transportlayer.TransportLayer(self.ntwk, SRCPORT, DSTPORT, DEBUG)
+        self.trans = transportlayer.TransportLayer(self.ntwk, localaddrpair[1], remoteaddrpair[1], DEBUG)
 
     def shutdown(self):
         """Terminates the connection with the remote server"""
@@ -51,15 +60,15 @@ class Socket:
         return self.trans.recv()
 
 
-def rawhttpget(url):
+def rawhttpget(url, connections=1):
     """
     Retrieves the file at the given url over an HTTP connection using raw sockets and writes it to a file
 
     url (str) - url of the page to be retrieved
+    connections (int) - number of parallel connections. If more than 1, the file is downloaded in byte ranges
     """
     # add http if user did not supply
-    if not (url.startswith('http://') or url.startswith('https://')):
-        url = 'http://' + url
+    url = addscheme(url)
 
     # get filename to write to, remote IP address, and our local IP address
     domain, path = spliturl(url)
@@ -67,6 +76,11 @@ def rawhttpget(url):
     remote_addr = dnslookup(url)
     local_ip = getlocalip()
 
+    if connections > 1:
+        sports = [SRCPORT] + random.sample([port for port in range(1024, 65536) if port != SRCPORT], connections - 1)
+        rangeget.RangeDownload(domain, path, local_ip, remote_addr, outfn, sports, DSTPORT, DEBUG).run()
+        return
+
     # connect to the remote server
     s = Socket()
     s.connect((local_ip, SRCPORT), (remote_addr, DSTPORT))
@@ -75,33 +89,95 @@ def rawhttpget(url):
     getstr = 'GET ' + path + ' HTTP/1.1\r\nHost: ' + domain + '\r\n\r\n'
     s.send(getstr)
 
-    fptr = None
-    firstmsg = True
+    parser = httpcode.HTTPResponse()
+    sink = filesink.FileSink(outfn, background=True)
+    done = False
 
     # in a loop, read from the server, then write the HTTP response body to the file
-    while True:
+    while not done:
         data = s.recv()
 
         if data is None:
-            fptr.close()
-            break
-
-        httpresp = httpcode.HTTPResponse(bytes(data))
-        if firstmsg:
-            firstmsg = False
-            if httpresp.isbytes:
-                fptr = open(outfn, 'wb')
-            else:
-                fptr = open(outfn, 'w')
-
-        fptr.write(httpresp.body)
+            events = parser.close()
+            done = True
+        else:
+            events = parser.feed(data)
+
+        for event, value in events:
+            if event == httpcode.Event.HEADERS:
+                if parser.status != 200:
+                    sink.close()
+                    sys.exit('Received HTTP status {}'.format(parser.status))
+                if parser.total_length is not None:
+                    sink.preallocate(parser.total_length)
+            elif event == httpcode.Event.BODY:
+                sink.write(value)
+            elif event == httpcode.Event.END:
+                done = True
+
+    sink.close()
 
     # gracefully shutdown connection
     s.shutdown()
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        sys.exit('please provide a url')
+def rawhttpgetmany(urls, connections=1, local_ip=None):
+    """
+    Retrieves several urls over persistent, pipelined HTTP connections and writes each one to a file
 
-    rawhttpget(sys.argv[1])
+    urls (list) - urls of the files to be retrieved
+    connections (int) - most connections to one host
+    local_ip (str) - local IP address to send from. Defaults to the address of this host
+
+    return (list) - the httppool.Request of each url, whose status is the HTTP status of its response
+    """
+    urls = [addscheme(url) for url in urls]
+    return httppool.fetchmany(urls, local_ip if local_ip is not None else getlocalip(), connections, DEBUG)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    nconns = 1
+    capture = None
+    metricsfile = None
+    tracefile = None
+    while len(args) >= 2 and args[0] in ('-n', '-w', '-m', '-t'):
+        if args[0] == '-t':
+            tracefile = args[1]
+        elif args[0] == '-n':
+            nconns = int(args[1])
+        elif args[0] == '-w':
+            # every connection records its datagrams to the same file
+            capture = pcap.PcapWriter(args[1])
+            networklayer.NetworkLayer.capture = capture
+        else:
+            # every connection writes a JSON line with its metrics every second and when it shuts down
+            metricsfile = open(args[1], 'w')
+            transportlayer.TransportLayer.onmetrics = lambda snap: metricsfile.write(json.dumps(snap) + '\n')
+        args = args[2:]
+
+    if len(args) < 1:
+        sys.exit('usage: rawhttpget.py [-n connections] [-w capture.pcap] [-m metrics.jsonl] [-t trace.bin] url '
+                 '[url ...]')
+
+    # the packet trace is always recorded. kill -USR1 dumps it while the transfer runs
+    pkttrace.dumponsignal(tracefile or TRACEFILE)
+    failed = True
+    try:
+        if len(args) == 1:
+            rawhttpget(args[0], nconns)
+        else:
+            # several urls are fetched over persistent, pipelined connections, with up to nconns per host
+            rawhttpgetmany(args, nconns)
+        failed = False
+    finally:
+        if failed or tracefile is not None:
+            pkttrace.gettrace().dump(tracefile or TRACEFILE)
+            if failed:
+                print('packet trace written to {}. Decode it with pkttrace.py'.format(tracefile or TRACEFILE),
+                      file=sys.stderr)
+        # the capture of a transfer that failed is the most interesting one
+        if capture is not None:
+            capture.close()
+        if metricsfile is not None:
+            metricsfile.close()
@@ -0,0 +1,139 @@
+import threading
+
+INITWINDOW = 64 << 10  # receive buffer of a new connection, in bytes
+MAXWINDOW = 16 << 20  # largest receive buffer of one connection
+MEMBUDGET = 256 << 20  # receive buffer memory of all connections of the process
+
+
+class MemoryBudget:
+    """
+    Receive buffer memory shared by the connections of a process.
+
+    A connection may always have its fair share of the budget, i.e. the total divided by the number of connections.
+    Beyond that, it may use what the others leave unused. A connection holding more than its fair share when the budget
+    runs out is cut back to its share the next time it asks to grow or shrink, which it does about once per RTT.
+    """
+
+    def __init__(self, total=MEMBUDGET):
+        """
+        total (int) - bytes of receive buffer that all connections together may use
+        """
+        self.total = total
+        self.grants = dict()  # maps owner -> bytes it may use
+        self.lock = threading.Lock()
+
+    def request(self, owner, want):
+        """
+        Asks for a receive buffer of the given size and returns the size granted, which may be smaller
+
+        owner (object) - the connection's tuner. It holds its grant until release() is called
+        want (int) - bytes wanted
+        """
+        with self.lock:
+            self.grants[owner] = 0
+            others = sum(self.grants.values())
+            fair = self.total // len(self.grants)
+            grant = min(want, max(self.total - others, fair))
+            self.grants[owner] = grant
+            return grant
+
+    def release(self, owner):
+        """Returns the memory of a connection that is closed"""
+        with self.lock:
+            self.grants.pop(owner, None)
+
+    def used(self):
+        """Returns the bytes granted to all connections"""
+        with self.lock:
+            return sum(self.grants.values())
+
+
+budget = None
+budgetlock = threading.Lock()
+
+
+def getbudget():
+    """Returns the memory budget shared by all connections of the process"""
+    global budget
+    with budgetlock:
+        if budget is None:
+            budget = MemoryBudget()
+        return budget
+
+
+class RcvBufTuner:
+    """
+    Sizes the receive buffer of a connection from the rate at which the application reads (dynamic right-sizing, as
+    done by Linux).
+
+    A window smaller than the bandwidth-delay product limits the sender, and a larger one only ties up memory. Once per
+    RTT, the bytes the application read during the last RTT estimate the BDP, and the buffer is grown to twice that,
+    plus room for the growth of a sender still in slow start, up to maximum. If the application falls behind and
+    leaves data unread, the buffer shrinks back towards what it actually reads. The size is always subject to the
+    memory budget. Unread data takes up part of the buffer, so the advertised window closes when reading stops.
+    """
+
+    def __init__(self, initial=INITWINDOW, maximum=MAXWINDOW, budget=None):
+        """
+        initial (int) - buffer size until the first measurement, in bytes. The buffer never shrinks below it
+        maximum (int) - largest buffer size, in bytes
+        budget (MemoryBudget) - budget to take the memory from. Defaults to the budget of the process
+        """
+        self.initial = initial
+        self.maximum = maximum
+        self.budget = budget if budget is not None else getbudget()
+        self.size = self.budget.request(self, initial)
+
+        self.rtt = None  # estimate of the round trip time seen by the receiver
+        self.epoch = None  # start of the current measurement
+        self.copied = 0  # bytes read by the application since the start of the measurement
+        self.lastcopied = 0  # bytes read during the previous measurement
+
+    def samplertt(self, rtt):
+        """
+        Updates the RTT estimate. Like Linux, the estimate follows decreases at once, since samples taken while ACKs are
+        delayed or the sender is idle are too large
+
+        rtt (float) - round trip time in seconds
+        """
+        if self.rtt is None or rtt < self.rtt:
+            self.rtt = rtt
+        else:
+            self.rtt = 7 / 8 * self.rtt + 1 / 8 * rtt
+
+    def read(self, nbytes):
+        """Called when the application read nbytes"""
+        self.copied += nbytes
+
+    def update(self, now, unread):
+        """
+        Adjusts the buffer size once per RTT and returns it
+
+        now (float) - current time
+        unread (int) - bytes received in order that the application has not read yet
+        """
+        if self.epoch is None:
+            self.epoch = now
+        if self.rtt is None or now - self.epoch < self.rtt:
+            return self.size
+
+        copied = self.copied
+        want = self.size
+        if 2 * copied > self.size:
+            want = 2 * copied
+            if copied > self.lastcopied > 0:
+                # the sender is still speeding up: leave room for it to grow as much again
+                want += 2 * (copied - self.lastcopied)
+        elif unread > 0:
+            # the application is the bottleneck: give back half of what it does not use
+            want = max((self.size + 2 * copied) // 2, self.initial)
+
+        self.size = self.budget.request(self, min(want, self.maximum))
+        self.epoch = now
+        self.lastcopied = copied
+        self.copied = 0
+        return self.size
+
+    def close(self):
+        """Returns the buffer to the budget"""
+        self.budget.release(self)
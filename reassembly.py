@@ -0,0 +1,151 @@
+from bisect import bisect_left, bisect_right
+
+from tcp import SEQMOD
+
+
+class ReassemblyQueue:
+    """
+    Reorders the payloads of received TCP segments into the byte stream.
+
+    Out of order data is kept in an interval map: a sorted list of range start offsets and a dict mapping each start to
+    the end of the range and the list of buffers that make it up. Overlapping and partially duplicate segments only
+    contribute the bytes that are not buffered yet, and adjacent ranges are merged, so ranges never touch or overlap.
+    Buffers are never concatenated: in-order data is handed out as a list of views, or joined once by read().
+
+    Internally, positions are offsets into the stream rather than sequence numbers, so that comparisons are not
+    affected by sequence numbers wrapping around.
+    """
+
+    def __init__(self, rcvnxt, budget=1 << 20):
+        """
+        rcvnxt (int) - sequence number of the next byte expected, i.e. the initial sequence number of the peer + 1
+        budget (int) - maximum number of out of order bytes to buffer. Segments that do not fit are dropped
+        """
+        self.base = rcvnxt  # sequence number of stream offset 0
+        self.offset = 0  # stream offset of the next byte expected
+        self.budget = budget
+
+        self.starts = []  # sorted start offsets of the out of order ranges
+        self.ranges = dict()  # maps start offset -> [end offset, list of buffers]
+        self.ooobytes = 0  # bytes currently buffered out of order
+
+        self.ready = []  # in-order buffers that have not been read yet
+        self.readybytes = 0
+
+    @property
+    def nxt(self):
+        """Sequence number of the next byte expected"""
+        return (self.base + self.offset) % SEQMOD
+
+    def __tooffset(self, seq):
+        """Converts a sequence number into a stream offset. Sequence numbers up to 2^31 behind nxt map to the past"""
+        diff = (seq - self.base - self.offset) % SEQMOD
+        if diff >= SEQMOD // 2:
+            diff -= SEQMOD
+        return self.offset + diff
+
+    def insert(self, seq, data, window=None):
+        """
+        Adds the payload of a received segment
+
+        seq (int) - sequence number of the first byte of data
+        data (bytes-like) - payload of the segment. It is referenced, not copied, so it must not be modified afterwards
+        window (int) - if given, bytes at or beyond nxt + window are discarded
+
+        return (int) - number of bytes that became available in order because of this segment
+        """
+        start = self.__tooffset(seq)
+        end = start + len(data)
+
+        if window is not None and end > self.offset + window:
+            end = self.offset + window
+            data = data[0:max(end - start, 0)]
+
+        # empty, entirely duplicate or outside the window. a segment that starts beyond the window is clipped to end
+        # before it starts
+        if end <= max(start, self.offset):
+            return 0
+
+        # drop the part that has already been delivered
+        if start < self.offset:
+            data = data[self.offset - start:]
+            start = self.offset
+
+        if start == self.offset:
+            before = self.readybytes
+            self.__deliver(data)
+            self.__drain()
+            return self.readybytes - before
+
+        if self.ooobytes + (end - start) > self.budget:
+            return 0
+
+        self.__add_range(start, end, data)
+        return 0
+
+    def __add_range(self, start, end, data):
+        """Merges the out of order buffer data covering [start, end) with every range it overlaps or touches"""
+        # ranges are disjoint and sorted, so their ends are sorted as well
+        lo = bisect_left(self.starts, start)
+        if lo > 0 and self.ranges[self.starts[lo - 1]][0] >= start:
+            lo -= 1
+        hi = bisect_right(self.starts, end)
+
+        chunks = []
+        cur = start  # first byte of data that has not been placed yet
+        newstart = start
+        for rstart in self.starts[lo:hi]:
+            rend, rchunks = self.ranges.pop(rstart)
+            if rstart > cur:
+                chunks.append(data[cur - start:rstart - start])
+                self.ooobytes += rstart - cur
+            chunks.extend(rchunks)
+            cur = max(cur, rend)
+            newstart = min(newstart, rstart)
+
+        if cur < end:
+            chunks.append(data[cur - start:])
+            self.ooobytes += end - cur
+
+        self.starts[lo:hi] = [newstart]
+        self.ranges[newstart] = [max(cur, end), chunks]
+
+    def __deliver(self, data):
+        self.ready.append(data)
+        self.readybytes += len(data)
+        self.offset += len(data)
+
+    def __drain(self):
+        """Moves every buffered range that is now in order to the ready list"""
+        while self.starts and self.starts[0] <= self.offset:
+            rstart = self.starts.pop(0)
+            rend, chunks = self.ranges.pop(rstart)
+            self.ooobytes -= rend - rstart
+
+            # skip the bytes of the range that were already delivered
+            skip = self.offset - rstart
+            for chunk in chunks:
+                if skip >= len(chunk):
+                    skip -= len(chunk)
+                    continue
+                self.__deliver(chunk[skip:] if skip else chunk)
+                skip = 0
+
+    def blocks(self):
+        """Returns a list of (start seq, end seq) pairs of the out of order ranges, in order"""
+        return [((self.base + s) % SEQMOD, (self.base + self.ranges[s][0]) % SEQMOD) for s in self.starts]
+
+    def readviews(self):
+        """Returns the list of in-order buffers received since the last read, without copying them"""
+        views = self.ready
+        self.ready = []
+        self.readybytes = 0
+        return views
+
+    def read(self):
+        """Returns all in-order bytes received since the last read as one bytes object, or None if there are none"""
+        if not self.ready:
+            return None
+        if len(self.ready) == 1:
+            return bytes(self.readviews()[0])
+        return b''.join(self.readviews())
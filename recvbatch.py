@@ -0,0 +1,111 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import sys
+
+RECVBATCH = 64  # most datagrams read per call to drain()
+BUFSIZE = 65535  # size of each receive buffer, enough for any IPv4 datagram
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+def loadrecvmmsg():
+    """Returns the recvmmsg function of the C library, or None if it is not available"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+
+    func.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    func.restype = ctypes.c_int
+    return func
+
+
+recvmmsg = loadrecvmmsg()
+
+
+class BatchReceiver:
+    """
+    Reads many datagrams from a non-blocking socket per call, into a fixed pool of preallocated buffers.
+
+    The buffers are slices of one bytearray that is allocated once, so receiving does not allocate a bytes object per
+    datagram. On Linux, a single recvmmsg system call fills up to count buffers; elsewhere, or if usemmsg is False, the
+    socket is drained with recv_into until it would block. The returned datagrams are views of the pool and are
+    overwritten by the next call to drain(), so anything that must outlive a batch has to be copied.
+    """
+
+    def __init__(self, sock, count=RECVBATCH, size=BUFSIZE, usemmsg=True):
+        """
+        sock (socket) - non-blocking datagram or raw socket to read from
+        count (int) - number of buffers, i.e. most datagrams returned by one drain()
+        size (int) - size of each buffer. Longer datagrams are truncated
+        usemmsg (bool) - whether to use recvmmsg if it is available
+        """
+        self.sock = sock
+        self.count = count
+        self.size = size
+
+        self.mem = bytearray(count * size)
+        view = memoryview(self.mem)
+        self.buffers = [view[i * size:(i + 1) * size] for i in range(count)]
+
+        self.msgs = None
+        if usemmsg and recvmmsg is not None:
+            # one iovec per buffer, pointing into the pool
+            self.cmem = (ctypes.c_char * len(self.mem)).from_buffer(self.mem)
+            base = ctypes.addressof(self.cmem)
+            self.iovs = (iovec * count)()
+            self.msgs = (mmsghdr * count)()
+            for i in range(count):
+                self.iovs[i].iov_base = base + i * size
+                self.iovs[i].iov_len = size
+                self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovs[i])
+                self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def drain(self):
+        """
+        Reads the datagrams that are waiting on the socket, without blocking
+
+        return (list) - memoryviews of the datagrams that were read, at most count of them. They are only valid until
+                        the next call to drain()
+        """
+        if self.msgs is not None:
+            n = recvmmsg(self.sock.fileno(), self.msgs, self.count, socket.MSG_DONTWAIT, None)
+            if n < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return []
+                raise OSError(err, os.strerror(err))
+            return [self.buffers[i][:self.msgs[i].msg_len] for i in range(n)]
+
+        datagrams = []
+        for buf in self.buffers:
+            try:
+                n = self.sock.recv_into(buf)
+            except (BlockingIOError, InterruptedError):
+                break
+            datagrams.append(buf[:n])
+        return datagrams
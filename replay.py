@@ -0,0 +1,219 @@
+import sys
+import time
+
+import eventloop
+import httpcode
+import ip
+import networklayer
+import pcap
+import simnet
+import tcp
+import transportlayer
+import utils
+from rcvbuf import MAXWINDOW
+
+
+class ReplayTransport(transportlayer.TransportLayer):
+    """
+    TransportLayer of a replay. Its receive buffer starts at full size: the client that was captured may have
+    advertised a larger window than ours would at first, and the server's segments have to fit in ours
+    """
+    window = MAXWINDOW
+
+
+class Capture:
+    """
+    One TCP connection of a capture, as seen by its client: the address pairs, the client's initial sequence number
+    and request, and the datagrams the server sent, with their times relative to the client's SYN
+    """
+
+    def __init__(self, records, port=None):
+        """
+        records (iterable) - (timestamp in nanoseconds, datagram) tuples, as returned by pcap.readpcap()
+        port (int) - local port of the connection to take. Defaults to the first connection opened in the capture
+        """
+        records = list(records)
+        syn = None
+        for timestamp, datagram in records:
+            seg = self.__segment(datagram)
+            if seg is not None and seg[1].flags & tcp.SYN and not seg[1].flags & tcp.ACK and \
+                    (port is None or seg[1].sport == port):
+                syn = timestamp, seg
+                break
+        if syn is None:
+            raise RuntimeError('no connection{} in the capture'.format(
+                ' from port {}'.format(port) if port is not None else ''))
+
+        self.start, (synip, synseg) = syn
+        self.client = (utils.inttoaddr(synip.src), synseg.sport)
+        self.server = (utils.inttoaddr(synip.dst), synseg.dport)
+        self.isn = synseg.seq
+        self.mtu = simnet.MTU
+
+        self.inbound = []  # (seconds after the SYN, datagram) sent by the server
+        self.handshake = 0  # number of those up to and including the SYN-ACK, or all of them if there is none
+        sent = dict()  # maps seq -> payload of the client's segments
+        for timestamp, datagram in records:
+            if timestamp < self.start:
+                continue
+            ippkt = ip.deserialize_ip(datagram)
+            if ippkt.proto != 6:
+                continue
+            self.mtu = max(self.mtu, len(datagram))
+
+            fromserver = (ippkt.src, ippkt.dst) == (synip.dst, synip.src)
+            if ippkt.flags & ip.MF or ippkt.frag > 0:
+                # fragments carry no ports, so every fragment between the two addresses is taken
+                if fromserver:
+                    self.inbound.append(((timestamp - self.start) / 1e9, datagram))
+                continue
+
+            seg = tcp.deserialize_tcp(ippkt.data)
+            if fromserver and (seg.sport, seg.dport) == (synseg.dport, synseg.sport):
+                self.inbound.append(((timestamp - self.start) / 1e9, datagram))
+                if not self.handshake and seg.flags & tcp.SYN and seg.flags & tcp.ACK:
+                    self.handshake = len(self.inbound)
+            elif (ippkt.src, ippkt.dst, seg.sport, seg.dport) == (synip.src, synip.dst, synseg.sport, synseg.dport):
+                if seg.data:
+                    sent.setdefault(seg.seq, bytes(seg.data))
+        if not self.handshake:
+            self.handshake = len(self.inbound)
+
+        # the request is the data the client sent, contiguous from its first byte. retransmissions are sent once
+        self.request = bytearray()
+        nxt = (self.isn + 1) % tcp.SEQMOD
+        while True:
+            data = sent.get(nxt)
+            if data is None:
+                break
+            self.request += data
+            nxt = (nxt + len(data)) % tcp.SEQMOD
+
+    @staticmethod
+    def __segment(datagram):
+        """Returns the IP and TCP packets of an unfragmented TCP datagram, or None"""
+        ippkt = ip.deserialize_ip(datagram)
+        if ippkt.proto != 6 or ippkt.flags & ip.MF or ippkt.frag > 0:
+            return None
+        return ippkt, tcp.deserialize_tcp(ippkt.data)
+
+
+class Replayer:
+    """
+    Feeds the server's side of a captured connection through the stack: a NetworkLayer validates and reassembles the
+    datagrams, a TransportLayer handles the segments and acknowledges them, and an HTTPResponse parses the responses.
+
+    The stack runs over a SimLink, where what it sends is discarded, and the captured datagrams are handed to it at the
+    times they were captured, relative to its SYN. By default the loop is a SimLoop, whose virtual clock makes the
+    replay run as fast as the code does while the stack still sees the original timing, e.g. in its RTT samples and
+    timers. With realtime, the replay runs on a normal event loop and takes as long as the original transfer.
+    """
+
+    def __init__(self, capture, realtime=False):
+        """
+        capture (Capture) - connection to replay
+        realtime (bool) - whether to replay at the original pace
+        """
+        self.capture = capture
+        self.loop = eventloop.EventLoop() if realtime else simnet.SimLoop()
+        self.link = simnet.SimLink(self.loop, mtu=capture.mtu)
+        self.pending = 0  # captured datagrams not handed to the stack yet
+        self.statuses = []  # status codes of the responses parsed
+
+    def run(self):
+        """
+        Replays the connection until the capture ends or the server closes the connection
+
+        return (dict) - metrics of the replay: MB/s of response bodies and packets/s of wall clock time, CPU seconds per
+                        MB, and counts of the datagrams and responses
+        """
+        capture = self.capture
+        ntwk = networklayer.NetworkLayer(loop=self.loop, link=self.link)
+        ntwk.connect(capture.client, capture.server)
+        trans = ReplayTransport(ntwk, capture.client[1], capture.server[1])
+        trans.seq = capture.isn  # the server's segments acknowledge the sequence numbers of the captured client
+
+        start = self.loop.time()
+        self.pending = len(capture.inbound)
+        self.__schedule(start, capture.inbound[:capture.handshake])
+
+        def readable():
+            return trans.finrecvd or (trans.rcvq is not None and trans.rcvq.readybytes > 0)
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        trans.send(bytes(capture.request))
+        # segments that arrive before the handshake is complete are ignored. When a real time replay runs late, the
+        # datagrams that are due by then are handed over at once, so those after the SYN-ACK are scheduled only now
+        self.__schedule(start, capture.inbound[capture.handshake:])
+
+        parser = httpcode.HTTPResponse()
+        received = 0
+        while True:
+            self.loop.run_until(lambda: readable() or not self.pending)
+            if not readable():
+                break  # the capture ends here
+            data = trans.recv()
+            for event, value in parser.feed(data) if data is not None else parser.close():
+                if event == httpcode.Event.HEADERS:
+                    self.statuses.append(parser.status)
+                elif event == httpcode.Event.BODY:
+                    received += len(value)
+            if data is None:
+                break
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+
+        ntwk.shutdown()
+        self.loop.close()
+
+        packets = len(capture.inbound) - self.pending
+        mb = received / 1e6
+        return {'MBps': mb / wall,
+                'packets_per_s': packets / wall,
+                'cpu_s_per_MB': cpu / mb if mb else 0.0,
+                'packets': packets,
+                'sent': self.link.up.sent,
+                'responses': len(self.statuses),
+                'body_bytes': received}
+
+    def __schedule(self, start, inbound):
+        """Schedules the injection of (offset, datagram) tuples at their offsets after start"""
+        for offset, datagram in inbound:
+            self.loop.call_at(start + offset, lambda datagram=datagram: self.__inject(datagram))
+
+    def __inject(self, datagram):
+        self.pending -= 1
+        self.link.inject(datagram)
+
+
+def replay(path, port=None, realtime=False):
+    """
+    Replays a connection of a pcap or pcapng file and returns the metrics of Replayer.run()
+
+    path (str) - capture file
+    port (int) - local port of the connection. Defaults to the first connection in the capture
+    realtime (bool) - whether to replay at the original pace
+    """
+    return Replayer(Capture(pcap.readpcap(path), port), realtime).run()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    port = None
+    realtime = False
+    while args and args[0] in ('-p', '-t'):
+        if args[0] == '-t':
+            realtime = True
+            args = args[1:]
+        elif len(args) >= 2:
+            port = int(args[1])
+            args = args[2:]
+        else:
+            break
+
+    if len(args) != 1:
+        sys.exit('usage: replay.py [-t] [-p port] capture.pcap')
+
+    for name, value in replay(args[0], port, realtime).items():
+        print('{:<14} {:.2f}'.format(name, value) if isinstance(value, float) else '{:<14} {}'.format(name, value))
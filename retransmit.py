@@ -0,0 +1,170 @@
+from collections import deque
+
+from tcp import SEQMOD, seqle, seqlt
+
+# RFC 6298 constants
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+GRANULARITY = 0.001  # resolution of our clock in seconds
+INITIAL_RTO = 1.0
+MIN_RTO = 1.0
+MAX_RTO = 60.0
+
+
+class RTOEstimator:
+    """Computes the retransmission timeout from RTT samples as described in RFC 6298"""
+
+    def __init__(self, initial=INITIAL_RTO, minrto=MIN_RTO, maxrto=MAX_RTO):
+        self.srtt = None  # smoothed round trip time. None until the first sample
+        self.rttvar = None  # round trip time variation
+        self.rto = initial
+        self.minrto = minrto
+        self.maxrto = maxrto
+
+        self.samples = 0  # RTT samples taken
+        self.lastrtt = None  # latest sample
+        self.minrtt = None  # smallest sample, the best estimate of the path's propagation delay
+
+    def sample(self, rtt):
+        """
+        Updates the estimate with a new round trip time measurement
+
+        rtt (float) - measured round trip time in seconds. Must not come from a retransmitted segment (Karn's rule)
+        """
+        self.samples += 1
+        self.lastrtt = rtt
+        if self.minrtt is None or rtt < self.minrtt:
+            self.minrtt = rtt
+
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+
+        self.rto = min(max(self.srtt + max(GRANULARITY, K * self.rttvar), self.minrto), self.maxrto)
+
+    def backoff(self):
+        """Doubles the timeout after it expired"""
+        self.rto = min(self.rto * 2, self.maxrto)
+
+
+class Unacked:
+    """A segment that has been sent but not acknowledged yet"""
+    __slots__ = ('seq', 'end', 'senttime', 'pkt', 'retransmitted')
+
+    def __init__(self, seq, end, senttime, pkt):
+        self.seq = seq  # first sequence number of the segment
+        self.end = end  # sequence number just past the segment, i.e. the ack that acknowledges all of it
+        self.senttime = senttime  # time of the last (re)transmission
+        self.pkt = pkt  # TCP packet object, kept so that it can be retransmitted
+        self.retransmitted = False
+
+
+class RetransmitQueue:
+    """
+    Segments that have been sent but not acknowledged yet, in sequence order. A cumulative ACK retires every segment
+    it covers, and only segments that were never retransmitted produce RTT samples (Karn's rule).
+    """
+
+    def __init__(self):
+        self.segments = deque()
+        self.rto = RTOEstimator()
+        self.deadline = None  # time at which the retransmission timer expires, or None if it is not running
+        self.una = None  # oldest unacknowledged sequence number
+        self.nxt = None  # sequence number just past the last segment sent
+
+    def __len__(self):
+        return len(self.segments)
+
+    def push(self, tcppkt, now):
+        """
+        Tracks a segment that was just sent for the first time. Segments that occupy no sequence space are ignored
+
+        tcppkt (TCP) - segment that was sent
+        now (float) - current time
+        """
+        seqlen = tcppkt.seqlen()
+        if seqlen == 0:
+            return
+
+        end = (tcppkt.seq + seqlen) % SEQMOD
+        if not self.segments:
+            self.una = tcppkt.seq
+        self.segments.append(Unacked(tcppkt.seq, end, now, tcppkt))
+        self.nxt = end
+        if self.deadline is None:
+            self.deadline = now + self.rto.rto
+
+    def ack(self, acknum, now, rtt=None):
+        """
+        Retires every segment that is completely covered by the given cumulative ACK, updates the RTO and restarts the
+        retransmission timer if the ACK acknowledges new data
+
+        acknum (int) - ack field of the received segment
+        now (float) - current time
+        rtt (float) - round trip time measured with the timestamp option (RFC 7323), if any. Timestamps tell which
+                      transmission is acknowledged, so such samples are also taken for retransmitted segments
+
+        return (int) - number of segments retired
+        """
+        advanced = self.segments and seqlt(self.una, acknum) and seqle(acknum, self.nxt)
+        if advanced:
+            self.una = acknum
+
+        retired = 0
+        sample = None
+        ambiguous = False
+        while self.segments and seqle(self.segments[0].end, acknum):
+            seg = self.segments.popleft()
+            ambiguous = ambiguous or seg.retransmitted
+            sample = now - seg.senttime
+            retired += 1
+
+        if retired:
+            # time the most recently sent segment, unless the ACK may have been caused by a retransmission
+            if rtt is not None:
+                self.rto.sample(rtt)
+            elif not ambiguous:
+                self.rto.sample(sample)
+
+        # restart the timer for the remaining data whenever new data is acknowledged, even if the ACK ends partway into
+        # a segment (RFC 6298 5.2 and 5.3)
+        if advanced:
+            self.deadline = now + self.rto.rto if self.segments else None
+
+        return retired
+
+    def flight(self):
+        """Returns the number of sequence numbers sent but not acknowledged yet"""
+        if not self.segments:
+            return 0
+        return (self.nxt - self.una) % SEQMOD
+
+    def expired(self, now):
+        """Returns whether the retransmission timer has expired"""
+        return self.deadline is not None and now >= self.deadline
+
+    def timeout(self, now):
+        """
+        Handles an expired retransmission timer: backs off the RTO, restarts the timer, and returns the oldest
+        unacknowledged segment, which is the only one that should be retransmitted (RFC 6298 5.4 - 5.6)
+        """
+        seg = self.segments[0]
+        seg.retransmitted = True
+        seg.senttime = now
+        self.rto.backoff()
+        self.deadline = now + self.rto.rto
+        return seg
+
+    def retransmit(self, now):
+        """
+        Returns the oldest unacknowledged segment for a fast retransmit. The timer keeps running and the RTO is not
+        backed off
+        """
+        seg = self.segments[0]
+        seg.retransmitted = True
+        seg.senttime = now
+        return seg
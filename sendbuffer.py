@@ -0,0 +1,63 @@
+from collections import deque
+
+
+class SendBuffer:
+    """
+    Data given to send() that has not been sent yet, kept as a queue of immutable chunks.
+
+    take() cuts the next segment's payload off the front as a memoryview of the chunk it lies in, so segmenting a large
+    body copies nothing. The segment keeps its view on the retransmission queue, and a retransmission sends the same
+    view again. Only a segment that spans two chunks, i.e. the boundary between two send() calls, is copied.
+    """
+
+    def __init__(self):
+        self.chunks = deque()  # memoryviews of the data, in order
+        self.offset = 0  # bytes of the first chunk that have already been taken
+        self.size = 0  # bytes not taken yet
+
+    def __len__(self):
+        return self.size
+
+    def append(self, data):
+        """
+        Adds data to the end of the buffer
+
+        data (bytes-like) - data to send. bytes objects are referenced. Anything else is copied once, since the caller
+                            may reuse its buffer
+        """
+        if not data:
+            return
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        self.chunks.append(memoryview(data))
+        self.size += len(data)
+
+    def take(self, n):
+        """
+        Removes the first n bytes from the buffer and returns them as a bytes-like object
+
+        n (int) - number of bytes to take. Must not be larger than len(self)
+        """
+        first = self.chunks[0]
+        end = self.offset + n
+        if end <= len(first):
+            view = first[self.offset:end]
+            self.__advance(n)
+            return view
+
+        # the segment spans chunks
+        parts = []
+        while n > 0:
+            first = self.chunks[0]
+            part = first[self.offset:self.offset + n]
+            parts.append(part)
+            n -= len(part)
+            self.__advance(len(part))
+        return memoryview(b''.join(parts))
+
+    def __advance(self, n):
+        self.offset += n
+        self.size -= n
+        if self.offset == len(self.chunks[0]):
+            self.chunks.popleft()
+            self.offset = 0
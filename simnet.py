@@ -0,0 +1,225 @@
+import errno
+import random
+import socket
+
+import eventloop
+import pmtu
+
+MTU = 1500
+LATENCY = 0.02  # one-way delay of a simulated link, in seconds
+BANDWIDTH = 100e6  # bits per second in each direction
+QUEUE = 256 << 10  # bytes a direction can queue before it drops datagrams, i.e. the bottleneck buffer
+
+
+class SimLoop(eventloop.EventLoop):
+    """
+    Event loop with a virtual clock, for running connections over a SimLink.
+
+    Instead of waiting, the loop jumps straight to the next timer, so a simulated transfer takes only as long as the
+    Python code it runs and gives the same result on every machine, however long it would take on a real network. Only
+    timers can be waited for; a simulation has no real sockets.
+    """
+
+    def __init__(self, start=0.0):
+        """
+        start (float) - time of the virtual clock when the loop is created
+        """
+        super().__init__()
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def _wait(self, timeout):
+        if timeout is None:
+            raise RuntimeError('simulation has no timers left to wait for')
+
+        when = self.now + timeout
+        # a timer due at the end of the wait must find the clock at its exact time, not one rounding error before it
+        if self.timers and abs(self.timers[0][0] - when) < 1e-9:
+            when = self.timers[0][0]
+        self.now = max(self.now, when)
+        return []
+
+
+class Pipe:
+    """
+    One direction of a simulated link.
+
+    Datagrams are serialized at the pipe's bandwidth one after the other, so they queue up behind each other, and a
+    datagram that finds more than queue bytes waiting is dropped, as in the buffer of a bottleneck router. Each one
+    then takes latency seconds to arrive. Independently, each datagram is lost with probability loss, held back by
+    up to reorder delay seconds with probability reorder, so that later datagrams overtake it, and delivered twice
+    with probability duplicate.
+    """
+
+    def __init__(self, loop, deliver, rng, latency=LATENCY, bandwidth=BANDWIDTH, queue=QUEUE, loss=0.0, reorder=0.0,
+                 reorderdelay=None, duplicate=0.0):
+        """
+        loop (SimLoop) - loop that delivers the datagrams
+        deliver (function) - called with each datagram when it arrives
+        rng (random.Random) - source of the random decisions, seeded for repeatable runs
+        latency (float) - one-way delay in seconds
+        bandwidth (float) - bits per second
+        queue (int) - most bytes waiting to be serialized
+        loss (float) - probability that a datagram is lost
+        reorder (float) - probability that a datagram is held back
+        reorderdelay (float) - longest a datagram is held back, in seconds. Defaults to latency
+        duplicate (float) - probability that a datagram is delivered twice
+        """
+        self.loop = loop
+        self.deliver = deliver
+        self.rng = rng
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.queue = queue
+        self.loss = loss
+        self.reorder = reorder
+        self.reorderdelay = reorderdelay if reorderdelay is not None else latency
+        self.duplicate = duplicate
+        self.busyuntil = 0  # time at which the last queued datagram has been serialized
+
+        self.sent = 0  # datagrams handed to the pipe
+        self.bytes = 0  # bytes of those datagrams
+        self.dropped = 0  # datagrams dropped because the queue was full
+        self.lost = 0  # datagrams lost at random
+        self.reordered = 0
+        self.duplicated = 0
+
+    def send(self, datagram):
+        """
+        Puts a datagram on the pipe
+
+        datagram (bytes) - datagram starting with the IP header. Must not be modified afterwards
+        """
+        now = self.loop.time()
+        self.sent += 1
+        self.bytes += len(datagram)
+
+        start = max(now, self.busyuntil)
+        if (start - now) * self.bandwidth / 8 > self.queue:
+            self.dropped += 1
+            return
+        self.busyuntil = start + len(datagram) * 8 / self.bandwidth
+
+        if self.rng.random() < self.loss:
+            self.lost += 1
+            return
+
+        arrival = self.busyuntil + self.latency
+        if self.rng.random() < self.reorder:
+            arrival += self.rng.random() * self.reorderdelay
+            self.reordered += 1
+        self.loop.call_at(arrival, lambda: self.deliver(datagram))
+        if self.rng.random() < self.duplicate:
+            self.duplicated += 1
+            self.loop.call_at(arrival, lambda: self.deliver(datagram))
+
+
+class SimSocket:
+    """The socket returned by SimLink.connect(). Supports what a NetworkLayer does with a connected raw socket"""
+
+    def __init__(self, link):
+        self.link = link
+
+    def send(self, data):
+        return self.sendmsg([data])
+
+    def sendmsg(self, buffers):
+        datagram = b''.join(buffers)
+        # like a raw socket, a datagram larger than the MTU of the interface cannot be sent
+        if len(datagram) > self.link.mtu:
+            raise OSError(errno.EMSGSIZE, 'Message too long')
+        self.link.up.send(datagram)
+        return len(datagram)
+
+    def getsockopt(self, level, option):
+        if (level, option) != (socket.IPPROTO_IP, getattr(socket, 'IP_MTU', 14)):
+            raise OSError(errno.ENOPROTOOPT, 'Protocol not available')
+        return self.link.mtu
+
+    def close(self):
+        pass
+
+
+class SimListener:
+    """Returned by SimLink.listen(). Receives the datagrams sent to the client until it is closed"""
+
+    def __init__(self, link, callback, addr):
+        self.link = link
+        self.callback = callback
+        self.addr = addr  # destination address of the datagrams to receive as 4 bytes, or None for all
+
+    def close(self):
+        if self in self.link.listeners:
+            self.link.listeners.remove(self)
+
+
+class SimLink:
+    """
+    In-memory network between the client, i.e. the NetworkLayers using the link, and simulated hosts such as
+    simserver.SimServer, driven by a SimLoop.
+
+    It is a drop-in replacement for links.RawLink, so it needs neither root nor a real server: datagrams the client
+    sends travel through the up pipe to the host their destination address is attached to, and datagrams hosts send
+    travel through the down pipe to the client. Both pipes share latency, bandwidth, queue size and impairments, and
+    take their random decisions from one generator seeded with seed, so a run can be repeated exactly.
+    """
+
+    def __init__(self, loop, mtu=MTU, seed=0, **pipeargs):
+        """
+        loop (SimLoop) - loop with the virtual clock
+        mtu (int) - MTU of the link. Larger datagrams cannot be sent
+        seed (int) - seed of the random decisions of the pipes
+        pipeargs - latency, bandwidth, queue, loss, reorder, reorderdelay and duplicate of both pipes (see Pipe)
+        """
+        self.loop = loop
+        self.mtu = mtu
+        self.rng = random.Random(seed)
+        self.up = Pipe(loop, self.__to_host, self.rng, **pipeargs)
+        self.down = Pipe(loop, self.__to_client, self.rng, **pipeargs)
+        self.paths = pmtu.PathCache(probe=self.getmtu)
+        self.hosts = dict()  # maps IP address as 4 bytes -> host receiving the datagrams sent to it
+        self.listeners = []
+        self.unreachable = 0  # datagrams sent to addresses no host is attached to
+
+    def attach(self, addr, host):
+        """
+        Connects a simulated host to the link
+
+        addr (str) - IP address of the host
+        host (object) - has a receive(datagram) method, and sends with send()
+        """
+        self.hosts[socket.inet_aton(addr)] = host
+
+    def send(self, datagram):
+        """Sends a datagram from a host to the client"""
+        self.down.send(bytes(datagram))
+
+    def inject(self, datagram):
+        """Hands a datagram to the client right away, without going through the down pipe, e.g. to replay a capture"""
+        self.__to_client(bytes(datagram))
+
+    def connect(self, remoteaddrpair):
+        return SimSocket(self)
+
+    def listen(self, callback, localaddrpair=None, size=None):
+        listener = SimListener(self, callback, socket.inet_aton(localaddrpair[0]) if localaddrpair else None)
+        self.listeners.append(listener)
+        return listener
+
+    def getmtu(self, addr):
+        return self.mtu
+
+    def __to_host(self, datagram):
+        host = self.hosts.get(datagram[16:20])
+        if host is None:
+            self.unreachable += 1
+            return
+        host.receive(datagram)
+
+    def __to_client(self, datagram):
+        # like raw sockets, every listener gets a copy of each datagram for its address
+        for listener in list(self.listeners):
+            if listener.addr is None or listener.addr == datagram[16:20]:
+                listener.callback([memoryview(datagram)])
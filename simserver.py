@@ -0,0 +1,475 @@
+import random
+import socket
+from collections import deque
+
+import fragment
+import ip
+import networklayer
+import utils
+from congestion import getcontroller
+from retransmit import RTOEstimator
+from tcp import TCPOptions, deserialize_tcp, seqle, seqlt, ACK, FIN, PSH, RST, SYN, SEQMOD
+
+WINDOW = 4 << 20  # receive window of the server, in bytes
+WSCALE = 7  # window scale the server asks for
+MINRTO = 0.2  # like Linux, rather than the 1 second of RFC 6298
+CHUNK = 8192  # largest chunk of a chunked response
+
+
+class SimConnection:
+    """
+    Server side of one TCP connection of a SimServer.
+
+    A deliberately simple but complete sender: segments of the client's MSS within the congestion window and the
+    client's window, a retransmission timer that goes back to the oldest unacknowledged byte and resends from there,
+    fast retransmit on duplicate ACKs, and the congestion control algorithms of congestion.py. With SACK, every
+    duplicate ACK during recovery retransmits the next hole the client reported, so that several losses in one window
+    are repaired in about one round trip, as RFC 6675 does. Received data is only accepted in order; anything else is
+    answered with a duplicate ACK.
+    """
+
+    def __init__(self, server, clientaddr, cport, syn):
+        """
+        server (SimServer) - server the connection belongs to
+        clientaddr (int) - IP address of the client
+        cport (int) - port of the client
+        syn (TCP) - SYN that opens the connection
+        """
+        self.server = server
+        self.loop = server.loop
+        self.key = (clientaddr, cport)
+        self.template = networklayer.HeaderTemplate(server.addrint, clientaddr, server.port, cport)
+
+        opts = syn.parseoptions()
+        self.rcvscale = WSCALE if server.wscale and opts.wscale is not None else 0
+        self.sndscale = opts.wscale if self.rcvscale else 0
+        self.tsok = server.timestamps and opts.tsval is not None
+        self.tsrecent = opts.tsval if self.tsok else 0
+        self.sackok = server.sack and opts.sackok
+        self.mss = min(opts.mss if opts.mss is not None else 536, server.link.mtu - 40)
+        if self.tsok:
+            self.mss -= 12
+
+        self.iss = server.rng.getrandbits(32)
+        self.rcvnxt = (syn.seq + 1) % SEQMOD
+        self.snduna = self.iss
+        self.sndnxt = (self.iss + 1) % SEQMOD
+        self.sndmax = self.sndnxt  # highest sequence number sent, which sndnxt returns to after a timeout
+        self.peerwnd = syn.window  # the window of a SYN is never scaled
+
+        self.out = deque()  # memoryviews of the responses not acknowledged yet, starting at outseq
+        self.outseq = self.sndnxt
+        self.outlen = 0
+        self.inbuf = bytearray()  # request bytes received but not parsed yet
+        self.served = 0  # requests answered
+
+        self.cc = getcontroller(server.congestion, self.mss)
+        self.rto = RTOEstimator(minrto=MINRTO)
+        self.timer = None
+        self.timing = None  # (seq, time) of the segment being timed, if timestamps are off
+        self.sacked = []  # (left, right) blocks above snduna the client reported, in sequence order
+        self.highrxt = None  # during recovery, sequence number up to which holes have been retransmitted
+        self.established = False
+        self.finrcvd = False
+        self.closing = False  # whether to close once every response has been sent
+        self.finseq = None  # sequence number of our FIN once it has been sent
+
+        self.__send_syn()
+
+    def __tsnow(self):
+        return int(self.loop.time() * 1000) % SEQMOD
+
+    def __emit(self, seq, flags, data=None, options=None):
+        if self.tsok and options is None:
+            options = TCPOptions(tsval=self.__tsnow(), tsecr=self.tsrecent).serialize()
+        window = min(WINDOW >> self.rcvscale, 0xffff)
+        if flags & SYN:
+            window = min(WINDOW, 0xffff)
+        self.server.idnum = (self.server.idnum + 1) & 0xffff
+        hdr = self.template.build(self.server.idnum, seq, self.rcvnxt, flags, window, options, data)
+        self.server.link.send(hdr + data if data is not None else hdr)
+        self.server.segments += 1
+
+    def __send_syn(self):
+        """Sends the SYN-ACK, and retransmits it until the client's ACK arrives"""
+        opts = TCPOptions(mss=self.server.link.mtu - 40, sackok=self.sackok)
+        if self.rcvscale:
+            opts.wscale = self.rcvscale
+        if self.tsok:
+            opts.tsval = self.__tsnow()
+            opts.tsecr = self.tsrecent
+        self.__emit(self.iss, SYN | ACK, options=opts.serialize())
+        self.__arm_timer()
+
+    def __arm_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = self.loop.call_later(self.rto.rto, self.__on_timer)
+
+    def __stop_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def __flight(self):
+        return (self.sndnxt - self.snduna) % SEQMOD
+
+    def __slice(self, offset, n):
+        """Returns n bytes of the responses, starting offset bytes after outseq"""
+        parts = []
+        for chunk in self.out:
+            if offset >= len(chunk):
+                offset -= len(chunk)
+                continue
+            part = chunk[offset:offset + n]
+            parts.append(part)
+            n -= len(part)
+            offset = 0
+            if n == 0:
+                break
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def __trim(self, acked):
+        """Forgets the first acked bytes of the responses"""
+        self.outlen -= acked
+        self.outseq = (self.outseq + acked) % SEQMOD
+        while acked > 0:
+            chunk = self.out[0]
+            if acked < len(chunk):
+                self.out[0] = chunk[acked:]
+                return
+            acked -= len(chunk)
+            self.out.popleft()
+
+    def __push(self):
+        """Sends as much new data as the windows allow, then our FIN once the client has everything"""
+        while self.established:
+            offset = (self.sndnxt - self.outseq) % SEQMOD
+            unsent = self.outlen - offset
+            if unsent <= 0:
+                break
+            n = min(unsent, self.mss, min(self.cc.window(), self.peerwnd) - self.__flight())
+            if n <= 0:
+                break
+            self.__emit(self.sndnxt, ACK | PSH if n == unsent else ACK, self.__slice(offset, n))
+            if self.timing is None and not self.tsok and self.sndnxt == self.sndmax:
+                self.timing = (self.sndnxt, self.loop.time())
+            self.sndnxt = (self.sndnxt + n) % SEQMOD
+            if seqlt(self.sndmax, self.sndnxt):
+                self.sndmax = self.sndnxt
+            if self.timer is None:
+                self.__arm_timer()
+
+        # with the client's window closed and nothing in flight, only the timer can get things moving again
+        if self.timer is None and self.outlen > 0 and self.__flight() == 0:
+            self.__arm_timer()
+
+        if (self.closing or self.finrcvd) and self.finseq is None and self.outlen == 0 and self.established:
+            self.finseq = self.sndnxt
+            self.__emit(self.finseq, FIN | ACK)
+            self.sndnxt = self.sndmax = (self.finseq + 1) % SEQMOD
+            self.__arm_timer()
+
+    def __retransmit(self):
+        """Sends the oldest unacknowledged segment again"""
+        if not self.established:
+            self.__send_syn()
+            return
+        n = min(self.outlen, self.mss, self.__flight())
+        if n > 0:
+            self.__emit(self.snduna, ACK, self.__slice(0, n))
+            self.highrxt = (self.snduna + n) % SEQMOD
+        elif self.finseq is not None:
+            self.__emit(self.finseq, FIN | ACK)
+        self.server.retransmits += 1
+
+    def __retransmit_hole(self):
+        """Retransmits the next part of the data below the highest SACKed byte that was neither SACKed nor resent"""
+        if not self.sacked or self.highrxt is None:
+            return
+        start = self.highrxt if seqlt(self.snduna, self.highrxt) else self.snduna
+        for left, right in self.sacked:
+            if seqlt(start, left):
+                n = min((left - start) % SEQMOD, self.mss)
+                self.__emit(start, ACK, self.__slice((start - self.outseq) % SEQMOD, n))
+                self.highrxt = (start + n) % SEQMOD
+                self.server.retransmits += 1
+                return
+            if seqlt(start, right):
+                start = right
+
+    def __update_sacked(self, blocks):
+        """Merges the SACK blocks of an ACK into the scoreboard and forgets what snduna has passed"""
+        merged = []
+        for left, right in sorted(self.sacked + (blocks or []), key=lambda b: (b[0] - self.snduna) % SEQMOD):
+            if not seqlt(self.snduna, right) or seqlt(self.sndmax, right):
+                continue
+            if seqlt(left, self.snduna):
+                left = self.snduna
+            if merged and seqle(left, merged[-1][1]):
+                if seqlt(merged[-1][1], right):
+                    merged[-1] = (merged[-1][0], right)
+            else:
+                merged.append((left, right))
+        self.sacked = merged
+
+    def __on_timer(self):
+        self.timer = None
+        if not self.established:
+            self.rto.backoff()
+            self.__send_syn()
+            return
+        if self.__flight() == 0:
+            if self.outlen > 0:
+                # the client's window is closed: probe it with one byte
+                self.__emit(self.sndnxt, ACK, self.__slice((self.sndnxt - self.outseq) % SEQMOD, 1))
+                self.sndnxt = self.sndmax = (self.sndnxt + 1) % SEQMOD
+                self.__arm_timer()
+            return
+
+        self.server.timeouts += 1
+        self.rto.backoff()
+        self.timing = None
+        self.cc.timeout(self.__flight(), self.loop.time())
+        self.sacked = []
+        self.highrxt = None
+
+        # go back to the oldest unacknowledged byte and send everything from there again
+        self.__retransmit()
+        if self.finseq is None or self.outlen > 0:
+            self.sndnxt = (self.snduna + min(self.outlen, self.mss)) % SEQMOD
+        self.__arm_timer()
+
+    def receive(self, seg):
+        """Handles a segment from the client"""
+        if seg.flags & RST:
+            self.close()
+            return
+
+        opts = seg.parseoptions() if seg.dataofs > 5 else None
+        if self.tsok and opts is not None and opts.tsval is not None and seqle(seg.seq, self.rcvnxt):
+            self.tsrecent = opts.tsval
+
+        if seg.flags & ACK:
+            self.__on_ack(seg, opts)
+
+        data = seg.data if seg.data is not None else b''
+        if data or seg.flags & FIN:
+            if seg.seq == self.rcvnxt and not self.finrcvd:
+                self.rcvnxt = (self.rcvnxt + len(data)) % SEQMOD
+                self.inbuf += data
+                if seg.flags & FIN:
+                    self.rcvnxt = (self.rcvnxt + 1) % SEQMOD
+                    self.finrcvd = True
+                self.__parse()
+            # every segment with data is acknowledged right away, duplicates and out of order ones included
+            if not self.__pending_output():
+                self.__emit(self.sndnxt, ACK)
+
+        self.__push()
+        if self.finrcvd and self.finseq is not None and self.snduna == self.sndmax:
+            self.close()
+
+    def __pending_output(self):
+        """Returns whether __push will send a segment, which then carries the ACK"""
+        unsent = self.outlen - (self.sndnxt - self.outseq) % SEQMOD
+        return self.established and unsent > 0 and min(self.cc.window(), self.peerwnd) > self.__flight()
+
+    def __on_ack(self, seg, opts):
+        now = self.loop.time()
+        acknum = seg.ack
+        if not self.established:
+            if acknum != (self.iss + 1) % SEQMOD:
+                return
+            self.established = True
+            self.snduna = acknum
+            self.peerwnd = seg.window << self.sndscale
+            self.__stop_timer()
+            if opts is not None and opts.tsecr:
+                self.rto.sample(((self.__tsnow() - opts.tsecr) % SEQMOD) / 1000)
+            return
+
+        flight = self.__flight()
+        window = seg.window << self.sndscale
+        if seqlt(self.snduna, acknum) and seqle(acknum, self.sndmax):
+            # a timeout moved sndnxt back, and data sent before it may still be acknowledged
+            if seqlt(self.sndnxt, acknum):
+                self.sndnxt = acknum
+            acked = (acknum - self.snduna) % SEQMOD
+            self.snduna = acknum
+            datalen = min(acked, self.outlen)
+            self.__trim(datalen)
+
+            if self.tsok and opts is not None and opts.tsecr:
+                self.rto.sample(((self.__tsnow() - opts.tsecr) % SEQMOD) / 1000)
+            elif self.timing is not None and seqlt(self.timing[0], acknum):
+                self.rto.sample(now - self.timing[1])
+                self.timing = None
+
+            self.peerwnd = window
+            self.cc.rtt = self.rto.srtt
+            if self.sackok:
+                self.__update_sacked(opts.sack if opts is not None else None)
+            if self.cc.ack(acknum, acked, False, flight, self.sndnxt, now) and \
+                    not (self.sacked and self.highrxt is not None and seqlt(self.snduna, self.highrxt)):
+                self.__retransmit()
+            elif self.cc.inrecovery:
+                # the partial ACK's hole may have been resent already
+                self.__retransmit_hole()
+            if self.__flight() > 0:
+                self.__arm_timer()
+            else:
+                self.__stop_timer()
+            return
+
+        isdup = acknum == self.snduna and flight > 0 and not seg.data and window == self.peerwnd
+        self.peerwnd = window
+        if self.sackok and opts is not None and opts.sack:
+            self.__update_sacked(opts.sack)
+        if self.cc.ack(acknum, 0, isdup, flight, self.sndnxt, now):
+            self.__retransmit()
+        elif isdup and self.cc.inrecovery:
+            self.__retransmit_hole()
+
+    def __parse(self):
+        """Answers every complete request received so far, up to the one after which the connection closes"""
+        while not self.closing:
+            end = self.inbuf.find(b'\r\n\r\n')
+            if end < 0:
+                return
+            head = bytes(self.inbuf[:end]).decode('ascii', errors='replace')
+            del self.inbuf[:end + 4]
+
+            lines = head.split('\r\n')
+            headers = dict()
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            # like the keep-alive limit of real servers, the last request a connection answers is told it closes
+            self.served += 1
+            last = self.server.maxrequests is not None and self.served >= self.server.maxrequests
+            for chunk in self.server.respond(lines[0], headers, last):
+                self.out.append(memoryview(chunk))
+                self.outlen += len(chunk)
+            if last or headers.get('connection', '').lower() == 'close':
+                self.closing = True
+
+    def close(self):
+        self.__stop_timer()
+        self.server.connections.pop(self.key, None)
+
+
+class SimServer:
+    """
+    Scripted HTTP server on a simulated host, to run the client against over a SimLink.
+
+    It serves the given files over its own small TCP implementation (see SimConnection), with persistent connections,
+    pipelining, single byte ranges, chunked bodies and a limit of requests per connection, so that rawhttpget, range
+    downloads and the connection pool can all be run against it. Everything it does is decided by the loop's virtual
+    clock and a seeded generator, so runs repeat exactly.
+    """
+
+    def __init__(self, link, addr, files=None, port=80, congestion='newreno', wscale=True, sack=True, timestamps=True,
+                 seed=0, chunked=False, maxrequests=None, ranges=True):
+        """
+        link (SimLink) - link to attach to
+        addr (str) - IP address of the server
+        files (dict) - maps path -> bytes-like content
+        port (int) - port to listen on
+        congestion (str) - congestion control algorithm of the server: 'reno', 'newreno' or 'cubic'
+        wscale (bool) - whether to accept window scaling
+        sack (bool) - whether to accept SACK
+        timestamps (bool) - whether to accept timestamps
+        seed (int) - seed of the initial sequence numbers
+        chunked (bool) - whether to send bodies with chunked encoding instead of Content-Length
+        maxrequests (int) - if given, requests answered on a connection before the server closes it
+        ranges (bool) - whether to answer Range requests with part of the file. If False, the whole file is sent
+        """
+        self.link = link
+        self.loop = link.loop
+        self.addr = addr
+        self.addrint = utils.addrtoint(addr)
+        self.files = files if files is not None else dict()
+        self.port = port
+        self.congestion = congestion
+        self.wscale = wscale
+        self.sack = sack
+        self.timestamps = timestamps
+        self.chunked = chunked
+        self.maxrequests = maxrequests
+        self.ranges = ranges
+        self.rng = random.Random(seed)
+        self.reassembler = fragment.Reassembler(self.loop)
+        self.connections = dict()  # maps (client address, client port) -> SimConnection
+        self.idnum = 0
+
+        self.accepted = 0  # connections opened by the client
+        self.requests = 0
+        self.segments = 0  # segments sent
+        self.retransmits = 0
+        self.timeouts = 0
+        link.attach(addr, self)
+
+    def receive(self, datagram):
+        """Handles a datagram from the link"""
+        ip_pkt = ip.deserialize_ip(datagram)
+        if not ip_pkt.valid_checksum() or ip_pkt.proto != socket.IPPROTO_TCP:
+            return
+        if ip_pkt.flags & ip.MF or ip_pkt.frag > 0:
+            ip_pkt = self.reassembler.add(ip_pkt)
+            if ip_pkt is None:
+                return
+        if utils.checksum16(utils.getpseudoheader(ip_pkt) + ip_pkt.data) != 0:
+            return
+
+        seg = deserialize_tcp(ip_pkt.data)
+        if seg.dport != self.port:
+            return
+        key = (ip_pkt.src, seg.sport)
+        conn = self.connections.get(key)
+        if seg.flags & SYN and not seg.flags & ACK:
+            if conn is None:
+                self.connections[key] = SimConnection(self, ip_pkt.src, seg.sport, seg)
+                self.accepted += 1
+            return
+        if conn is not None:
+            conn.receive(seg)
+
+    def respond(self, requestline, headers, close=False):
+        """
+        Returns the response to a request as a list of bytes-like chunks
+
+        requestline (str) - e.g. 'GET /index.html HTTP/1.1'
+        headers (dict) - maps lowercase header name -> value
+        close (bool) - whether the connection closes after this response
+        """
+        self.requests += 1
+        extra = 'Connection: close\r\n' if close else ''
+        parts = requestline.split(' ')
+        body = self.files.get(parts[1]) if len(parts) == 3 and parts[0] == 'GET' else None
+        if body is None:
+            return ['HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n{}\r\n'.format(extra).encode('ascii')]
+
+        status = '200 OK'
+        start, end = 0, len(body)
+        rng = headers.get('range', '')
+        if self.ranges and rng.startswith('bytes='):
+            first, _, last = rng[6:].partition('-')
+            start = int(first)
+            end = min(int(last) + 1, len(body)) if last else len(body)
+            status = '206 Partial Content'
+            extra += 'Content-Range: bytes {}-{}/{}\r\n'.format(start, end - 1, len(body))
+
+        body = memoryview(body)[start:end]
+        if not self.chunked:
+            head = 'HTTP/1.1 {}\r\nContent-Length: {}\r\n{}\r\n'.format(status, len(body), extra)
+            return [head.encode('ascii'), body]
+
+        head = 'HTTP/1.1 {}\r\nTransfer-Encoding: chunked\r\n{}\r\n'.format(status, extra)
+        chunks = [head.encode('ascii')]
+        for offset in range(0, len(body), CHUNK):
+            piece = body[offset:offset + CHUNK]
+            chunks.extend(['{:x}\r\n'.format(len(piece)).encode('ascii'), piece, b'\r\n'])
+        chunks.append(b'0\r\n\r\n')
+        return chunks
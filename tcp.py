@@ -1,3 +1,5 @@
+import struct
+
 import utils
 
 """
@@ -43,58 +45,237 @@ FIN = 0x0001
 flagvals = [URG, ACK, PSH, RST, SYN, FIN]
 flagstrs = ['U', 'A', 'P', 'R', 'S', 'F']
 
+SEQMOD = 1 << 32  # sequence numbers wrap around at 2^32
 
-def deserialize_tcp(slz):
+
+def seqlt(a, b):
+    """Returns whether sequence number a comes before b, taking wraparound into account (RFC 1982)"""
+    return a != b and (b - a) % SEQMOD < SEQMOD // 2
+
+
+def seqle(a, b):
+    """Returns whether sequence number a comes before or is equal to b"""
+    return (b - a) % SEQMOD < SEQMOD // 2
+
+
+# string form of the 6 flag bits of a TCP header, indexed by their value
+FLAGCOMBOS = [''.join(flagstrs[i] for i in range(len(flagvals)) if v & flagvals[i]) for v in range(64)]
+
+
+def parseflags(flags):
     """
-    Deserializes an TCP object from the given bytearray, or throws an exception if serialization failed
+    Converts TCP flags given as a string (e.g. 'SA') into the bitmask used by the TCP class. Bitmasks are returned
+    unchanged
     """
-    if len(slz) < 20:
-        raise RuntimeError('TCP buffer length too small: {}'.format(len(slz)))
+    errstr = 'invalid TCP flags field provided: {}'.format(flags)
 
-    pkt = TCP()
+    if isinstance(flags, int):
+        if flags & ~0x3F != 0:
+            raise RuntimeError(errstr)
+        return flags
 
-    pkt.sport = utils.deserializeint(slz[0:2])
-    pkt.dport = utils.deserializeint(slz[2:4])
-    pkt.seq = utils.deserializeint(slz[4:8])
-    pkt.ack = utils.deserializeint(slz[8:12])
+    if len(flags) > 6:
+        raise RuntimeError(errstr)
 
-    offset_flags = utils.deserializeint(slz[12:14])
-    pkt.dataofs = offset_flags >> 12
+    out = 0
+    for c in flags:
+        if c not in flagstrs:
+            raise RuntimeError(errstr)
+        out |= flagvals[flagstrs.index(c)]
+
+    return out
 
-    for i in range(len(flagvals)):
-        if offset_flags & flagvals[i] != 0:
-            pkt.flags += flagstrs[i]
+# option kinds (RFC 9293, RFC 7323, RFC 2018)
+OPT_EOL = 0
+OPT_NOP = 1
+OPT_MSS = 2
+OPT_WSCALE = 3
+OPT_SACKOK = 4
+OPT_SACK = 5
+OPT_TIMESTAMP = 8
 
-    pkt.window = utils.deserializeint(slz[14:16])
-    pkt.chksum = utils.deserializeint(slz[16:18])
-    pkt.urgptr = utils.deserializeint(slz[18:20])
+MAXOPTLEN = 40  # the data offset field leaves room for at most 40 bytes of options
+MAXWSCALE = 14  # largest window scale shift allowed by RFC 7323
 
-    if pkt.dataofs > 5:
-        pkt.options = slz[20:pkt.dataofs*4]
+OPTMSS = struct.Struct('!BBH')
+OPTTIMESTAMP = struct.Struct('!BBBBII')  # preceded by 2 NOPs so that the values are 4-byte aligned
+OPTSACKBLOCK = struct.Struct('!II')
 
-    if len(slz) > pkt.dataofs*4:
-        pkt.data = slz[pkt.dataofs*4:len(slz)]
+
+class TCPOptions:
+    """
+    Decoded TCP options. Fields of options that are absent are None (or False for sackok)
+
+    Options are serialized in the layout most stacks use, padded with NOPs so that every multi-byte value is aligned:
+    MSS, window scale, SACK-permitted, timestamps, then SACK blocks.
+    """
+    __slots__ = ('mss', 'wscale', 'sackok', 'tsval', 'tsecr', 'sack')
+
+    def __init__(self, mss=None, wscale=None, sackok=False, tsval=None, tsecr=None, sack=None):
+        """
+        mss (int) - maximum segment size. Only sent on SYNs
+        wscale (int) - window scale shift. Only sent on SYNs
+        sackok (bool) - whether SACK is permitted. Only sent on SYNs
+        tsval (int) - timestamp value. If set, tsecr is sent as well
+        tsecr (int) - timestamp echo reply
+        sack (list) - (left edge, right edge) sequence number pairs of received out of order blocks
+        """
+        self.mss = mss
+        self.wscale = wscale
+        self.sackok = sackok
+        self.tsval = tsval
+        self.tsecr = tsecr
+        self.sack = sack
+
+    def serialize(self):
+        """
+        Returns the options as bytes padded to a multiple of 4, or None if there are none. SACK blocks that do not fit
+        in the 40 bytes of option space are left out
+        """
+        slz = bytearray()
+        if self.mss is not None:
+            slz.extend(OPTMSS.pack(OPT_MSS, 4, self.mss))
+        if self.wscale is not None:
+            slz.extend((OPT_NOP, OPT_WSCALE, 3, self.wscale))
+        if self.sackok:
+            slz.extend((OPT_NOP, OPT_NOP, OPT_SACKOK, 2))
+        if self.tsval is not None:
+            tsecr = self.tsecr if self.tsecr is not None else 0
+            slz.extend(OPTTIMESTAMP.pack(OPT_NOP, OPT_NOP, OPT_TIMESTAMP, 10, self.tsval, tsecr))
+        if self.sack:
+            n = min(len(self.sack), (MAXOPTLEN - len(slz) - 4) // OPTSACKBLOCK.size)
+            if n > 0:
+                slz.extend((OPT_NOP, OPT_NOP, OPT_SACK, 2 + n * OPTSACKBLOCK.size))
+                for left, right in self.sack[:n]:
+                    slz.extend(OPTSACKBLOCK.pack(left, right))
+
+        if not slz:
+            return None
+        return bytes(slz)
+
+
+def deserialize_options(slz):
+    """
+    Decodes the options of a TCP header into a TCPOptions object, or throws an exception if they are malformed.
+    Unknown options are skipped
+
+    slz (bytes-like) - the options, i.e. the bytes between the fixed header and the payload, or None
+    """
+    opts = TCPOptions()
+    if slz is None:
+        return opts
+
+    buf = memoryview(slz)
+    i = 0
+    while i < len(buf):
+        kind = buf[i]
+        if kind == OPT_EOL:
+            break
+        if kind == OPT_NOP:
+            i += 1
+            continue
+
+        if i + 1 >= len(buf) or buf[i + 1] < 2 or i + buf[i + 1] > len(buf):
+            raise RuntimeError('malformed TCP option of kind {}'.format(kind))
+        optlen = buf[i + 1]
+
+        if kind == OPT_MSS and optlen == 4:
+            opts.mss = OPTMSS.unpack_from(buf, i)[2]
+        elif kind == OPT_WSCALE and optlen == 3:
+            opts.wscale = min(buf[i + 2], MAXWSCALE)
+        elif kind == OPT_SACKOK and optlen == 2:
+            opts.sackok = True
+        elif kind == OPT_TIMESTAMP and optlen == 10:
+            opts.tsval, opts.tsecr = struct.unpack_from('!II', buf, i + 2)
+        elif kind == OPT_SACK and (optlen - 2) % OPTSACKBLOCK.size == 0:
+            opts.sack = [OPTSACKBLOCK.unpack_from(buf, j) for j in range(i + 2, i + optlen, OPTSACKBLOCK.size)]
+        i += optlen
+
+    return opts
+
+
+# source port, destination port, seq, ack, data offset/flags, window, checksum. urgptr is decoded lazily
+TCPHDR = struct.Struct('!HHIIHHH')
+
+LAZY = object()  # placeholder for header fields that are decoded from the raw buffer on first access
+
+
+def deserialize_tcp(slz):
+    """
+    Deserializes an TCP object from the given bytes-like object, or throws an exception if serialization failed
+
+    Like ip.deserialize_ip, this does not copy: urgptr and options are decoded on first access and the payload is a
+    memoryview of slz.
+    """
+    buf = memoryview(slz)
+    if len(buf) < 20:
+        raise RuntimeError('TCP buffer length too small: {}'.format(len(buf)))
+
+    pkt = TCP.__new__(TCP)
+    pkt.raw = buf
+
+    pkt.sport, pkt.dport, pkt.seq, pkt.ack, offset_flags, pkt.window, pkt.chksum = TCPHDR.unpack_from(buf)
+    pkt.dataofs = offset_flags >> 12
+    pkt.flags = offset_flags & 0x3F
+
+    pkt._urgptr = LAZY
+    pkt._options = LAZY if pkt.dataofs > 5 else None
+
+    hdrlen = pkt.dataofs*4
+    pkt.data = buf[hdrlen:] if len(buf) > hdrlen else None
 
     return pkt
 
 
 class TCP:
-    """Serializer and deserializer class for IP datagrams"""
+    """
+    Serializer and deserializer class for TCP segments
+
+    Flags are stored as a bitmask of URG, ACK, PSH, RST, SYN and FIN. They may be given to the constructor as a string
+    (e.g. 'SA') for convenience.
+    """
+    __slots__ = ('sport', 'dport', 'seq', 'ack', 'dataofs', 'flags', 'window', 'chksum', '_urgptr', '_options', 'data',
+                 'raw')
 
     def __init__(self, sport=20, dport=80, seq=0, ack=0,
-                 dataofs=5, flags='', window=8192,
+                 dataofs=5, flags=0, window=8192,
                  urgptr=0, options=None, data=None):
         self.sport = sport
         self.dport = dport
         self.seq = seq
         self.ack = ack
         self.dataofs = dataofs
-        self.flags = flags
+        self.flags = parseflags(flags)
         self.window = window
         self.chksum = 0x0000
         self.urgptr = urgptr
         self.options = options
         self.data = data
+        self.raw = None  # buffer this packet was deserialized from, if any
+
+    @property
+    def urgptr(self):
+        if self._urgptr is LAZY:
+            self._urgptr = int.from_bytes(self.raw[18:20], byteorder='big')
+        return self._urgptr
+
+    @urgptr.setter
+    def urgptr(self, value):
+        self._urgptr = value
+
+    @property
+    def options(self):
+        if self._options is LAZY:
+            self._options = self.raw[20:self.dataofs*4]
+        return self._options
+
+    @options.setter
+    def options(self, value):
+        self._options = value
+
+    def parseoptions(self):
+        """Returns the options of this segment decoded into a TCPOptions object"""
+        return deserialize_options(self.options)
 
     def show(self):
         print('###[ TCP ]### ')
@@ -103,22 +284,12 @@ class TCP:
         print('  seq: {}'.format(self.seq))
         print('  ack: {}'.format(self.ack))
         print('  dataofs: {}'.format(self.dataofs))
-        print('  flags: {}'.format(self.flags))
+        print('  flags: {}'.format(FLAGCOMBOS[self.flags]))
         print('  window: {}'.format(self.window))
         print('  chksum: {}'.format(self.chksum))
         print('  urgptr: {}'.format(self.urgptr))
-        print('  options: {}'.format(self.options))
-        print('  data: {}'.format(self.data))
-
-    def __checkflags(self, flags):
-        errstr = 'invalid TCP flags field provided: {}'.format(flags)
-
-        if len(flags) > 6:
-            raise RuntimeError(errstr)
-
-        for c in range(len(flags)):
-            if flags[c] not in ['U', 'A', 'P', 'R', 'S', 'F']:
-                raise RuntimeError(errstr)
+        print('  options: {}'.format(None if self.options is None else bytes(self.options)))
+        print('  data: {}'.format(None if self.data is None else bytes(self.data)))
 
     def compute_checksum(self, ip):
         ip_pseudohdr = utils.getpseudoheader(ip)
@@ -126,6 +297,27 @@ class TCP:
         ip_pseudohdr.extend(tcp_slz)
         self.chksum = utils.checksum16(ip_pseudohdr)
 
+    def update(self, seq=None, ack=None, window=None):
+        """
+        Changes the given header fields and patches the checksum incrementally (RFC 1624) rather than recomputing it
+        over the whole segment. The checksum must already be valid, i.e. compute_checksum must have been called.
+
+        seq (int) - new sequence number, or None to leave it unchanged
+        ack (int) - new acknowledgement number, or None to leave it unchanged
+        window (int) - new window, or None to leave it unchanged
+        """
+        if seq is not None and seq != self.seq:
+            self.chksum = utils.updatechecksum32(self.chksum, self.seq, seq)
+            self.seq = seq
+
+        if ack is not None and ack != self.ack:
+            self.chksum = utils.updatechecksum32(self.chksum, self.ack, ack)
+            self.ack = ack
+
+        if window is not None and window != self.window:
+            self.chksum = utils.updatechecksum16(self.chksum, self.window, window)
+            self.window = window
+
     def serialize(self):
         """Serializes this TCP packet into a bytearray that can be sent over a raw socket"""
         slz = bytearray()
@@ -135,13 +327,12 @@ class TCP:
         slz.extend(utils.serialize32(self.seq))
         slz.extend(utils.serialize32(self.ack))
 
-        # Build 16-bit value for data offset and flags
-        offset_flags = self.dataofs << 12
-        self.__checkflags(self.flags)
+        # the data offset covers the options, which are padded to a multiple of 4 bytes
+        if self.options is not None:
+            self.dataofs = 5 + (len(self.options) + 3) // 4
 
-        for c in range(len(self.flags)):
-            idx = flagstrs.index(self.flags[c])
-            offset_flags |= flagvals[idx]
+        # Build 16-bit value for data offset and flags
+        offset_flags = (self.dataofs << 12) | parseflags(self.flags)
 
         slz.extend(utils.serialize16(offset_flags))
         slz.extend(utils.serialize16(self.window))
@@ -151,8 +342,61 @@ class TCP:
         # append options and data if necessary
         if self.options is not None:
             slz.extend(self.options)
+            slz.extend(bytes(-len(self.options) % 4))
 
         if self.data is not None:
             slz.extend(self.data)
 
         return slz
+
+    def seqlen(self):
+        """Returns the amount of sequence space this segment occupies: its payload plus one for each of SYN and FIN"""
+        n = len(self.data) if self.data is not None else 0
+        if self.flags & SYN:
+            n += 1
+        if self.flags & FIN:
+            n += 1
+        return n
+
+
+class TCPPool:
+    """
+    Freelist of TCP objects. Lets code that sends a segment and immediately forgets about it (e.g. pure ACKs) reuse
+    packet objects instead of allocating a new one each time
+    """
+
+    def __init__(self, maxsize=64):
+        """
+        maxsize (int) - maximum number of free packets to keep around
+        """
+        self.maxsize = maxsize
+        self.free = []
+
+    def acquire(self, sport=20, dport=80, seq=0, ack=0, flags=0, window=8192, options=None, data=None):
+        """Returns a TCP object with the given fields set, reusing a released object if one is available"""
+        if not self.free:
+            return TCP(sport=sport, dport=dport, seq=seq, ack=ack, flags=flags, window=window, options=options,
+                       data=data)
+
+        pkt = self.free.pop()
+        pkt.sport = sport
+        pkt.dport = dport
+        pkt.seq = seq
+        pkt.ack = ack
+        pkt.dataofs = 5
+        pkt.flags = parseflags(flags)
+        pkt.window = window
+        pkt.chksum = 0x0000
+        pkt.urgptr = 0
+        pkt.options = options
+        pkt.data = data
+        pkt.raw = None
+        return pkt
+
+    def release(self, pkt):
+        """Returns the given packet to the pool. The caller must not use it afterwards"""
+        if len(self.free) < self.maxsize:
+            pkt.data = None
+            pkt.raw = None
+            pkt.options = None
+            self.free.append(pkt)
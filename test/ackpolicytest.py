@@ -0,0 +1,51 @@
+import sys
+import unittest
+
+sys.path.append('../')
+import ackpolicy
+
+
+class AckPolicyTest(unittest.TestCase):
+    def testeverysecondsegment(self):
+        policy = ackpolicy.AckPolicy(mss=536, every=2, delay=0.04)
+        self.assertFalse(policy.received(1448, 0.0))
+        self.assertEqual(policy.deadline, 0.04)
+
+        # the first segment made 1448 bytes a full segment
+        self.assertTrue(policy.received(1448, 0.01))
+        policy.acked()
+        self.assertFalse(policy.pending)
+        self.assertIsNone(policy.deadline)
+        self.assertEqual(policy.saved, 1)
+
+    def testdelayedack(self):
+        policy = ackpolicy.AckPolicy(delay=0.04)
+        self.assertFalse(policy.received(100, 1.0))
+        self.assertFalse(policy.received(100, 1.02))  # the timer does not restart
+        self.assertFalse(policy.due(1.03))
+        self.assertTrue(policy.due(1.04))
+
+        policy.acked()
+        self.assertFalse(policy.due(2.0))
+
+    def testimmediate(self):
+        policy = ackpolicy.AckPolicy()
+        self.assertTrue(policy.received(1000, 0.0, immediate=True))
+        self.assertEqual(policy.immediate, 1)
+
+        # acknowledging every segment
+        policy = ackpolicy.AckPolicy(every=1)
+        self.assertTrue(policy.received(1000, 0.0))
+
+    def testpiggyback(self):
+        policy = ackpolicy.AckPolicy()
+        policy.acked()  # nothing was pending
+        self.assertEqual(policy.acks, 0)
+
+        policy.received(100, 0.0)
+        policy.acked()
+        self.assertEqual((policy.segments, policy.acks, policy.saved), (1, 1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import sys
+import unittest
+
+sys.path.append('../')
+import congestion
+
+MSS = 1000
+
+
+class CongestionTest(unittest.TestCase):
+    def testslowstart(self):
+        cc = congestion.NewReno(MSS)
+        self.assertEqual(cc.window(), 4 * MSS)
+
+        # one segment per ACK, even for a stretch ACK
+        cc.ack(1000, 1000, False, 4000, 4000, 0.0)
+        cc.ack(3000, 2000, False, 3000, 4000, 0.0)
+        self.assertEqual(cc.window(), 6 * MSS)
+
+    def testcongestionavoidance(self):
+        cc = congestion.Reno(MSS)
+        cc.cwnd = cc.ssthresh = 4 * MSS
+        for i in range(4):
+            cc.ack((i + 1) * MSS, MSS, False, 4 * MSS, 4 * MSS, 0.0)
+        self.assertEqual(cc.window(), 5 * MSS)
+
+    def testfastrecovery(self):
+        cc = congestion.NewReno(MSS)
+        cc.cwnd = 10 * MSS
+
+        # three duplicate ACKs trigger a single fast retransmit
+        self.assertFalse(cc.ack(0, 0, True, 10 * MSS, 10 * MSS, 0.0))
+        self.assertFalse(cc.ack(0, 0, False, 10 * MSS, 10 * MSS, 0.0))  # window update, not a duplicate
+        self.assertFalse(cc.ack(0, 0, True, 10 * MSS, 10 * MSS, 0.0))
+        self.assertTrue(cc.ack(0, 0, True, 10 * MSS, 10 * MSS, 0.0))
+        self.assertTrue(cc.inrecovery)
+        self.assertEqual(cc.ssthresh, 5 * MSS)
+        self.assertEqual(cc.window(), 8 * MSS)
+
+        # inflation by one segment per further duplicate
+        self.assertFalse(cc.ack(0, 0, True, 10 * MSS, 10 * MSS, 0.0))
+        self.assertEqual(cc.window(), 9 * MSS)
+
+        # a partial ACK retransmits the next hole and stays in recovery
+        self.assertTrue(cc.ack(3 * MSS, 3 * MSS, False, 10 * MSS, 10 * MSS, 0.0))
+        self.assertTrue(cc.inrecovery)
+
+        # acknowledging everything sent before the loss ends recovery with a deflated window
+        self.assertFalse(cc.ack(10 * MSS, 7 * MSS, False, 9 * MSS, 12 * MSS, 0.0))
+        self.assertFalse(cc.inrecovery)
+        self.assertEqual(cc.window(), 3 * MSS)
+
+    def testrenopartialack(self):
+        cc = congestion.Reno(MSS)
+        cc.cwnd = 10 * MSS
+        for _ in range(3):
+            cc.ack(0, 0, True, 10 * MSS, 10 * MSS, 0.0)
+
+        # reno leaves recovery at the first new ACK
+        self.assertFalse(cc.ack(3 * MSS, 3 * MSS, False, 10 * MSS, 10 * MSS, 0.0))
+        self.assertFalse(cc.inrecovery)
+        self.assertEqual(cc.window(), 5 * MSS)
+
+    def testtimeout(self):
+        cc = congestion.NewReno(MSS)
+        cc.cwnd = 20 * MSS
+        cc.timeout(16 * MSS, 0.0)
+        self.assertEqual(cc.window(), MSS)
+        self.assertEqual(cc.ssthresh, 8 * MSS)
+
+    def testcubic(self):
+        cc = congestion.Cubic(MSS)
+        cc.rtt = 0.1
+        cc.cwnd = 100 * MSS
+        cc.loss(100 * MSS, 0.0)
+        cc.cwnd = cc.ssthresh
+        self.assertEqual(cc.window(), 70 * MSS)
+
+        # concave growth back to the window of the loss, which is reached after k seconds
+        cc.ack(MSS, MSS, False, 70 * MSS, 70 * MSS, 0.0)
+        self.assertAlmostEqual(cc.k, (30 / congestion.CUBIC_C) ** (1 / 3))
+        now = 0.0
+        while now < cc.k:
+            now += 0.1
+            for _ in range(cc.window() // MSS):
+                cc.ack(MSS, MSS, False, cc.window(), cc.window(), now)
+        self.assertGreater(cc.window(), 95 * MSS)
+        self.assertLess(cc.window(), 105 * MSS)
+
+    def testgetcontroller(self):
+        self.assertIsInstance(congestion.getcontroller('cubic', MSS), congestion.Cubic)
+        with self.assertRaises(RuntimeError):
+            congestion.getcontroller('vegas', MSS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import socket
+import sys
+import unittest
+
+sys.path.append('../')
+import demux
+import eventloop
+import ip
+import networklayer
+import tcp
+import utils
+
+
+def makedatagram(src, dst, sport, dport, data=b'', **kwargs):
+    tcppkt = tcp.TCP(sport=sport, dport=dport, flags='A', data=bytearray(data))
+    tcp_slz = tcppkt.serialize()
+    ippkt = ip.IP(src=src, dst=dst, proto=6, len=20 + len(tcp_slz), **kwargs)
+    tcppkt.compute_checksum(ippkt)
+    ippkt.data = tcppkt.serialize()
+    return ippkt
+
+
+def makelayer(dmx, localaddrpair, remoteaddrpair):
+    ntwk = networklayer.NetworkLayer(demux=dmx)
+    ntwk.local_addr = utils.addrtoint(localaddrpair[0])
+    ntwk.local_port = localaddrpair[1]
+    ntwk.remote_addr = utils.addrtoint(remoteaddrpair[0])
+    ntwk.remote_port = remoteaddrpair[1]
+    ntwk.lastrecv = 0
+    dmx.register(ntwk)
+    return ntwk
+
+
+class DemuxTest(unittest.TestCase):
+    def testdispatch(self):
+        loop = eventloop.EventLoop()
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        dmx = demux.Demux(loop, a)
+
+        local = '10.0.0.1'
+        ntwk1 = makelayer(dmx, (local, 40000), ('10.0.0.2', 80))
+        ntwk2 = makelayer(dmx, (local, 40001), ('10.0.0.2', 80))
+        ntwk3 = makelayer(dmx, (local, 40000), ('10.0.0.3', 80))
+        with self.assertRaises(RuntimeError):
+            makelayer(dmx, (local, 40000), ('10.0.0.3', 80))
+
+        received = []
+        ntwk1.onpackets = lambda pkts: received.append((1, [bytes(tcp.deserialize_tcp(p.data).data) for p in pkts]))
+        ntwk2.onpackets = lambda pkts: received.append((2, [bytes(tcp.deserialize_tcp(p.data).data) for p in pkts]))
+
+        b.send(makedatagram('10.0.0.2', local, 80, 40000, b'one').serialize())
+        b.send(makedatagram('10.0.0.2', local, 80, 40001, b'two').serialize())
+        b.send(makedatagram('10.0.0.2', local, 80, 40000, b'three').serialize())
+        b.send(makedatagram('10.0.0.2', local, 80, 40002, b'nobody').serialize())
+        b.send(makedatagram('10.0.0.3', local, 80, 40000, b'inbox').serialize())
+        loop.run_until(lambda: ntwk3.inbox, 1)
+
+        self.assertEqual(received, [(1, [b'one', b'three']), (2, [b'two'])])
+        self.assertEqual(bytes(tcp.deserialize_tcp(ntwk3.inbox[0].data).data), b'inbox')
+
+        dmx.unregister(ntwk1)
+        dmx.unregister(ntwk2)
+        dmx.unregister(ntwk3)
+        self.assertEqual(dmx.connections, {})
+        self.assertEqual(dmx.addrpairs, {})
+        a.close()
+        b.close()
+        loop.close()
+
+    def testfragments(self):
+        loop = eventloop.EventLoop()
+        dmx = demux.Demux(loop, socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM))
+
+        local = '10.0.0.1'
+        ntwk1 = makelayer(dmx, (local, 40000), ('10.0.0.2', 80))
+        ntwk2 = makelayer(dmx, (local, 40001), ('10.0.0.2', 80))
+
+        # fragments of a datagram for the second connection
+        whole = makedatagram('10.0.0.2', local, 80, 40001, b'fragmented data!', id=4242)
+        frag1 = ip.IP(src='10.0.0.2', dst=local, proto=6, len=36, flags='M', frag=0, id=4242,
+                      data=whole.data[:16])
+        frag2 = ip.IP(src='10.0.0.2', dst=local, proto=6, len=40, frag=2, id=4242, data=whole.data[16:])
+        dmx.dispatch([frag2.serialize(), frag1.serialize()])
+
+        self.assertEqual(len(ntwk1.inbox), 0)
+        self.assertEqual(len(ntwk2.inbox), 1)
+        self.assertEqual(bytes(tcp.deserialize_tcp(ntwk2.inbox[0].data).data), b'fragmented data!')
+        loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import socket
+import sys
+import unittest
+
+sys.path.append('../')
+import eventloop
+
+
+class EventLoopTest(unittest.TestCase):
+    def testtimerorder(self):
+        loop = eventloop.EventLoop()
+        fired = []
+        loop.call_later(0.02, lambda: fired.append('b'))
+        loop.call_later(0.01, lambda: fired.append('a'))
+        cancelled = loop.call_later(0.015, lambda: fired.append('x'))
+        cancelled.cancel()
+
+        loop.run_until(lambda: len(fired) == 2, 1)
+        self.assertEqual(fired, ['a', 'b'])
+        loop.close()
+
+    def testrununtiltimeout(self):
+        loop = eventloop.EventLoop()
+        start = loop.time()
+        self.assertFalse(loop.run_until(lambda: False, 0.05))
+        self.assertGreaterEqual(loop.time() - start, 0.05)
+        loop.close()
+
+    def testreader(self):
+        loop = eventloop.EventLoop()
+        a, b = socket.socketpair()
+        a.setblocking(False)
+        received = []
+        loop.add_reader(a, lambda: received.append(a.recv(100)))
+
+        loop.call_later(0.01, lambda: b.send(b'hello'))
+        self.assertTrue(loop.run_until(lambda: received, 1))
+        self.assertEqual(received, [b'hello'])
+
+        loop.remove_reader(a)
+        loop.close()
+        a.close()
+        b.close()
+
+    def testnothingtowaitfor(self):
+        loop = eventloop.EventLoop()
+        with self.assertRaises(RuntimeError):
+            loop.run_once()
+        loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
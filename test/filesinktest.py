@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+import filesink
+
+
+class FileSinkTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def readback(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def writepieces(self, sink, data):
+        view = memoryview(data)
+        for i in range(0, len(data), 1460):
+            sink.write(view[i:i + 1460])
+        sink.close()
+
+    def testsequential(self):
+        data = os.urandom(100000)
+        self.writepieces(filesink.FileSink(self.path, bufsize=4096), data)
+        self.assertEqual(self.readback(), data)
+
+    def testbackground(self):
+        data = os.urandom(100000)
+        sink = filesink.FileSink(self.path, background=True, bufsize=4096, maxqueued=8192)
+        sink.preallocate(len(data))
+        self.writepieces(sink, data)
+        self.assertEqual(self.readback(), data)
+
+    def testmmap(self):
+        data = os.urandom(100000)
+        sink = filesink.FileSink(self.path, usemmap=True)
+        sink.write(data[0:10])
+        sink.preallocate(len(data))
+        sink.write(data[10:])
+        sink.close()
+        self.assertEqual(self.readback(), data)
+
+    def testoffsets(self):
+        sink = filesink.FileSink(self.path, bufsize=4)
+        sink.preallocate(8)
+        sink.pwrite(4, b'efgh')
+        sink.pwrite(0, b'ab')
+        sink.pwrite(2, b'cd')
+        sink.close()
+        self.assertEqual(self.readback(), b'abcdefgh')
+
+    def testtruncated(self):
+        sink = filesink.FileSink(self.path)
+        sink.preallocate(100)
+        sink.write(b'abc')
+        sink.close()
+        self.assertEqual(self.readback(), b'abc')
+
+    @unittest.skipUnless(os.path.exists('/dev/full'), 'needs /dev/full')
+    def testwriterfails(self):
+        # every write to /dev/full fails
+        sink = filesink.FileSink('/dev/full', background=True, bufsize=4096)
+        sink.write(bytes(10000))
+        with self.assertRaises(OSError):
+            sink.close()
+
+        # the error is raised only after the file was closed
+        self.assertFalse(sink.writer.thread.is_alive())
+        with self.assertRaises(OSError):
+            os.fstat(sink.fd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import sys
+import unittest
+
+sys.path.append('../')
+import eventloop
+import fragment
+import ip
+
+
+class FakeClockLoop(eventloop.EventLoop):
+    """Event loop whose clock only moves when the test says so"""
+    now = 0.0
+
+    def time(self):
+        return self.now
+
+
+def frag(data, offset, more=True, src='10.0.0.1', idnum=1, proto=6):
+    return ip.IP(src=src, dst='10.0.0.2', proto=proto, id=idnum, len=20 + len(data), flags='M' if more else '',
+                 frag=offset // 8, data=bytearray(data))
+
+
+class FragmentTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = FakeClockLoop()
+        self.reasm = fragment.Reassembler(self.loop, timeout=30, maxbytes=64)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def testoverlapandduplicates(self):
+        self.assertIsNone(self.reasm.add(frag(b'cccccccc', 16, more=False)))
+        self.assertIsNone(self.reasm.add(frag(b'aaaaaaaabbbb', 0)))
+        self.assertIsNone(self.reasm.add(frag(b'aaaaaaaabbbb', 0)))  # duplicate
+
+        # overlaps both neighbours. only the hole is filled, the data that arrived first wins
+        out = self.reasm.add(frag(b'XXXXXXXXXXXXXXXX', 8))
+        self.assertIsNotNone(out)
+        self.assertEqual(bytes(out.data), b'aaaaaaaabbbbXXXXcccccccc')
+        self.assertEqual(out.len, 44)
+        self.assertEqual(len(self.reasm), 0)
+        self.assertEqual(self.reasm.nbytes, 0)
+
+    def testinconsistent(self):
+        self.reasm.add(frag(bytes(8), 16, more=False))
+        self.assertIsNone(self.reasm.add(frag(bytes(24), 8)))  # would end past the 24 bytes of the datagram
+        self.assertEqual(self.reasm.inconsistent, 1)
+        self.assertEqual(self.reasm.nbytes, 24)
+
+        # a last fragment that sets another length drops the whole datagram
+        self.assertIsNone(self.reasm.add(frag(bytes(8), 24, more=False)))
+        self.assertEqual((len(self.reasm), self.reasm.nbytes, self.reasm.inconsistent), (0, 0, 2))
+
+        # so does one that ends before data that was already received
+        self.reasm.add(frag(bytes(32), 0, idnum=2))
+        self.assertIsNone(self.reasm.add(frag(bytes(8), 16, more=False, idnum=2)))
+        self.assertEqual((len(self.reasm), self.reasm.nbytes, self.reasm.inconsistent), (0, 0, 3))
+
+        # fragments that agree still reassemble to the right size
+        self.reasm.add(frag(bytes(8), 8, more=False, idnum=3))
+        out = self.reasm.add(frag(b'ab' * 4, 0, idnum=3))
+        self.assertEqual((out.len, bytes(out.data)), (36, b'ab' * 4 + bytes(8)))
+
+    def testkeys(self):
+        # same id from different sources or protocols are different datagrams
+        self.assertIsNone(self.reasm.add(frag(b'aaaaaaaa', 0, src='10.0.0.3')))
+        self.assertIsNone(self.reasm.add(frag(b'bbbbbbbb', 0, proto=17)))
+        self.assertIsNone(self.reasm.add(frag(b'cccccccc', 8, more=False)))
+        self.assertEqual(len(self.reasm), 3)
+
+        out = self.reasm.add(frag(b'dddddddd', 0))
+        self.assertEqual(bytes(out.data), b'ddddddddcccccccc')
+
+    def testtimeout(self):
+        self.reasm.add(frag(b'aaaaaaaa', 0, idnum=1))
+        self.loop.now = 20.0
+        self.reasm.add(frag(b'bbbbbbbb', 0, idnum=2))
+
+        # the timer drops the first datagram, then the second one
+        self.loop.now = 30.0
+        self.loop.run_once(0)
+        self.assertEqual(len(self.reasm), 1)
+        self.loop.now = 50.0
+        self.loop.run_once(0)
+        self.assertEqual(len(self.reasm), 0)
+        self.assertEqual(self.reasm.expired, 2)
+
+    def testmemorycap(self):
+        for idnum in range(4):
+            self.reasm.add(frag(bytes(24), 0, idnum=idnum))
+
+        # 96 bytes do not fit in 64: the oldest datagrams are evicted
+        self.assertEqual(self.reasm.evicted, 2)
+        self.assertEqual(list(key[3] for key in self.reasm.datagrams), [2, 3])
+        self.assertIsNone(self.reasm.add(frag(bytes(8), 24, more=False, idnum=0)))
+        self.assertIsNotNone(self.reasm.add(frag(bytes(8), 24, more=False, idnum=3)))
+
+    def testoverflow(self):
+        self.assertIsNone(self.reasm.add(frag(bytes(16), 65520)))
+        self.assertEqual(len(self.reasm), 0)
+        self.assertEqual(self.reasm.oversized, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
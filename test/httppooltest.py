@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+import eventloop
+import httppool
+import links
+import simnet
+import simserver
+
+FILES = {'/small{}'.format(i): bytes((i + j) % 251 for j in range(3000 + 1000 * i)) for i in range(12)}
+URLS = ['http://10.0.0.2/small{}'.format(i) for i in range(12)]
+
+
+class HTTPPoolTest(unittest.TestCase):
+    def setUp(self):
+        # the pool uses the thread's default loop and link, and writes the files to the working directory
+        self.loop = simnet.SimLoop()
+        self.link = simnet.SimLink(self.loop)
+        oldloop, oldlink = eventloop.getloop(), links.getlink()
+        eventloop.setloop(self.loop)
+        links.setlink(self.link)
+        self.addCleanup(eventloop.setloop, oldloop)
+        self.addCleanup(links.setlink, oldlink)
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmpdir.name)
+
+    def assertfetched(self, reqs):
+        for req in reqs:
+            self.assertEqual((req.status, req.done), (200, True))
+            with open(req.outfn, 'rb') as f:
+                self.assertEqual(f.read(), FILES[req.path])
+
+    def testrequest(self):
+        req = httppool.Request('http://example.com/files/a.bin')
+        self.assertEqual((req.domain, req.path, req.outfn), ('example.com', '/files/a.bin', 'a.bin'))
+
+        req = httppool.Request('http://example.com', 'out.html')
+        self.assertEqual((req.path, req.outfn), ('/', 'out.html'))
+        self.assertIsNone(req.status)
+
+    def testpipelined(self):
+        server = simserver.SimServer(self.link, '10.0.0.2', FILES)
+        pool = httppool.ConnectionPool('10.0.0.1')
+        reqs = pool.fetch(URLS)
+        elapsed = self.loop.time()
+        pool.close()
+
+        self.assertfetched(reqs)
+        self.assertEqual((server.accepted, server.requests), (1, len(URLS)))
+        # the requests share round trips rather than waiting for each other's responses
+        self.assertLess(elapsed, len(URLS) * 2 * simnet.LATENCY)
+
+    def testchunked(self):
+        server = simserver.SimServer(self.link, '10.0.0.2', FILES, chunked=True)
+        self.assertfetched(httppool.fetchmany(URLS, '10.0.0.1'))
+        self.assertEqual(server.accepted, 1)
+
+    def testcloseretry(self):
+        # the server closes each connection after 5 responses, with the rest of the pipeline unanswered
+        server = simserver.SimServer(self.link, '10.0.0.2', FILES, maxrequests=5)
+        pool = httppool.ConnectionPool('10.0.0.1')
+        reqs = pool.fetch(URLS)
+        pool.close()
+
+        self.assertfetched(reqs)
+        self.assertEqual((server.accepted, server.requests), (3, len(URLS)))
+
+    def testreuse(self):
+        first = simserver.SimServer(self.link, '10.0.0.2', FILES)
+        second = simserver.SimServer(self.link, '10.0.0.3', FILES)
+        pool = httppool.ConnectionPool('10.0.0.1', maxconns=2)
+
+        self.assertfetched(pool.fetch(URLS[:6] + ['http://10.0.0.3/small0']))
+        self.assertEqual(len(pool.idleconns['10.0.0.2']), 2)
+
+        # a later fetch reuses the idle connections to each host instead of opening new ones
+        self.assertfetched(pool.fetch(URLS[6:] + ['http://10.0.0.3/small1']))
+        pool.close()
+        self.assertEqual((first.accepted, second.accepted), (2, 1))
+        self.assertEqual(first.requests, len(URLS))
+
+
+if __name__ == '__main__':
+    unittest.main()
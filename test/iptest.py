@@ -50,16 +50,31 @@ class IPTest(TestCase):
         self.assertEqual(pkt.tos, 0)
         self.assertEqual(pkt.len, 20)
         self.assertEqual(pkt.idnum, 1)
-        self.assertEqual(pkt.flags, '')
+        self.assertEqual(pkt.flags, 0)
         self.assertEqual(pkt.frag, 0)
         self.assertEqual(pkt.chksum, 0x7ce7)
         self.assertEqual(pkt.ttl, 64)
         self.assertEqual(pkt.proto, 0)
-        self.assertEqual(pkt.src, '127.0.0.1')
-        self.assertEqual(pkt.dst, '127.0.0.1')
+        self.assertEqual(pkt.src, 0x7f000001)
+        self.assertEqual(pkt.dst, 0x7f000001)
         self.assertEqual(pkt.options, None)
         self.assertEqual(pkt.data, None)
 
+    def test_deserialize_lazyfields(self):
+        scapypkt = scapyip.IP(tos=0x10, options=[scapyip.IPOption_NOP()] * 4, proto=6) / b'payload'
+        slz = bytes(scapypkt)
+        pkt = ip.deserialize_ip(slz)
+
+        self.assertEqual(pkt.ihl, 6)
+        self.assertEqual(pkt.tos, 0x10)
+        self.assertEqual(bytes(pkt.options), b'\x01\x01\x01\x01')
+        self.assertEqual(bytes(pkt.data), b'payload')
+        self.assertTrue(pkt.valid_checksum())
+
+        corrupted = bytearray(slz)
+        corrupted[8] ^= 0xff
+        self.assertFalse(ip.deserialize_ip(corrupted).valid_checksum())
+
     def test_pseudoheader(self):
         pkt = ip.IP(version=4, ihl=5, tos=0, len=40, id=1, flags='', frag=0, ttl=64, proto=6,
                     src='192.168.198.131', dst='204.44.192.60',
@@ -0,0 +1,97 @@
+import json
+import sys
+import unittest
+
+sys.path.append('../')
+import ip
+import metrics
+import networklayer
+import simnet
+import simserver
+import tcp
+import transportlayer
+import utils
+
+FILE = bytes(range(256)) * 2048
+
+
+def download(onmetrics=None, **linkargs):
+    """Downloads FILE over a simulated network and returns the transport layer after it shut down"""
+    loop = simnet.SimLoop()
+    link = simnet.SimLink(loop, seed=3, **linkargs)
+    simserver.SimServer(link, '10.0.0.2', {'/file': FILE})
+    ntwk = networklayer.NetworkLayer(loop=loop, link=link)
+    ntwk.connect(('10.0.0.1', 40000), ('10.0.0.2', 80))
+    trans = transportlayer.TransportLayer(ntwk, 40000, 80)
+    trans.onmetrics = onmetrics
+    trans.send(b'GET /file HTTP/1.1\r\nHost: 10.0.0.2\r\nConnection: close\r\n\r\n')
+    while trans.recv() is not None:
+        pass
+    trans.shutdown()
+    loop.close()
+    return trans
+
+
+class MetricsTest(unittest.TestCase):
+    def testcounters(self):
+        counters = metrics.TransportMetrics()
+        self.assertEqual(set(counters.snapshot().values()), {0})
+        counters.retransmits += 2
+        self.assertEqual(counters.snapshot()['retransmits'], 2)
+        # counters are slots, so a misspelled counter is an error rather than a new attribute
+        with self.assertRaises(AttributeError):
+            counters.retransmit = 1
+
+    def testnetworklayer(self):
+        loop = simnet.SimLoop()
+        ntwk = networklayer.NetworkLayer(loop=loop, link=simnet.SimLink(loop))
+        ntwk.local_addr = utils.addrtoint('10.0.0.1')
+        ntwk.remote_addr = utils.addrtoint('10.0.0.2')
+        template = networklayer.HeaderTemplate(ntwk.remote_addr, ntwk.local_addr, 80, 40000)
+        datagram = template.build(1, 1, 1, tcp.ACK, 1000, None, b'data') + b'data'
+        other = networklayer.HeaderTemplate(utils.addrtoint('10.0.0.3'), ntwk.local_addr, 80, 40000)
+
+        self.assertIsNotNone(ntwk.accept(ip.deserialize_ip(bytes(datagram))))
+        datagram[10] ^= 0xff
+        self.assertIsNone(ntwk.accept(ip.deserialize_ip(bytes(datagram))))
+        self.assertIsNone(ntwk.accept(ip.deserialize_ip(bytes(other.build(1, 1, 1, tcp.ACK, 1000)))))
+
+        snap = ntwk.snapshot()
+        self.assertEqual((snap['datagrams_in'], snap['bytes_in']), (2, 2 * 44))
+        self.assertEqual((snap['badchecksum'], snap['foreign']), (1, 1))
+
+    def testtransfer(self):
+        trans = download(loss=0.01, reorder=0.02)
+        snap = trans.snapshot()
+        self.assertEqual(snap['segments_in'], snap['ip']['datagrams_in'])
+        self.assertEqual(snap['segments_out'], snap['ip']['datagrams_out'])
+        self.assertGreater(snap['bytes_in'], len(FILE))
+        self.assertGreater(snap['outoforder'], 0)
+        self.assertGreater(snap['ooomax'], 0)
+        self.assertEqual(snap['ooobytes'], 0)
+        self.assertGreater(snap['acks_out'], 0)
+        self.assertAlmostEqual(snap['minrtt'], 2 * simnet.LATENCY, places=2)
+        self.assertEqual(snap['remote'], '10.0.0.2:80')
+        json.dumps(snap)
+
+    def testretransmits(self):
+        # the request and our FIN have to be retransmitted on a link that loses a third of the datagrams
+        snap = download(loss=0.3).snapshot()
+        self.assertGreater(snap['timeouts'], 0)
+        self.assertGreaterEqual(snap['retransmits'], snap['timeouts'] + snap['fastretransmits'])
+        self.assertGreater(snap['duplicates'], 0)
+
+    def testhook(self):
+        snaps = []
+        trans = download(snaps.append, bandwidth=2e6)
+        times = [snap['time'] for snap in snaps]
+        # one snapshot a second, and a last one at shutdown
+        self.assertGreater(len(snaps), 2)
+        self.assertEqual(times, sorted(times))
+        self.assertAlmostEqual(times[1] - times[0], trans.metricsinterval)
+        self.assertEqual(snaps[-1]['bytes_in'], trans.metrics.bytes_in)
+        self.assertIsNone(trans.metricstimer)
+
+
+if __name__ == '__main__':
+    unittest.main()
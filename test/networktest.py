@@ -5,8 +5,11 @@ import unittest
 
 sys.path.append('../')
 import utils
+import fragment
 import ip
 import networklayer
+import pmtu
+import tcp
 
 
 class Server:
@@ -50,6 +53,78 @@ class NetworkTest(unittest.TestCase):
         ntwk.settimeout(1)
         ntwk.recv()
 
+    def testheadertemplate(self):
+        src = utils.addrtoint('192.168.198.131')
+        dst = utils.addrtoint('204.44.192.60')
+        template = networklayer.HeaderTemplate(src, dst, 33320, 80)
+
+        for flags, options, data in [(tcp.ACK, None, None),
+                                     (tcp.SYN, bytearray(b'\x02\x04\x05\xb4'), None),
+                                     (tcp.ACK | tcp.PSH, None, bytearray(b'GET / HTTP/1.1\r\n\r\n')),
+                                     (tcp.ACK, None, bytearray(b'odd'))]:
+            hdr = template.build(7, 4294967295, 123456, flags, 64240, options, data)
+            if data is not None:
+                hdr += data
+
+            tcppkt = tcp.TCP(sport=33320, dport=80, seq=4294967295, ack=123456, flags=flags, window=64240,
+                             options=options, data=data, dataofs=5 + (len(options) // 4 if options else 0))
+            tcp_slz = tcppkt.serialize()
+            ippkt = ip.IP(id=7, src=src, dst=dst, proto=6, len=20 + len(tcp_slz))
+            tcppkt.compute_checksum(ippkt)
+            ippkt.data = tcppkt.serialize()
+
+            self.assertEqual(bytes(hdr), bytes(ippkt.serialize()))
+
+    def testsendsegment(self):
+        ntwk = networklayer.NetworkLayer()
+        ntwk.local_addr = utils.addrtoint('192.168.198.131')
+        ntwk.remote_addr = utils.addrtoint('204.44.192.60')
+        ntwk.ssock, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+        # the payload is gathered from a view of a larger buffer
+        body = b'x' * 100 + b'payload' + b'y' * 100
+        ntwk.send_segment(33320, 80, 1, 2, tcp.ACK, 64240, data=memoryview(body)[100:107])
+        datagram = peer.recv(65535)
+        ntwk.ssock.close()
+        peer.close()
+
+        ippkt = ip.deserialize_ip(datagram)
+        self.assertEqual(ippkt.len, len(datagram))
+        self.assertTrue(ippkt.valid_checksum())
+        self.assertEqual(bytes(tcp.deserialize_tcp(ippkt.data).data), b'payload')
+
+    def testsendfragments(self):
+        ntwk = networklayer.NetworkLayer()
+        ntwk.local_addr = utils.addrtoint('192.168.198.131')
+        ntwk.remote_addr = utils.addrtoint('204.44.192.60')
+        ntwk.paths = pmtu.PathCache(probe=lambda addr: 576)
+        ntwk.ssock, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+        # a datagram that fits is sent whole, with DF set
+        ntwk.send_segment(33320, 80, 1, 2, tcp.ACK, 64240, data=b'x' * 536)
+        ippkt = ip.deserialize_ip(peer.recv(65535))
+        self.assertEqual((ippkt.len, ippkt.flags, ippkt.frag), (576, ip.DF, 0))
+
+        # a larger one is split into fragments that fit the path MTU and share the next id
+        body = bytes(range(256)) * 5
+        ntwk.send_segment(33320, 80, 537, 2, tcp.ACK, 64240, data=body)
+        self.assertEqual(ntwk.fragments, 3)
+        reassembler = fragment.Reassembler(ntwk.loop)
+        for i in range(3):
+            frag = ip.deserialize_ip(peer.recv(65535))
+            self.assertTrue(frag.valid_checksum())
+            self.assertLessEqual(frag.len, 576)
+            self.assertEqual(frag.idnum, (ippkt.idnum + 1) & 0xffff)
+            self.assertEqual(frag.flags, ip.MF if i < 2 else 0)
+            reass = reassembler.add(frag)
+        ntwk.ssock.close()
+        peer.close()
+
+        self.assertEqual(reass.len, 20 + 20 + len(body))
+        tcppkt = tcp.deserialize_tcp(reass.data)
+        self.assertEqual(bytes(tcppkt.data), body)
+        self.assertEqual(utils.checksum16(utils.getpseudoheader(reass) + reass.data), 0)
+
     def testfraginorder(self):
         ntwk = networklayer.NetworkLayer()
         localip = '127.0.0.1'
@@ -0,0 +1,93 @@
+import io
+import struct
+import sys
+import unittest
+
+sys.path.append('../')
+import pcap
+
+
+def datagram(size, idnum=0):
+    """Returns an IPv4 datagram of the given size"""
+    return bytes([0x45, 0]) + size.to_bytes(2, byteorder='big') + idnum.to_bytes(2, byteorder='big') + bytes(size - 6)
+
+
+class PcapTest(unittest.TestCase):
+    def testroundtrip(self):
+        out = io.BytesIO()
+        writer = pcap.PcapWriter(out, bufsize=4096)
+        first = datagram(40, 1)
+        second = datagram(1500, 2)
+        writer.write([first], 1234567890123456789)
+        # nothing is written until the buffer is full
+        self.assertEqual(out.getvalue(), b'')
+        writer.write([second[:40], memoryview(second)[40:]], 1234567890999999999)
+        writer.close()
+        self.assertEqual(writer.packets, 2)
+
+        magic, major, minor, _, _, snaplen, linktype = pcap.FILEHDR.unpack_from(out.getvalue())
+        self.assertEqual((magic, major, minor, snaplen, linktype), (pcap.NSMAGIC, 2, 4, 65535, pcap.LINKTYPE_RAW))
+
+        out.seek(0)
+        self.assertEqual(list(pcap.readpcap(out)), [(1234567890123456789, first), (1234567890999999999, second)])
+
+    def testbuffering(self):
+        out = io.BytesIO()
+        writer = pcap.PcapWriter(out, clock=lambda: 5, bufsize=4096)
+        for i in range(9):
+            writer.write([datagram(1000, i)])
+        # the file header and the first 5 records filled the buffer. the other 4 are only written when flushed
+        record = pcap.RECORDHDR.size + 1000
+        self.assertEqual(len(out.getvalue()), pcap.FILEHDR.size + 5 * record)
+        writer.flush()
+        self.assertEqual(len(out.getvalue()), pcap.FILEHDR.size + 9 * record)
+        out.seek(0)
+        self.assertEqual([ts for ts, _ in pcap.readpcap(out)], [5] * 9)
+
+    def testsnaplen(self):
+        out = io.BytesIO()
+        writer = pcap.PcapWriter(out, snaplen=100)
+        writer.write([datagram(60), bytes(200)], 0)
+        writer.close()
+        _, _, caplen, length = pcap.RECORDHDR.unpack_from(out.getvalue(), pcap.FILEHDR.size)
+        self.assertEqual((caplen, length), (100, 260))
+
+    def testclassicethernet(self):
+        # big endian, microsecond timestamps, Ethernet frames with a VLAN tag and padding, and an ARP frame
+        dgram = datagram(28)
+        frames = [bytes(12) + b'\x81\x00\x00\x05\x08\x00' + dgram + bytes(18),
+                  bytes(12) + b'\x08\x06' + bytes(28)]
+        data = struct.pack('>IHHiIII', pcap.USMAGIC, 2, 4, 0, 0, 65535, pcap.LINKTYPE_ETHERNET)
+        for i, frame in enumerate(frames):
+            data += struct.pack('>IIII', 10 + i, 250000, len(frame), len(frame)) + frame
+
+        self.assertEqual(list(pcap.readpcap(io.BytesIO(data))), [(10250000000, dgram)])
+
+    def testpcapng(self):
+        dgram = datagram(40)
+
+        def block(blocktype, body):
+            body += bytes(-len(body) % 4)
+            return struct.pack('<II', blocktype, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+        # an interface with Linux cooked capture and nanosecond timestamps, and one with the default microseconds
+        data = block(pcap.SHB, struct.pack('<IHHq', pcap.BYTEORDER, 1, 0, -1))
+        data += block(pcap.IDB, struct.pack('<HHI', pcap.LINKTYPE_LINUX_SLL, 0, 65535) +
+                      struct.pack('<HHB3x', pcap.IF_TSRESOL, 1, 9) + struct.pack('<HH', 0, 0))
+        data += block(pcap.IDB, struct.pack('<HHI', pcap.LINKTYPE_RAW, 0, 65535))
+        frame = bytes(14) + b'\x08\x00' + dgram
+        ts = 1700000000123456789
+        data += block(pcap.EPB, struct.pack('<IIIII', 0, ts >> 32, ts & 0xffffffff, len(frame), len(frame)) + frame)
+        ts = 1700000001000001
+        data += block(pcap.EPB, struct.pack('<IIIII', 1, ts >> 32, ts & 0xffffffff, len(dgram), len(dgram)) + dgram)
+
+        self.assertEqual(list(pcap.readpcap(io.BytesIO(data))),
+                         [(1700000000123456789, dgram), (1700000001000001000, dgram)])
+
+    def testnotpcap(self):
+        with self.assertRaises(RuntimeError):
+            list(pcap.readpcap(io.BytesIO(b'GET / HTTP/1.1\r\n')))
+
+
+if __name__ == '__main__':
+    unittest.main()
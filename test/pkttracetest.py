@@ -0,0 +1,106 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+import networklayer
+import pkttrace
+import simnet
+import simserver
+import tcp
+import transportlayer
+
+
+class PktTraceTest(unittest.TestCase):
+    def testring(self):
+        trace = pkttrace.Trace(capacity=4)
+        for i in range(3):
+            trace.record(i / 10, pkttrace.OUT, pkttrace.SEGMENT, 40000, 80, seq=i)
+        self.assertEqual([rec[5] for rec in pkttrace.RECORD.iter_unpack(trace.records())], [0, 1, 2])
+
+        # once the ring is full, the oldest records are overwritten
+        for i in range(3, 10):
+            trace.record(i / 10, pkttrace.IN, pkttrace.SEGMENT, 40000, 80, seq=i)
+        self.assertEqual([rec[5] for rec in pkttrace.RECORD.iter_unpack(trace.records())], [6, 7, 8, 9])
+        self.assertEqual(trace.count, 10)
+
+    def testdump(self):
+        trace = pkttrace.Trace(capacity=8)
+        trace.record(1.5, pkttrace.OUT, pkttrace.SEGMENT, 40000, 80, 100, 200, tcp.ACK | tcp.PSH, 502, 1448)
+        trace.record(1.75, pkttrace.OUT, pkttrace.TIMEOUT, 40000, 80, 100, length=2896)
+        out = io.BytesIO()
+        trace.dump(out)
+        out.seek(0)
+
+        header, records = pkttrace.load(out)
+        self.assertEqual((header['count'], header['lost'], header['capacity']), (2, 0, 8))
+        self.assertEqual(records[0], (1.5, pkttrace.OUT, pkttrace.SEGMENT, 40000, 80, 100, 200, tcp.ACK | tcp.PSH,
+                                      502, 1448))
+        self.assertEqual(pkttrace.describe(records[0], 1.5).split(),
+                         ['0.000000', 'out', '40000', '>', '80', 'segment', 'AP', 'seq', '100', 'ack', '200', 'win',
+                          '502', 'len', '1448'])
+        self.assertEqual(pkttrace.describe(records[1], 1.5).split()[5:], ['timeout', 'una', '100', 'flight', '2896'])
+
+        # in debug mode, records are printed as they are recorded
+        trace.echo = io.StringIO()
+        trace.record(2.0, pkttrace.IN, pkttrace.DUPACK, 40000, 80, 300, 100, tcp.ACK)
+        self.assertEqual(trace.echo.getvalue(),
+                         pkttrace.describe((2.0, pkttrace.IN, pkttrace.DUPACK, 40000, 80, 300, 100, tcp.ACK, 0, 0)) + '\n')
+
+        with self.assertRaises(RuntimeError):
+            pkttrace.load(io.BytesIO(b'not a trace at all, really not one'))
+
+    def testtransfer(self):
+        # a thread's connections record their segments and what happened to them
+        trace = pkttrace.gettrace()
+        before = trace.count
+        loop = simnet.SimLoop()
+        link = simnet.SimLink(loop, seed=3, loss=0.02, reorder=0.02)
+        simserver.SimServer(link, '10.0.0.2', {'/file': bytes(1 << 20)})
+        ntwk = networklayer.NetworkLayer(loop=loop, link=link)
+        ntwk.connect(('10.0.0.1', 40001), ('10.0.0.2', 80))
+        trans = transportlayer.TransportLayer(ntwk, 40001, 80)
+        trans.send(b'GET /file HTTP/1.1\r\nHost: 10.0.0.2\r\nConnection: close\r\n\r\n')
+        while trans.recv() is not None:
+            pass
+        trans.shutdown()
+        loop.close()
+
+        snap = trans.snapshot()
+        self.assertEqual(trace.count - before, snap['segments_in'] + snap['segments_out'] + snap['outoforder'] +
+                         snap['duplicates'] + snap['outofwindow'] + snap['dupacks'] + snap['paws'] + snap['timeouts'])
+
+        records = list(pkttrace.RECORD.iter_unpack(trace.records()))[-(trace.count - before):]
+        self.assertEqual(records[0][1:5], (pkttrace.OUT, pkttrace.SEGMENT, 40001, 80))
+        self.assertEqual(records[0][7], tcp.SYN)
+        events = set(rec[2] for rec in records)
+        self.assertIn(pkttrace.OUTOFORDER, events)
+
+    def testdecoder(self):
+        trace = pkttrace.Trace()
+        for i in range(5):
+            trace.record(i, pkttrace.IN, pkttrace.SEGMENT, 40000 + i % 2, 80, seq=i * 1000, length=1000)
+        trace.record(5, pkttrace.IN, pkttrace.OUTOFORDER, 40000, 80, seq=9000)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'test.trace')
+        trace.dump(path)
+
+        def decode(*args):
+            sys.argv = ['pkttrace.py'] + list(args) + [path]
+            printed = io.StringIO()
+            with contextlib.redirect_stdout(printed):
+                pkttrace.main()
+            return printed.getvalue().splitlines()[1:]
+
+        self.assertEqual(len(decode()), 6)
+        self.assertEqual([line.split()[7] for line in decode('-p', '40001')], ['1000', '3000'])
+        self.assertEqual(len(decode('-e', 'outoforder,dupack')), 1)
+        self.assertEqual([line.split()[0] for line in decode('-p', '40000', '-n', '2')], ['4.000000', '5.000000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import sys
+import unittest
+
+sys.path.append('../')
+import pmtu
+import utils
+
+
+class PMTUTest(unittest.TestCase):
+    def setUp(self):
+        self.probes = []
+        self.routemtu = 1500
+        self.cache = pmtu.PathCache(expires=600, probe=self.probe)
+        self.dst = utils.addrtoint('204.44.192.60')
+
+    def probe(self, addr):
+        self.probes.append(addr)
+        return self.routemtu
+
+    def testlookup(self):
+        # the route is only looked up once until the entry expires
+        self.assertEqual(self.cache.mtu(self.dst, 0), 1500)
+        self.assertEqual(self.cache.mtu(self.dst, 100), 1500)
+        self.assertEqual(self.probes, ['204.44.192.60'])
+
+    def testupdate(self):
+        self.cache.mtu(self.dst, 0)
+        self.cache.update(self.dst, 1400, 10)
+        self.assertEqual(self.cache.mtu(self.dst, 10), 1400)
+
+        # updates only ever lower the MTU, and never below the minimum of IPv4
+        self.cache.update(self.dst, 1480, 20)
+        self.assertEqual(self.cache.mtu(self.dst, 20), 1400)
+        self.cache.update(self.dst, 20, 30)
+        self.assertEqual(self.cache.mtu(self.dst, 30), pmtu.MINMTU)
+
+    def testexpiry(self):
+        self.cache.mtu(self.dst, 0)
+        self.cache.update(self.dst, 1400, 10)
+
+        # once the entry expires the route is asked again, so the MTU can grow back
+        self.assertEqual(self.cache.mtu(self.dst, 609), 1400)
+        self.assertEqual(self.cache.mtu(self.dst, 610), 1500)
+        self.assertEqual(len(self.probes), 2)
+
+        # a refresh takes whatever the kernel knows now
+        self.routemtu = 1280
+        self.assertEqual(self.cache.refresh(self.dst, 620).mtu, 1280)
+
+    def testids(self):
+        other = utils.addrtoint('10.0.0.1')
+        first = self.cache.nextid(self.dst, 0)
+        ids = [self.cache.nextid(self.dst, 0) for _ in range(0x10000)]
+
+        # one counter per destination, wrapping around after 65535
+        self.assertEqual(ids[0], (first + 1) & 0xffff)
+        self.assertEqual(len(set(ids)), 0x10000)
+        self.cache.nextid(other, 0)
+        self.assertEqual(self.cache.nextid(self.dst, 0), (first + 0x10001) & 0xffff)
+
+
+if __name__ == '__main__':
+    unittest.main()
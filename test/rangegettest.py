@@ -0,0 +1,152 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+import eventloop
+import links
+import rangeget
+import simnet
+import simserver
+
+BODY = bytes(i * 13 % 253 for i in range(4500000))
+SPORTS = [40000, 40001, 40002, 40003]
+
+
+class PortImpairment:
+    """
+    Link of a SimServer that drops datagrams the server sends to one client port, so that only one connection of a
+    download is impaired: each of them with probability loss, and all of them once cutoff have been sent
+    """
+
+    def __init__(self, link, port, loss=0.0, cutoff=None, seed=0):
+        self.link = link
+        self.port = port
+        self.loss = loss
+        self.cutoff = cutoff
+        self.rng = random.Random(seed)
+        self.sent = 0  # datagrams sent to the port, including those dropped
+        self.dropped = 0
+
+    def __getattr__(self, name):
+        return getattr(self.link, name)
+
+    def send(self, datagram):
+        # the server's datagrams have no IP options, so the TCP destination port is at offset 22
+        if int.from_bytes(datagram[22:24], byteorder='big') == self.port:
+            self.sent += 1
+            if self.cutoff is not None and self.sent > self.cutoff or self.rng.random() < self.loss:
+                self.dropped += 1
+                return
+        self.link.send(datagram)
+
+
+class RangeGetTest(unittest.TestCase):
+    def setUp(self):
+        # the download uses the thread's default loop and link
+        self.loop = simnet.SimLoop()
+        self.link = simnet.SimLink(self.loop)
+        oldloop, oldlink = eventloop.getloop(), links.getlink()
+        eventloop.setloop(self.loop)
+        links.setlink(self.link)
+        self.addCleanup(eventloop.setloop, oldloop)
+        self.addCleanup(links.setlink, oldlink)
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.outfn = os.path.join(tmpdir.name, 'file')
+
+    def download(self, sports=SPORTS):
+        """Downloads /file from the server at 10.0.0.2 and returns the RangeDownload and the contents of the file"""
+        download = rangeget.RangeDownload('10.0.0.2', '/file', '10.0.0.1', '10.0.0.2', self.outfn, sports)
+        download.run()
+        with open(self.outfn, 'rb') as f:
+            return download, f.read()
+
+    def testpieces(self):
+        sched = rangeget.RangeScheduler(100, 1000, piecesize=300)
+        self.assertEqual([(rng.start, rng.end) for rng in sched.pending], [(100, 400), (400, 700), (700, 1000)])
+
+        rng = sched.take(0)
+        self.assertEqual((rng.start, rng.end), (100, 400))
+        rng.start = 250
+        sched.finish(rng)  # unfinished ranges are handed out again first
+        self.assertEqual((sched.pending[0].start, sched.pending[0].end), (250, 400))
+        self.assertEqual(sched.active, [])
+
+    def teststealsplit(self):
+        sched = rangeget.RangeScheduler(0, 1000, piecesize=1000, minsteal=100, stalltime=5)
+        victim = sched.take(0)
+        victim.start = 200
+
+        thief = sched.take(1)
+        self.assertEqual((victim.start, victim.end), (200, 600))
+        self.assertEqual((thief.start, thief.end), (600, 1000))
+
+        # ranges shorter than 2 * minsteal are left alone
+        victim.start = 450
+        thief.start = 850
+        self.assertIsNone(sched.take(2))
+
+    def teststealstalled(self):
+        sched = rangeget.RangeScheduler(0, 1000, piecesize=500, minsteal=100, stalltime=5)
+        fast = sched.take(0)
+        slow = sched.take(0)
+        fast.start = 450
+        fast.lastprogress = 9
+        slow.start = 600
+        slow.lastprogress = 4
+        self.assertTrue(sched.stalled(10))
+
+        # the stalled range is taken over entirely, even though it is smaller than the other one
+        fast.start = 0
+        rng = sched.take(10)
+        self.assertEqual((rng.start, rng.end), (600, 1000))
+        self.assertEqual(len(slow), 0)
+        self.assertFalse(sched.stalled(10))
+
+    def testdownload(self):
+        lossy = PortImpairment(self.link, SPORTS[1], loss=0.05, seed=3)
+        server = simserver.SimServer(lossy, '10.0.0.2', {'/file': BODY})
+        download, body = self.download()
+
+        self.assertEqual(body, BODY)
+        self.assertEqual([conn.sport for conn in download.connections], SPORTS)
+        self.assertEqual(server.accepted, len(SPORTS))
+        self.assertGreater(lossy.dropped, 0)
+        # the file takes 5 pieces, and ranges are split off the slow connection once they have all been handed out
+        self.assertGreater(server.requests, 5)
+
+    def teststalled(self):
+        # one connection stops receiving anything partway through its first range
+        stalled = PortImpairment(self.link, SPORTS[1], cutoff=100)
+        simserver.SimServer(stalled, '10.0.0.2', {'/file': BODY})
+        download, body = self.download()
+
+        self.assertEqual(body, BODY)
+        self.assertGreater(stalled.dropped, 0)
+        # its response never ended, and the rest of its range was taken over by another connection
+        rng = download.connections[1].range
+        self.assertIsNotNone(rng)
+        self.assertEqual(len(rng), 0)
+
+    def testnoranges(self):
+        # the server ignores Range and sends the whole file over the first connection
+        server = simserver.SimServer(self.link, '10.0.0.2', {'/file': BODY}, ranges=False)
+        download, body = self.download()
+        self.assertEqual(body, BODY)
+        self.assertIsNone(download.scheduler)
+        self.assertEqual((server.accepted, server.requests), (1, 1))
+
+    def testnorangesunknownsize(self):
+        # without Content-Length, the file ends with the response
+        server = simserver.SimServer(self.link, '10.0.0.2', {'/file': BODY}, ranges=False, chunked=True)
+        download, body = self.download()
+        self.assertEqual(body, BODY)
+        self.assertEqual((server.accepted, download.size), (1, len(BODY)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+import eventloop
+import links
+import rawhttpget
+import simnet
+import simserver
+
+FILES = {'/a.txt': b'first file' * 100, '/b.txt': b'second file' * 100}
+
+
+class RawHTTPGetTest(unittest.TestCase):
+    def setUp(self):
+        # the downloads use the thread's default loop and link, and write the files to the working directory
+        self.loop = simnet.SimLoop()
+        self.link = simnet.SimLink(self.loop)
+        oldloop, oldlink = eventloop.getloop(), links.getlink()
+        eventloop.setloop(self.loop)
+        links.setlink(self.link)
+        self.addCleanup(eventloop.setloop, oldloop)
+        self.addCleanup(links.setlink, oldlink)
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmpdir.name)
+
+    def testmany(self):
+        # urls may come with http://, https:// or no scheme at all
+        server = simserver.SimServer(self.link, '10.0.0.2', FILES)
+        reqs = rawhttpget.rawhttpgetmany(['https://10.0.0.2/a.txt', '10.0.0.2/b.txt'], local_ip='10.0.0.1')
+
+        self.assertEqual([(req.domain, req.path, req.status) for req in reqs],
+                         [('10.0.0.2', '/a.txt', 200), ('10.0.0.2', '/b.txt', 200)])
+        self.assertEqual(server.requests, 2)
+        for name in ('a.txt', 'b.txt'):
+            with open(name, 'rb') as f:
+                self.assertEqual(f.read(), FILES['/' + name])
+
+
+if __name__ == '__main__':
+    unittest.main()
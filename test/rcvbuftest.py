@@ -0,0 +1,70 @@
+import sys
+import unittest
+
+sys.path.append('../')
+import rcvbuf
+
+
+class RcvBufTest(unittest.TestCase):
+    def testbudgetfairness(self):
+        budget = rcvbuf.MemoryBudget(total=1000)
+        a, b = object(), object()
+        self.assertEqual(budget.request(a, 900), 900)
+
+        # b may always have its fair share, even if a uses more than its own
+        self.assertEqual(budget.request(b, 800), 500)
+        self.assertEqual(budget.used(), 1400)
+
+        # a is cut back to its fair share on its next request
+        self.assertEqual(budget.request(a, 900), 500)
+        budget.release(b)
+        self.assertEqual(budget.request(a, 900), 900)
+
+    def testgrow(self):
+        budget = rcvbuf.MemoryBudget(total=1 << 30)
+        tuner = rcvbuf.RcvBufTuner(initial=64 << 10, maximum=4 << 20, budget=budget)
+        tuner.samplertt(1)
+        self.assertEqual(tuner.update(0, 0), 64 << 10)
+
+        # the application reads 100 KiB per RTT: the buffer doubles that
+        tuner.read(100 << 10)
+        self.assertEqual(tuner.update(0.5, 0), 64 << 10)  # less than an RTT
+        self.assertEqual(tuner.update(1, 0), 200 << 10)
+
+        # the sender is still speeding up
+        tuner.read(200 << 10)
+        self.assertEqual(tuner.update(2, 0), 600 << 10)
+
+        # capped by the maximum
+        tuner.read(10 << 20)
+        self.assertEqual(tuner.update(3, 0), 4 << 20)
+
+    def testshrink(self):
+        budget = rcvbuf.MemoryBudget(total=1 << 30)
+        tuner = rcvbuf.RcvBufTuner(initial=64 << 10, budget=budget)
+        tuner.samplertt(1)
+        tuner.update(0, 0)
+        tuner.read(1 << 20)
+        self.assertEqual(tuner.update(1, 0), 2 << 20)
+
+        # an idle connection keeps its buffer, a stalled reader gives it back
+        self.assertEqual(tuner.update(2, 0), 2 << 20)
+        self.assertEqual(tuner.update(3, 1000), 1 << 20)
+        for i in range(20):
+            tuner.update(4 + i, 1000)
+        self.assertEqual(tuner.size, 64 << 10)
+
+        tuner.close()
+        self.assertEqual(budget.used(), 0)
+
+    def testrtt(self):
+        tuner = rcvbuf.RcvBufTuner(budget=rcvbuf.MemoryBudget())
+        tuner.samplertt(0.2)
+        tuner.samplertt(0.1)
+        self.assertEqual(tuner.rtt, 0.1)
+        tuner.samplertt(0.9)
+        self.assertAlmostEqual(tuner.rtt, 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import random
+import sys
+import unittest
+
+sys.path.append('../')
+import reassembly
+
+
+class ReassemblyTest(unittest.TestCase):
+    def testinorder(self):
+        q = reassembly.ReassemblyQueue(1000)
+        self.assertEqual(q.insert(1000, b'abc'), 3)
+        self.assertEqual(q.insert(1003, b'def'), 3)
+        self.assertEqual(q.nxt, 1006)
+        self.assertEqual(q.read(), b'abcdef')
+        self.assertIsNone(q.read())
+
+    def testoutoforder(self):
+        q = reassembly.ReassemblyQueue(0)
+        self.assertEqual(q.insert(6, b'ghi'), 0)
+        self.assertEqual(q.insert(3, b'def'), 0)
+        self.assertEqual(q.blocks(), [(3, 9)])  # adjacent ranges are merged
+        self.assertEqual(q.insert(0, b'abc'), 9)
+        self.assertEqual(q.read(), b'abcdefghi')
+        self.assertEqual(q.ooobytes, 0)
+
+    def testoverlap(self):
+        q = reassembly.ReassemblyQueue(0)
+        q.insert(4, b'efgh')
+        q.insert(10, b'kl')
+        q.insert(2, b'cdefghijk')  # covers one range, overlaps another and fills the gap between them
+        self.assertEqual(q.blocks(), [(2, 12)])
+        self.assertEqual(q.ooobytes, 10)
+        q.insert(0, b'abc')  # partially duplicate
+        self.assertEqual(q.read(), b'abcdefghijkl')
+
+    def testduplicate(self):
+        q = reassembly.ReassemblyQueue(0)
+        q.insert(0, b'abc')
+        self.assertEqual(q.insert(0, b'abc'), 0)
+        self.assertEqual(q.read(), b'abc')
+
+    def testwindowandbudget(self):
+        q = reassembly.ReassemblyQueue(0, budget=4)
+        q.insert(2, b'cdefgh')  # over budget
+        self.assertEqual(q.blocks(), [])
+        q.insert(0, b'abcdef', window=4)
+        self.assertEqual(q.read(), b'abcd')
+
+    def testbeyondwindow(self):
+        q = reassembly.ReassemblyQueue(1000)
+        self.assertEqual(q.insert(1100, b'abc', window=100), 0)
+        self.assertEqual(q.insert(1200, b'def', window=100), 0)
+        self.assertEqual(q.insert(1050, b'', window=100), 0)
+        self.assertEqual(q.blocks(), [])
+        self.assertEqual(q.ranges, dict())
+        self.assertEqual(q.ooobytes, 0)
+
+        q.insert(1098, b'xyz', window=100)  # straddles the edge of the window
+        self.assertEqual(q.blocks(), [(1098, 1100)])
+
+    def testwraparound(self):
+        q = reassembly.ReassemblyQueue(2**32 - 2)
+        q.insert(1, b'def')
+        q.insert(2**32 - 2, b'abc')
+        self.assertEqual(q.read(), b'abcdef')
+        self.assertEqual(q.nxt, 4)
+
+    def testrandomorder(self):
+        rng = random.Random(5700)
+        stream = bytes(rng.getrandbits(8) for _ in range(5000))
+        segs = []
+        for _ in range(200):
+            start = rng.randrange(len(stream))
+            segs.append((start, min(len(stream), start + rng.randint(1, 500))))
+        segs.extend((i, min(len(stream), i + 1460)) for i in range(0, len(stream), 1460))
+        rng.shuffle(segs)
+
+        q = reassembly.ReassemblyQueue(123456)
+        for start, end in segs:
+            q.insert(123456 + start, memoryview(stream)[start:end])
+
+        self.assertEqual(q.read(), stream)
+
+
+if __name__ == '__main__':
+    unittest.main()
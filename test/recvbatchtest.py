@@ -0,0 +1,48 @@
+import socket
+import sys
+import unittest
+
+sys.path.append('../')
+import recvbatch
+
+
+class RecvBatchTest(unittest.TestCase):
+    def drain(self, usemmsg):
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        a.setblocking(False)
+        receiver = recvbatch.BatchReceiver(a, count=4, size=16, usemmsg=usemmsg)
+
+        self.assertEqual(receiver.drain(), [])
+
+        sent = [bytes([i]) * (i + 1) for i in range(6)]
+        for datagram in sent:
+            b.send(datagram)
+
+        first = [bytes(d) for d in receiver.drain()]
+        second = [bytes(d) for d in receiver.drain()]
+        self.assertEqual(first, sent[:4])
+        self.assertEqual(second, sent[4:])
+        self.assertEqual(receiver.drain(), [])
+
+        # datagrams are views of the pool, so the next batch overwrites them
+        b.send(b'abc')
+        b.send(b'xyz')
+        views = receiver.drain()
+        b.send(b'123')
+        receiver.drain()
+        self.assertEqual(bytes(views[0]), b'123')
+
+        a.close()
+        b.close()
+
+    def testrecvinto(self):
+        self.drain(False)
+
+    def testrecvmmsg(self):
+        if recvbatch.recvmmsg is None:
+            self.skipTest('recvmmsg is not available')
+        self.drain(True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import io
+import sys
+import unittest
+
+sys.path.append('../')
+import networklayer
+import pcap
+import replay
+import simnet
+import simserver
+import transportlayer
+
+FILES = {'/big': bytes(range(256)) * 4096, '/small': b'x' * 5000}
+REQUEST = b'GET /big HTTP/1.1\r\nHost: 10.0.0.2\r\n\r\nGET /small HTTP/1.1\r\nHost: 10.0.0.2\r\nConnection: close\r\n\r\n'
+
+
+def capture(latency=simnet.LATENCY, **linkargs):
+    """Downloads two files over one connection of a simulated network and returns the capture and the bytes received"""
+    loop = simnet.SimLoop(start=1000.0)
+    link = simnet.SimLink(loop, seed=3, latency=latency, **linkargs)
+    simserver.SimServer(link, '10.0.0.2', FILES)
+    out = io.BytesIO()
+    writer = pcap.PcapWriter(out, clock=lambda: int(loop.time() * 1e9))
+
+    ntwk = networklayer.NetworkLayer(loop=loop, link=link, capture=writer)
+    ntwk.connect(('10.0.0.1', 40000), ('10.0.0.2', 80))
+    trans = transportlayer.TransportLayer(ntwk, 40000, 80)
+    trans.send(REQUEST)
+    received = 0
+    data = trans.recv()
+    while data is not None:
+        received += len(data)
+        data = trans.recv()
+    trans.shutdown()
+    writer.close()
+    loop.close()
+
+    # everything we sent and everything the server sent us is recorded
+    assert writer.packets == link.up.sent + link.down.sent - link.down.lost - link.down.dropped + \
+        link.down.duplicated, writer.packets
+    out.seek(0)
+    return list(pcap.readpcap(out)), received
+
+
+class ReplayTest(unittest.TestCase):
+    def testcapture(self):
+        records, _ = capture()
+        first = replay.Capture(records)
+        self.assertEqual(first.client, ('10.0.0.1', 40000))
+        self.assertEqual(first.server, ('10.0.0.2', 80))
+        self.assertEqual(bytes(first.request), REQUEST)
+        self.assertEqual(records[0][0], 1000 * 10 ** 9)
+
+        # the SYN-ACK arrives a round trip after the SYN
+        offset, synack = first.inbound[0]
+        self.assertAlmostEqual(offset, 2 * simnet.LATENCY, places=3)
+        self.assertEqual(synack[12:16], bytes([10, 0, 0, 2]))
+
+        with self.assertRaises(RuntimeError):
+            replay.Capture(records, port=40001)
+
+    def testreplay(self):
+        records, received = capture(loss=0.01, reorder=0.01)
+        replayer = replay.Replayer(replay.Capture(records))
+        metrics = replayer.run()
+
+        self.assertEqual(replayer.statuses, [200, 200])
+        self.assertEqual(metrics['responses'], 2)
+        self.assertEqual(metrics['body_bytes'], len(FILES['/big']) + len(FILES['/small']))
+        self.assertLess(metrics['body_bytes'], received)  # which also included the headers
+        self.assertGreater(metrics['sent'], 0)
+
+        # replaying again gives the same result
+        again = replay.Replayer(replay.Capture(records)).run()
+        self.assertEqual(again['packets'], metrics['packets'])
+        self.assertEqual(again['sent'], metrics['sent'])
+
+    def testrealtime(self):
+        records, _ = capture(latency=0.002)
+        replayer = replay.Replayer(replay.Capture(records), realtime=True)
+        self.assertEqual(replayer.run()['responses'], 2)
+        self.assertEqual(replayer.statuses, [200, 200])
+
+
+if __name__ == '__main__':
+    unittest.main()
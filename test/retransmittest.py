@@ -0,0 +1,103 @@
+import sys
+import unittest
+
+sys.path.append('../')
+import retransmit
+import tcp
+
+
+class RetransmitTest(unittest.TestCase):
+    def testrtoestimator(self):
+        rto = retransmit.RTOEstimator(minrto=0.2)
+        self.assertEqual(rto.rto, 1.0)
+
+        rto.sample(0.1)
+        self.assertAlmostEqual(rto.srtt, 0.1)
+        self.assertAlmostEqual(rto.rttvar, 0.05)
+        self.assertAlmostEqual(rto.rto, 0.3)
+
+        rto.sample(0.1)
+        self.assertAlmostEqual(rto.rttvar, 0.0375)
+        self.assertAlmostEqual(rto.rto, 0.25)
+
+        rto.backoff()
+        self.assertAlmostEqual(rto.rto, 0.5)
+        for _ in range(10):
+            rto.backoff()
+        self.assertEqual(rto.rto, retransmit.MAX_RTO)
+
+    def testcumulativeack(self):
+        q = retransmit.RetransmitQueue()
+        for i in range(4):
+            q.push(tcp.TCP(seq=1000 + i * 100, data=bytearray(100)), 0.0)
+        q.push(tcp.TCP(seq=1400, flags='A'), 0.0)  # pure ACK, not tracked
+        self.assertEqual(len(q), 4)
+
+        self.assertEqual(q.ack(1250, 0.5), 2)  # partially acked segment stays
+        self.assertEqual(q.segments[0].seq, 1200)
+        self.assertAlmostEqual(q.rto.srtt, 0.5)
+        self.assertEqual(q.ack(1400, 0.6), 2)
+        self.assertIsNone(q.deadline)
+
+    def testpartialack(self):
+        q = retransmit.RetransmitQueue()
+        q.push(tcp.TCP(seq=1000, data=bytearray(1000)), 0.0)
+        self.assertEqual(q.deadline, 1.0)
+
+        # new data is acknowledged but no segment is complete: the timer still restarts
+        self.assertEqual(q.ack(1500, 0.8), 0)
+        self.assertEqual((q.una, q.deadline), (1500, 1.8))
+        self.assertFalse(q.expired(1.5))
+
+        # a duplicate ACK does not
+        q.ack(1500, 1.2)
+        self.assertEqual(q.deadline, 1.8)
+
+    def testsynfin(self):
+        q = retransmit.RetransmitQueue()
+        q.push(tcp.TCP(seq=2**32 - 1, flags='S'), 0.0)
+        self.assertEqual(q.ack(0, 0.1), 1)
+
+    def testtimeout(self):
+        q = retransmit.RetransmitQueue()
+        q.push(tcp.TCP(seq=0, data=bytearray(10)), 0.0)
+        q.push(tcp.TCP(seq=10, data=bytearray(10)), 0.0)
+        self.assertFalse(q.expired(0.5))
+        self.assertTrue(q.expired(1.0))
+
+        seg = q.timeout(1.0)
+        self.assertEqual(seg.seq, 0)
+        self.assertEqual(q.deadline, 3.0)
+
+        # Karn's rule: no sample from an ACK covering a retransmitted segment
+        q.ack(10, 1.5)
+        self.assertIsNone(q.rto.srtt)
+
+        # a timestamp tells which transmission was acknowledged
+        q.ack(20, 1.6, rtt=0.1)
+        self.assertAlmostEqual(q.rto.srtt, 0.1)
+
+    def testflight(self):
+        q = retransmit.RetransmitQueue()
+        self.assertEqual(q.flight(), 0)
+        q.push(tcp.TCP(seq=2**32 - 50, data=bytearray(100)), 0.0)
+        q.push(tcp.TCP(seq=50, data=bytearray(100)), 0.0)
+        self.assertEqual(q.flight(), 200)
+
+        q.ack(0, 0.1)  # partial ACK of the first segment
+        self.assertEqual(q.flight(), 150)
+        self.assertEqual(len(q), 2)
+
+        # a fast retransmit neither backs off the RTO nor restarts the timer
+        deadline = q.deadline
+        seg = q.retransmit(0.2)
+        self.assertEqual(seg.seq, 2**32 - 50)
+        self.assertTrue(seg.retransmitted)
+        self.assertEqual(q.deadline, deadline)
+
+        q.ack(150, 0.3)
+        self.assertEqual(q.flight(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import sys
+import unittest
+
+sys.path.append('../')
+import sendbuffer
+
+
+class SendBufferTest(unittest.TestCase):
+    def testtakeviews(self):
+        buf = sendbuffer.SendBuffer()
+        body = b'a' * 1000
+        buf.append(body)
+        self.assertEqual(len(buf), 1000)
+
+        # segments are views of the data, not copies
+        seg = buf.take(536)
+        self.assertIsInstance(seg, memoryview)
+        self.assertIs(seg.obj, body)
+        self.assertEqual(len(buf), 464)
+        self.assertEqual(bytes(buf.take(464)), b'a' * 464)
+        self.assertEqual(len(buf), 0)
+        self.assertFalse(buf)
+
+    def testspanchunks(self):
+        buf = sendbuffer.SendBuffer()
+        data = bytearray(b'abc')
+        buf.append(data)
+        buf.append(b'')
+        buf.append(b'defgh')
+        data[0] = ord('z')  # mutable data was copied
+
+        self.assertEqual(bytes(buf.take(2)), b'ab')
+        self.assertEqual(bytes(buf.take(4)), b'cdef')
+        self.assertEqual(bytes(buf.take(2)), b'gh')
+        self.assertEqual(len(buf.chunks), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
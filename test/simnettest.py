@@ -0,0 +1,86 @@
+import socket
+import sys
+import unittest
+
+sys.path.append('../')
+import simnet
+
+
+def datagram(dst, size):
+    """Returns a datagram of the given size whose destination address is dst"""
+    return bytes(16) + socket.inet_aton(dst) + bytes(size - 20)
+
+
+class Host:
+    def __init__(self, loop):
+        self.loop = loop
+        self.received = []
+
+    def receive(self, data):
+        self.received.append((self.loop.time(), bytes(data)))
+
+
+class SimNetTest(unittest.TestCase):
+    def testclock(self):
+        loop = simnet.SimLoop()
+        fired = []
+        loop.call_at(0.3, lambda: fired.append(loop.time()))
+        loop.call_later(100, lambda: fired.append(loop.time()))
+
+        # waiting takes no time, and every timer runs at exactly its time
+        self.assertTrue(loop.run_until(lambda: len(fired) == 2))
+        self.assertEqual(fired, [0.3, 100])
+        self.assertFalse(loop.run_until(lambda: False, 5))
+        self.assertEqual(loop.time(), 105)
+
+        # nothing can ever happen anymore
+        with self.assertRaises(RuntimeError):
+            loop.run_until(lambda: False)
+        loop.close()
+
+    def testpipe(self):
+        loop = simnet.SimLoop()
+        link = simnet.SimLink(loop, latency=0.01, bandwidth=8e6, queue=3000)
+        host = Host(loop)
+        link.attach('10.0.0.2', host)
+        sock = link.connect(('10.0.0.2', 80))
+
+        # 1000 byte datagrams take 1 ms each to serialize, then 10 ms to arrive. the fifth finds 4 ms of data, i.e.
+        # 4000 bytes, queued ahead of it, which is more than the queue holds
+        for i in range(5):
+            sock.send(datagram('10.0.0.2', 1000))
+        loop.run_until(lambda: False, 1)
+        self.assertEqual([round(t, 6) for t, _ in host.received], [0.011, 0.012, 0.013, 0.014])
+
+        # no host has that address
+        sock.send(datagram('10.0.0.3', 1000))
+        loop.run_until(lambda: False, 1)
+        self.assertEqual((link.up.sent, link.up.dropped, link.unreachable), (6, 1, 1))
+        with self.assertRaises(OSError):
+            sock.send(datagram('10.0.0.2', 1501))
+        loop.close()
+
+    def testimpairments(self):
+        def run(seed):
+            loop = simnet.SimLoop()
+            link = simnet.SimLink(loop, seed=seed, loss=0.1, reorder=0.1, duplicate=0.1)
+            received = []
+            link.listen(lambda datagrams: received.extend(bytes(d[20:24]) for d in datagrams))
+            for i in range(1000):
+                link.send(datagram('10.0.0.1', 24)[:20] + i.to_bytes(4, byteorder='big'))
+            loop.run_until(lambda: False, 10)
+            loop.close()
+            return link.down, [int.from_bytes(r, byteorder='big') for r in received]
+
+        pipe, received = run(1)
+        self.assertEqual(len(received), 1000 - pipe.lost + pipe.duplicated)
+        self.assertTrue(50 < pipe.lost < 150 and 50 < pipe.duplicated < 150 and 50 < pipe.reordered < 150)
+        self.assertNotEqual(received, sorted(received))
+
+        # the same seed gives the same run
+        self.assertEqual(run(1)[1], received)
+        self.assertNotEqual(run(2)[1], received)
+
+
+if __name__ == '__main__':
+    unittest.main()
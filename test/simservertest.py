@@ -0,0 +1,80 @@
+import sys
+import unittest
+
+sys.path.append('../')
+import httpcode
+import networklayer
+import simnet
+import simserver
+import transportlayer
+
+BODY = bytes(i * 7 % 251 for i in range(300000))
+
+
+def download(path='/file', request=None, **linkargs):
+    """Downloads a file from a SimServer with our stack. Returns the response, the body and the finished simulation"""
+    loop = simnet.SimLoop()
+    link = simnet.SimLink(loop, **linkargs)
+    server = simserver.SimServer(link, '10.0.0.2', {'/file': BODY})
+    ntwk = networklayer.NetworkLayer(loop=loop, link=link)
+    ntwk.connect(('10.0.0.1', 40000), ('10.0.0.2', 80))
+    trans = transportlayer.TransportLayer(ntwk, 40000, 80)
+
+    if request is None:
+        request = 'GET {} HTTP/1.1\r\nHost: 10.0.0.2\r\n\r\n'.format(path)
+    trans.send(request.encode('ascii'))
+    parser = httpcode.HTTPResponse()
+    body = bytearray()
+    done = False
+    while not done:
+        data = trans.recv()
+        for event, value in parser.feed(data) if data is not None else parser.close():
+            if event == httpcode.Event.BODY:
+                body += value
+            done = done or event == httpcode.Event.END or data is None
+    trans.shutdown()
+    elapsed = loop.time()
+
+    # the server closes once our last ACK arrives
+    loop.run_until(lambda: not server.connections, 5)
+    return parser, bytes(body), elapsed, server
+
+
+class SimServerTest(unittest.TestCase):
+    def testdownload(self):
+        parser, body, elapsed, server = download()
+        self.assertEqual(parser.status, 200)
+        self.assertEqual(body, BODY)
+        self.assertEqual((server.retransmits, server.connections), (0, {}))
+
+        # three RTTs of handshake, request and teardown, plus slow start
+        self.assertTrue(0.12 < elapsed < 0.5)
+
+    def testimpaired(self):
+        parser, body, elapsed, server = download(loss=0.02, reorder=0.02, duplicate=0.02, seed=7)
+        self.assertEqual(body, BODY)
+        self.assertGreater(server.retransmits, 0)
+        self.assertEqual(server.connections, {})
+
+        # the same seed gives the same run, to the microsecond
+        self.assertEqual(download(loss=0.02, reorder=0.02, duplicate=0.02, seed=7)[2], elapsed)
+
+    def testbandwidth(self):
+        # a 1 Mbit/s link takes 2.4 seconds for the file alone
+        _, body, elapsed, _ = download(bandwidth=1e6)
+        self.assertEqual(body, BODY)
+        self.assertTrue(2.4 < elapsed < 3.5)
+
+    def testrange(self):
+        request = 'GET /file HTTP/1.1\r\nHost: 10.0.0.2\r\nRange: bytes=1000-1999\r\n\r\n'
+        parser, body, _, _ = download(request=request)
+        self.assertEqual(parser.status, 206)
+        self.assertEqual(parser.content_range(), (1000, 1999, len(BODY)))
+        self.assertEqual(body, BODY[1000:2000])
+
+        parser, body, _, _ = download('/missing')
+        self.assertEqual((parser.status, body), (404, b''))
+
+
+if __name__ == '__main__':
+    unittest.main()
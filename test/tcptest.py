@@ -10,6 +10,33 @@ class TCPTest(unittest.TestCase):
         pkt.compute_checksum(ip.IP(proto=6, len=40))
         self.assertEqual(0x917e, pkt.chksum)
 
+    def test_tcpchecksum_update(self):
+        pkt = tcp.TCP(seq=4294967000, ack=12345, flags='A', data=bytearray(b'abc'))
+        ippkt = ip.IP(proto=6, len=43)
+        pkt.compute_checksum(ippkt)
+        pkt.update(seq=100, ack=54321, window=65535)
+
+        expected = tcp.TCP(seq=100, ack=54321, flags='A', window=65535, data=bytearray(b'abc'))
+        expected.compute_checksum(ippkt)
+        self.assertEqual(expected.chksum, pkt.chksum)
+
+    def test_parseflags(self):
+        self.assertEqual(tcp.parseflags('SA'), tcp.SYN | tcp.ACK)
+        self.assertEqual(tcp.parseflags(tcp.FIN), tcp.FIN)
+        self.assertRaises(RuntimeError, tcp.parseflags, 'X')
+        self.assertRaises(RuntimeError, tcp.parseflags, 0x40)
+
+    def test_pool(self):
+        pool = tcp.TCPPool(maxsize=1)
+        pkt = pool.acquire(seq=5, flags='A', data=bytearray(b'abc'))
+        pool.release(pkt)
+
+        reused = pool.acquire(seq=6, flags=tcp.SYN)
+        self.assertIs(reused, pkt)
+        self.assertEqual(reused.seq, 6)
+        self.assertEqual(reused.flags, tcp.SYN)
+        self.assertIsNone(reused.data)
+
     def serializetest_givenflag(self, flag):
         pkt = tcp.TCP(flags=flag)
         scapypkt = scapytcp.TCP(flags=flag)
@@ -45,6 +72,38 @@ class TCPTest(unittest.TestCase):
         self.assertEqual(60, len(pkt.serialize()))
         self.assertEqual(bytes(pkt.serialize()).hex(), bytes(scapypkt).hex())
 
+    def test_options(self):
+        opts = tcp.TCPOptions(mss=1460, wscale=7, sackok=True, tsval=123456, tsecr=0)
+        pkt = tcp.TCP(flags='S', options=opts.serialize())
+        slz = pkt.serialize()
+        self.assertEqual(pkt.dataofs, 11)
+
+        # scapy decodes what we encode
+        scapypkt = scapytcp.TCP(bytes(slz))
+        scapyopts = dict(scapypkt.options)
+        self.assertEqual(scapyopts['MSS'], 1460)
+        self.assertEqual(scapyopts['WScale'], 7)
+        self.assertIn('SAckOK', scapyopts)
+        self.assertEqual(scapyopts['Timestamp'], (123456, 0))
+
+        # and we decode what scapy encodes
+        scapypkt = scapytcp.TCP(flags='A', options=[('NOP', None), ('NOP', None), ('SAck', (100, 200, 300, 400)),
+                                                     ('Timestamp', (7, 8)), ('EOL', None)])
+        decoded = tcp.deserialize_tcp(bytes(scapypkt)).parseoptions()
+        self.assertEqual(decoded.sack, [(100, 200), (300, 400)])
+        self.assertEqual((decoded.tsval, decoded.tsecr), (7, 8))
+        self.assertIsNone(decoded.mss)
+        self.assertFalse(decoded.sackok)
+
+    def test_options_sacklimit(self):
+        blocks = [(i * 100, i * 100 + 50) for i in range(5)]
+        slz = tcp.TCPOptions(tsval=1, tsecr=2, sack=blocks).serialize()
+        self.assertLessEqual(len(slz), tcp.MAXOPTLEN)
+        self.assertEqual(tcp.deserialize_options(slz).sack, blocks[:3])
+
+        self.assertRaises(RuntimeError, tcp.deserialize_options, b'\x02\x04\x05')
+        self.assertIsNone(tcp.TCPOptions().serialize())
+
     def test_deserialize_default(self):
         scapypkt = scapytcp.TCP(flags='')
         slz = bytearray(bytes(scapypkt))
@@ -55,7 +114,7 @@ class TCPTest(unittest.TestCase):
         self.assertEqual(pkt.seq, 0)
         self.assertEqual(pkt.ack, 0)
         self.assertEqual(pkt.dataofs, 5)
-        self.assertEqual(pkt.flags, '')
+        self.assertEqual(pkt.flags, 0)
         self.assertEqual(pkt.window, 8192)
         self.assertEqual(pkt.urgptr, 0)
         self.assertEqual(pkt.options, None)
@@ -71,14 +130,14 @@ class TCPTest(unittest.TestCase):
         self.assertEqual(pkt.seq, 2073116320)
         self.assertEqual(pkt.ack, 76)
         self.assertEqual(pkt.dataofs, 5)
-        self.assertEqual(pkt.flags, 'AP')
+        self.assertEqual(pkt.flags, tcp.ACK | tcp.PSH)
         self.assertEqual(pkt.window, 64240)
         self.assertEqual(hex(pkt.chksum), hex(0x2a80))
         self.assertEqual(pkt.urgptr, 0)
 
         # not gonna bother checking the whole thing for now
-        self.assertTrue(pkt.data.decode('ascii').startswith('e on a stock Ubuntu Linux'))
-        self.assertTrue(pkt.data.decode('ascii').endswith('To earn these points, you must\n'))
+        self.assertTrue(bytes(pkt.data).decode('ascii').startswith('e on a stock Ubuntu Linux'))
+        self.assertTrue(bytes(pkt.data).decode('ascii').endswith('To earn these points, you must\n'))
 
 
 if __name__ == '__main__':
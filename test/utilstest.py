@@ -14,7 +14,12 @@ class UtilsTests(TestCase):
         self.assertEqual(5, len(resp.headers))
         self.assertTrue('Transfer-Encoding' in resp.headers)
         self.assertEqual('chunked', resp.headers['Transfer-Encoding'])
-        self.assertTrue(resp.body.startswith('<!DOCTYPE html>'))
+        self.assertTrue(resp.body.startswith(b'<!DOCTYPE html>'))
+
+    def test_addscheme(self):
+        self.assertEqual(utils.addscheme('example.com/a.txt'), 'http://example.com/a.txt')
+        self.assertEqual(utils.addscheme('http://example.com/a.txt'), 'http://example.com/a.txt')
+        self.assertEqual(utils.addscheme('https://example.com/a.txt'), 'https://example.com/a.txt')
 
     def test_spliturl(self):
         url1 = 'https://david.choffnes.com/classes/cs4700fa20/project4.php'
@@ -57,6 +62,11 @@ class UtilsTests(TestCase):
         self.assertEqual(utils.bytearraytoaddr(bytearray(b'\xab\xcd\xe2\x34')), '171.205.226.52')
         self.assertEqual(utils.bytearraytoaddr(bytearray(b'\xff\xff\xff\xff')), '255.255.255.255')
 
+    def testaddrtoint(self):
+        self.assertEqual(utils.addrtoint('171.205.226.52'), 0xabcde234)
+        self.assertEqual(utils.inttoaddr(0xabcde234), '171.205.226.52')
+        self.assertRaises(RuntimeError, utils.addrtoint, '1.2.3')
+
     def test_checksum_wikipedia(self):
         bytes = bytearray.fromhex('450000730000400040110000c0a80001c0a800c7')
         print(bytes)
@@ -73,6 +83,31 @@ class UtilsTests(TestCase):
         chksm = utils.checksum16(bytes)
         self.assertEqual(chksm, 0xdb15)
 
+    def test_checksum_notmodified(self):
+        bytes = bytearray.fromhex('865eac60712a81')
+        utils.checksum16(bytes)
+        self.assertEqual(len(bytes), 7)
+
+    def test_checksum_allzeroes(self):
+        self.assertEqual(utils.checksum16(bytearray(20)), 0xffff)
+
+    def test_onessum_partial(self):
+        bytes = bytearray.fromhex('450000730000400040110000c0a80001c0a800c7')
+        partial = utils.onessum16(bytes[0:8])
+        self.assertEqual(utils.onessum16(bytes[8:], partial), utils.onessum16(bytes))
+        self.assertEqual(~utils.onessum16(bytes) & 0xffff, 0xb861)
+
+    def test_updatechecksum(self):
+        bytes = bytearray.fromhex('450000730000400040110000c0a80001c0a800c7')
+        chksm = utils.checksum16(bytes)
+
+        bytes[4:6] = utils.serialize16(0x1234)
+        self.assertEqual(utils.updatechecksum16(chksm, 0x0000, 0x1234), utils.checksum16(bytes))
+
+        bytes[12:16] = utils.serialize32(0x0a000001)
+        chksm = utils.updatechecksum16(chksm, 0x0000, 0x1234)
+        self.assertEqual(utils.updatechecksum32(chksm, 0xc0a80001, 0x0a000001), utils.checksum16(bytes))
+
 
 if __name__ == '__main__':
     unittest.main()
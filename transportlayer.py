@@ -1,22 +1,52 @@
 import random
-import signal
 import sys
-import time
 
-from tcp import TCP, deserialize_tcp
+import pkttrace
 
-PACKETSIZE = 1024  # estimated average size of a packet. used so that we can use a packet-based congestion window
+from ackpolicy import AckPolicy
+from congestion import CongestionController, Reno, NewReno, Cubic, getcontroller
+from metrics import TransportMetrics
+from rcvbuf import RcvBufTuner, INITWINDOW, MAXWINDOW
+from reassembly import ReassemblyQueue
+from retransmit import RetransmitQueue
+from sendbuffer import SendBuffer
+from tcp import TCP, TCPOptions, TCPPool, deserialize_tcp, seqle, seqlt, ACK, FIN, PSH, RST, SYN, SEQMOD, MAXWSCALE
+from utils import inttoaddr
 
+TSOPTLEN = 12  # bytes the timestamp option takes in every segment, including its padding
+IPTCPLEN = 40  # bytes of the IP and TCP headers without options, which an MTU must hold besides the segment
 
-def handler(signum, frame):
-    """Handler for timing out recv"""
-    raise TimeoutError()
+
+def windowshift(window):
+    """Returns the smallest window scale shift that lets the given window in bytes be advertised (RFC 7323)"""
+    shift = 0
+    while window >> shift > 0xffff and shift < MAXWSCALE:
+        shift += 1
+    return shift
 
 
 class TransportLayer:
-    """Handles all functionality of the transport layer and implements TCP"""
+    """
+    Handles all functionality of the transport layer and implements TCP
+
+    The connection is driven by the event loop of its network layer: received packets are handled as soon as they arrive,
+    one batch at a time, and retransmissions are driven by a loop timer, no matter which connection on the loop the caller is
+    waiting for. recv() and shutdown() run the loop until they can complete.
+
+    Data given to send() is buffered and sent in segments of at most mss bytes whenever the congestion window and the
+    window of the server allow it, as ACKs arrive. The congestion control algorithm can be chosen per connection.
+
+    The handshake negotiates window scaling, so that windows larger than 64 KiB can be advertised, SACK, so that the
+    ACKs we send describe the out of order data we hold, and timestamps, which give an RTT sample for every ACK and
+    protect against old duplicate segments (PAWS). Each is only used if the server supports it as well.
+
+    The receive buffer starts small and is sized from the rate at which the application reads by an RcvBufTuner, up
+    to maxwindow and within the memory budget shared by all connections of the process. The advertised window is the
+    free part of the buffer, so it closes when the application stops reading.
+    """
     ntwk = None  # networklayer.NetworkLayer object
     established = False  # whether the 3 way handshake has been done yet
+    finrecvd = False  # whether the server has closed its side of the connection
 
     sport = None  # local port we are bound to
     dport = None  # remote port we are connected to
@@ -24,94 +54,337 @@ class TransportLayer:
     seq = random.randint(0, 4294967295)  # initial seq
     ack = 0  # initial ack
 
-    window = 8192
+    window = INITWINDOW  # receive buffer in bytes, tuned while data arrives. without window scaling, at most 65535
+    maxwindow = MAXWINDOW  # largest receive buffer, which sets the window scale we ask for
     advert_wnd = 8192  # just a guess for what the receiver's will be
-    cwnd = 1
+    mss = 536  # largest segment we send. the default of RFC 9293 until the server tells us otherwise
+    rcvmss = 1460  # MSS we announce: the MTU of our interface minus the IP and TCP headers, set by the handshake
 
-    timeout = 60  # timeout
+    # options we offer in the SYN
+    usewscale = True
+    usesack = True
+    usetimestamps = True
 
-    # list of (expected ack, timestamp, packet itself)
-    # used to track when packets have been dropped
-    trackinginfo = []
+    congestion = 'newreno'  # default congestion control algorithm
+    ackevery = 2  # full-sized segments acknowledged by one ACK of in-order data. 1 acknowledges every segment
+    delack = 0.04  # longest an ACK is delayed, in seconds
 
-    # list of (packet seq, packet data)
-    # used for handling out of order packets
-    unsentpacketslist = []
+    timeout = 60  # how long to wait for the handshake or the teardown to complete
 
-    def __init__(self, ntwk, sport, dport, debug=False):
+    onmetrics = None  # if set, called with snapshot() every metricsinterval seconds and once more at shutdown
+    metricsinterval = 1.0
+
+    # reorders received data. created once the handshake tells us the initial seq of the server
+    rcvq = None
+
+    def __init__(self, ntwk, sport, dport, debug=False, congestion=None):
+        """
+        ntwk (NetworkLayer) - network layer to send and receive through
+        sport (int) - local port
+        dport (int) - remote port
+        congestion (str or CongestionController) - congestion control algorithm: 'reno', 'newreno' or 'cubic', or a
+                                                    controller object. Defaults to self.congestion
+        """
         self.ntwk = ntwk
+        self.loop = ntwk.loop
         self.sport = sport
         self.dport = dport
         self.debug = debug
+        self.pktpool = TCPPool()  # recycles the packet objects used for pure ACKs
+        self.rtxq = RetransmitQueue()  # packets that have been sent but not acknowledged yet
+        self.rtxtimer = None  # loop timer that fires no later than the retransmission deadline
+        self.ackpolicy = AckPolicy(every=self.ackevery, delay=self.delack)  # decides when received data is acked
+        self.delacktimer = None  # loop timer that fires no later than the delayed ACK deadline
+        self.synack = None  # SYN-ACK received during the handshake
+        self.onrecv = None  # if set, called whenever new in-order data or the server's FIN arrives
+        self.sndbuf = SendBuffer()  # data given to send() that has not been sent yet
+        self.metrics = TransportMetrics()  # what happened to the segments of the connection, see snapshot()
+        self.metricstimer = None  # loop timer that calls onmetrics
+        self.trace = pkttrace.gettrace()  # ring of records of the segments and events of the thread's connections
+        if debug:
+            self.trace.echo = sys.stdout
+
+        # negotiated options
+        self.rcvscale = 0  # shift applied to the windows we advertise
+        self.sndscale = 0  # shift applied to the windows the server advertises
+        self.sackok = False
+        self.tsok = False
+        self.tsrecent = 0  # timestamp of the server to echo (RFC 7323 4.3)
+        self.lastacksent = 0  # ack field of the last segment we sent
+        self.lastooo = None  # seq of the last out of order segment received, reported in the first SACK block
+
+        self.tuner = RcvBufTuner(initial=self.window, maximum=self.maxwindow)  # sizes the receive buffer
+        self.window = self.tuner.size
+        self.rcvright = 0  # sequence number just past the right edge of the window we advertised
+
+        if congestion is None:
+            congestion = self.congestion
+        if isinstance(congestion, str):
+            congestion = getcontroller(congestion, self.mss)
+        self.cc = congestion
+
+        ntwk.onpackets = self.__on_packets
+
+    @property
+    def cwnd(self):
+        """Congestion window in bytes"""
+        return self.cc.window()
 
     def send(self, data):
         """
-        Sends the given string data over the TCP connection.
+        Sends the given string data over the TCP connection. The first call performs the 3 way handshake. Data that
+        does not fit in the current window is buffered and sent as ACKs arrive, while the event loop runs
 
-        tcp (bytearray) - the data to send over the network
+        data (bytes-like) - the data to send over the network. bytes objects are sent without being copied
         """
-        sentdata = 0
-        while sentdata < len(data):
-            effdata = data[sentdata:min(self.advert_wnd, self.cwnd * PACKETSIZE)]
-            # first data will be delivered as the final step in the 3 way handshake
-            if not self.established:
-                self.__connect(effdata)
-                self.established = True
-            else:
-                tcppkt = TCP(data=effdata)
-                self.__send_packet(tcppkt)
+        self.sndbuf.append(data)
 
-            self.seq += len(data)
-            sentdata += len(data)
+        # first data will be delivered as the final step in the 3 way handshake
+        if not self.established:
+            self.__connect()
+            self.established = True
+        else:
+            self.__transmit()
 
-    def __track(self, tcppkt):
-        """Tracks the given packet by storing the ACK we expect to receive for it, the time at which we sent it, and the
-        packet itself so that we can retransmit it.
+    def __transmit(self):
+        """Sends buffered data while the congestion window and the server's window have room for it"""
+        while self.sndbuf:
+            room = min(self.cc.window(), self.advert_wnd) - self.rtxq.flight()
+            n = min(len(self.sndbuf), self.mss, room)
 
-        tcppkt (TCP) - tcp packet object to track
-        """
+            # don't send a small segment while a full one could be sent later (RFC 9293 3.8.6.2.1)
+            if n <= 0 or n < len(self.sndbuf) and n < self.mss and self.rtxq.flight() > 0:
+                return
 
-        expectedack = tcppkt.seq
-        if tcppkt.data is not None:
-            expectedack += len(tcppkt.data)
+            flags = ACK if n < len(self.sndbuf) else ACK | PSH
+            tcppkt = TCP(flags=flags, options=self.__options(), data=self.sndbuf.take(n))
+            self.__send_packet(tcppkt)
 
-        ts = time.time()
-
-        self.trackinginfo.append((expectedack, ts, tcppkt))
+    def __track(self, tcppkt):
+        """Tracks the given packet on the retransmission queue, which stores the time at which we sent it and the packet
+        itself so that we can retransmit it.
 
-    def __check_retransmit(self, tcppkt):
+        tcppkt (TCP) - tcp packet object to track
         """
-        Iterates over the list of packets we've sent looking for any packets that have timed out waiting for an ACK. For
-        any packets that have timed out, this function retransmits them. If this packet is a match for a sent packet that
-        has not timed out, then it simply removes that packet from the tracking list.
+        self.rtxq.push(tcppkt, self.loop.time())
+        self.__arm_rtx_timer()
 
-        tcppkt (TCP) - a TCP packet object that was just received from the network. If this is None, then the code is
-                       requesting to retransmit only packets that have timed out. This is useful if we never receive
-                       ACKs from the server
+    def __arm_rtx_timer(self):
+        """
+        Makes sure a loop timer fires no later than the retransmission deadline. The deadline moves on every ACK, so
+        rather than rescheduling the timer each time, a timer that fires before the deadline just re-arms itself
+        """
+        deadline = self.rtxq.deadline
+        if deadline is None:
+            return
+
+        if self.rtxtimer is not None:
+            if self.rtxtimer.when <= deadline:
+                return
+            self.rtxtimer.cancel()
+        self.rtxtimer = self.loop.call_at(deadline, self.__on_rtx_timer)
+
+    def __on_rtx_timer(self):
+        self.rtxtimer = None
+        self.__check_timeout()
+        self.__arm_rtx_timer()
+
+    def __on_ack(self, tcppkt, opts):
         """
-        ts = time.time()
+        Retires every sent packet covered by the cumulative ACK of the given packet and lets the congestion controller
+        update the window. Retransmits the oldest unacknowledged packet if the ACK is the third duplicate, or a partial
+        ACK during recovery
 
-        rmvidx = []
-        for i in range(len(self.trackinginfo)):
-            pktinfo = self.trackinginfo[i]
+        tcppkt (TCP) - a TCP packet object with the ACK flag that was just received from the network
+        opts (TCPOptions) - its decoded options, or None if it has none
+        """
+        ts = self.loop.time()
+        flight = self.rtxq.flight()
+        una = self.rtxq.una
+
+        # the echoed timestamp is the time at which the acknowledged segment was sent
+        rtt = None
+        if self.tsok and opts is not None and opts.tsecr:
+            rtt = ((self.__tsnow() - opts.tsecr) % SEQMOD) / 1000
+
+        retired = self.rtxq.ack(tcppkt.ack, ts, rtt)
+        acked = flight - self.rtxq.flight()
+
+        # RFC 5681: a duplicate ACK acknowledges nothing new, carries no data, doesn't change the window and arrives
+        # while data is outstanding
+        isdup = acked == 0 and flight > 0 and tcppkt.ack == una and tcppkt.seqlen() == 0 and \
+            tcppkt.window << self.sndscale == self.advert_wnd
+
+        if isdup:
+            self.metrics.dupacks += 1
+            self.trace.record(ts, pkttrace.IN, pkttrace.DUPACK, self.sport, self.dport, tcppkt.seq, tcppkt.ack,
+                              tcppkt.flags, tcppkt.window)
+
+        self.cc.rtt = self.rtxq.rto.srtt
+        if self.cc.ack(tcppkt.ack, acked, isdup, flight, self.seq, ts):
+            seg = self.rtxq.retransmit(ts)
+            self.__resend(seg, pkttrace.FASTRETRANSMIT)
+            self.metrics.fastretransmits += 1
+
+    def __check_timeout(self):
+        """Retransmits the oldest unacknowledged packet if the retransmission timer has expired"""
+        ts = self.loop.time()
+        if not self.rtxq.expired(ts):
+            return
+
+        # timeout -- collapse the congestion window and retransmit only the oldest unacked packet
+        self.metrics.timeouts += 1
+        self.trace.record(ts, pkttrace.OUT, pkttrace.TIMEOUT, self.sport, self.dport, self.rtxq.una,
+                          length=self.rtxq.flight())
+        self.__check_pmtu()
+        self.cc.timeout(self.rtxq.flight(), ts)
+        seg = self.rtxq.timeout(ts)
+        self.__resend(seg)
+
+    def __check_pmtu(self):
+        """
+        Shrinks the segments we send if the path MTU dropped. Routers drop our datagrams, which carry DF, when they do
+        not fit the next hop, so a timeout is when to look for an ICMP message the kernel may have received about it
+        """
+        mss = self.ntwk.pathmtu(refresh=True) - IPTCPLEN
+        if self.tsok:
+            mss -= TSOPTLEN
+        if mss < self.mss:
+            self.mss = mss
+            self.cc.setmss(mss)
+            self.trace.record(self.loop.time(), pkttrace.OUT, pkttrace.PMTU, self.sport, self.dport, length=mss)
+
+    def __resend(self, seg, event=pkttrace.RETRANSMIT):
+        """
+        Sends a tracked segment again with our current ack, window and timestamp
 
-            if ts - pktinfo[1] >= self.timeout:
-                # timeout -- reset cwnd, remove tracking info, and retransmit
-                self.cwnd = 1
-                rmvidx.append(i)
-                self.__send_packet(pktinfo[2])
+        seg (Unacked) - segment to send
+        event (int) - why it is sent again, for the trace: pkttrace.RETRANSMIT or FASTRETRANSMIT
+        """
+        seg.pkt.ack = self.ack
+        seg.pkt.window = self.__wndfield()
+        if not seg.pkt.flags & SYN:
+            seg.pkt.options = self.__options()
+        self.__acking()
+        self.ntwk.send(seg.pkt)
+        self.metrics.segments_out += 1
+        self.metrics.retransmits += 1
+        nbytes = len(seg.pkt.data) if seg.pkt.data is not None else 0
+        self.metrics.bytes_out += nbytes
+        self.trace.record(self.loop.time(), pkttrace.OUT, event, self.sport, self.dport, seg.pkt.seq, seg.pkt.ack,
+                          seg.pkt.flags, seg.pkt.window, nbytes)
+
+    def __on_metrics_timer(self):
+        self.metricstimer = self.loop.call_later(self.metricsinterval, self.__on_metrics_timer)
+        self.onmetrics(self.snapshot())
+
+    def snapshot(self):
+        """
+        Returns the counters of the connection along with its current state, such as the congestion window, the windows
+        and the RTT estimate, as a dict that json.dumps() accepts. The counters and state of the network layer are in
+        its 'ip' entry
 
-            elif tcppkt is not None and pktinfo[0] == tcppkt.ack:
-                # successfully acked -- increment cwnd and remove tracking info
-                self.cwnd = min(self.cwnd + 1, 1000)
-                rmvidx.append(i)
+        return (dict) - byte counts and windows are in bytes, times in seconds
+        """
+        snap = self.metrics.snapshot()
+        rto = self.rtxq.rto
+        ntwk = self.ntwk
+        snap.update({
+            'time': self.loop.time(),
+            'local': '{}:{}'.format(inttoaddr(ntwk.local_addr), self.sport) if ntwk.local_addr is not None else None,
+            'remote': '{}:{}'.format(inttoaddr(ntwk.remote_addr), self.dport) if ntwk.remote_addr is not None else None,
+            'established': self.established,
+            'mss': self.mss,
+            'cwnd': self.cc.window(),
+            'ssthresh': self.cc.ssthresh,
+            'flight': self.rtxq.flight(),
+            'sndwnd': self.advert_wnd,  # window the server advertised
+            'unsent': len(self.sndbuf),
+            'rcvbuf': self.window,
+            'rcvwnd': self.__rcvwnd() if self.rcvq is not None else 0,  # window we advertised
+            'unread': self.rcvq.readybytes if self.rcvq is not None else 0,
+            'ooobytes': self.rcvq.ooobytes if self.rcvq is not None else 0,
+            'oooranges': len(self.rcvq.starts) if self.rcvq is not None else 0,
+            'srtt': rto.srtt,
+            'rttvar': rto.rttvar,
+            'rto': rto.rto,
+            'minrtt': rto.minrtt,
+            'lastrtt': rto.lastrtt,
+            'rttsamples': rto.samples,
+        })
+        snap['ip'] = ntwk.snapshot()
+        return snap
+
+    def __tsnow(self):
+        """Returns our timestamp clock, which ticks every millisecond"""
+        return int(self.loop.time() * 1000) % SEQMOD
+
+    def __wndfield(self):
+        """
+        Returns the value of the window field of the segments we send. The window is the free part of the receive
+        buffer. Its right edge never moves back, and only moves forward by at least a segment or half the buffer, so
+        that the server is not invited to send tiny segments (RFC 9293 3.8.6.2.2)
+        """
+        if self.rcvq is None:
+            return min(self.window, 0xffff)  # the window of a SYN is never scaled
+
+        free = max(self.window - self.rcvq.readybytes, 0)
+        right = (self.ack + free) % SEQMOD
+        if seqlt(self.rcvright, right) and (right - self.rcvright) % SEQMOD >= min(self.window // 2, self.rcvmss):
+            self.rcvright = right
+
+        # round up so that the scaled window does not end before the right edge
+        field = min((self.__rcvwnd() + (1 << self.rcvscale) - 1) >> self.rcvscale, 0xffff)
+        self.rcvright = (self.ack + (field << self.rcvscale)) % SEQMOD
+        return field
+
+    def __rcvwnd(self):
+        """Returns the receive window we advertised, in bytes from the next byte expected"""
+        if seqlt(self.rcvright, self.ack):
+            return 0
+        return (self.rcvright - self.ack) % SEQMOD
+
+    def __tune(self):
+        """Lets the tuner resize the receive buffer"""
+        if self.rcvq is not None:
+            self.window = self.tuner.update(self.loop.time(), self.rcvq.readybytes)
+
+    def __window_update(self):
+        """
+        Sends an ACK when reading data opened up a window that was too small for the server to send a full segment
+        """
+        threshold = min(self.window // 2, self.rcvmss)
+        free = max(self.window - self.rcvq.readybytes, 0)
+        if self.__rcvwnd() < threshold <= free - self.__rcvwnd():
+            self.__send_ack()
 
-        if self.debug:
-            print('removing {} tracked packets'.format(len(rmvidx)))
+    def __options(self, sack=False):
+        """
+        Returns the serialized options of a segment we send after the handshake, or None
 
-        # for any packets that timed out or were acked successfully, stop tracking them
-        for idx in reversed(rmvidx):
-            del self.trackinginfo[idx]
+        sack (bool) - whether to report the out of order data we hold
+        """
+        if not self.tsok and not (sack and self.sackok):
+            return None
+
+        opts = TCPOptions()
+        if self.tsok:
+            opts.tsval = self.__tsnow()
+            opts.tsecr = self.tsrecent
+        if sack and self.sackok:
+            opts.sack = self.__sackblocks()
+        return opts.serialize()
+
+    def __sackblocks(self):
+        """
+        Returns the out of order blocks to report, the one holding the most recently received segment first (RFC 2018)
+        """
+        blocks = self.rcvq.blocks()
+        for i, (left, right) in enumerate(blocks):
+            if seqle(left, self.lastooo) and seqlt(self.lastooo, right):
+                blocks.insert(0, blocks.pop(i))
+                break
+        return blocks
 
     def __send_packet(self, tcppkt):
         """
@@ -124,170 +397,321 @@ class TransportLayer:
         tcppkt.dport = self.dport
         tcppkt.seq = self.seq
         tcppkt.ack = self.ack
-        tcppkt.window = self.window
+        tcppkt.window = self.__wndfield()
+        self.__acking()
 
         # track the packet, then send it
         self.__track(tcppkt)
-        self.ntwk.send(tcppkt, self.debug)
-
-    def __return_all_valid_packets(self, current_pktdata):
-        """append previously received out of order packets if they match next ack"""
-        should_look_for_more = False
-        while True and len(self.unsentpacketslist) > 0:
-            for i in range(len(self.unsentpacketslist)):
-                pktseq = (self.unsentpacketslist[i])[0]
-                pktdata = (self.unsentpacketslist[i])[1]
-                if pktseq == self.ack:
-                    should_look_for_more = True
-                    current_pktdata += pktdata
-                    if pktdata is not None:
-                        self.ack = self.ack + len(pktdata)
-                    del self.unsentpacketslist[i]
-                    break
-            
-            if not should_look_for_more:
-                break
-        return current_pktdata
-
-    def __append_packet_to_list(self, tcppkt):
-        """ Append out of order packet to the list. Duplicates will not be discarded"""
-        flag = True
-        for i in range(len(self.unsentpacketslist)):
-            pkt = self.unsentpacketslist[i]
-            if tcppkt.seq == pkt[0]:
-                flag = False
-                break
-        if flag:
-            self.unsentpacketslist.append((tcppkt.seq, tcppkt.data))
-
-    def recv(self):
-        """Receives a packet from the network and returns the TCP payload as a bytearray"""
-        success = False
-        exactseq_pktdata = None
-
-        signal.signal(signal.SIGALRM, handler)
-
-        while not success:
-            signal.alarm(self.timeout)
-
-            # receive IP packet from network layer or time out
-            # in addition to having self.trackinginfo, we must also implement a timeout here
-            # because we may never get any ACKs at all and still need to be able to retransmit
-            try:
-                ippkt = self.ntwk.recv(self.debug)
-            except TimeoutError:
-                print('timeout')
-                self.__check_retransmit(None)
-                continue
-
-            signal.alarm(0)  # reset alarm
-            if ippkt.proto != 6:
-                print('wrong ip protocol')
-                continue
-
-            # extract TCP packet from it
-            tcppkt = deserialize_tcp(ippkt.data)
-
-            if tcppkt.sport != self.dport or tcppkt.dport != self.sport:
-                print('wrong ports received by tcp')
-                continue
-
-            if self.debug:
-                tcppkt.show()
-
-            # exit if reset (we don't handle that)
-            if tcppkt.flags == 'R':
-                sys.exit('Received reset from remote server')
-
-            # break early if this is the FIN packet
-            if 'F' in tcppkt.flags:
-                return tcppkt.data
-
-            self.advert_wnd = tcppkt.window
+        self.ntwk.send(tcppkt)
+        self.metrics.segments_out += 1
+        nbytes = len(tcppkt.data) if tcppkt.data is not None else 0
+        self.metrics.bytes_out += nbytes
+        self.trace.record(self.loop.time(), pkttrace.OUT, pkttrace.SEGMENT, self.sport, self.dport, tcppkt.seq,
+                          tcppkt.ack, tcppkt.flags, tcppkt.window, nbytes)
+        self.seq = (self.seq + tcppkt.seqlen()) % SEQMOD
+
+    def __send_ack(self):
+        """
+        Sends a pure ACK for the last byte received in order. ACKs take up no sequence space and are never
+        retransmitted, so they are not tracked and their packet object goes straight back to the pool
+        """
+        ackpkt = self.pktpool.acquire(sport=self.sport, dport=self.dport, seq=self.seq, ack=self.ack, flags=ACK,
+                                      window=self.__wndfield(), options=self.__options(sack=True))
+        self.__acking()
+        self.ntwk.send(ackpkt)
+        self.metrics.segments_out += 1
+        self.metrics.acks_out += 1
+        self.trace.record(self.loop.time(), pkttrace.OUT, pkttrace.SEGMENT, self.sport, self.dport, ackpkt.seq,
+                          ackpkt.ack, ACK, ackpkt.window)
+        self.pktpool.release(ackpkt)
+
+    def __acking(self):
+        """Called for every segment we send, all of which acknowledge everything received in order so far"""
+        self.lastacksent = self.ack
+        self.ackpolicy.acked()
+
+    def __arm_delack_timer(self):
+        """Makes sure a loop timer fires no later than the delayed ACK deadline, like __arm_rtx_timer"""
+        deadline = self.ackpolicy.deadline
+        if deadline is None:
+            return
+
+        if self.delacktimer is not None:
+            if self.delacktimer.when <= deadline:
+                return
+            self.delacktimer.cancel()
+        self.delacktimer = self.loop.call_at(deadline, self.__on_delack_timer)
+
+    def __on_delack_timer(self):
+        self.delacktimer = None
+        if self.ackpolicy.due(self.loop.time()):
+            self.ackpolicy.delayed += 1
+            self.__send_ack()
+        self.__arm_delack_timer()
+
+    def __on_packets(self, ippkts):
+        """
+        Handles a batch of IP packets received by the network layer, then acknowledges all of them at once, unless the
+        ACK policy lets the ACK wait. Called by the event loop. The packets are only valid during this call
 
-            # handle ack. may have to retransmit some packets
-            if 'A' in tcppkt.flags:
-                self.__check_retransmit(tcppkt)
+        ippkts (list) - received IP packets
+        """
+        before = self.rcvq.readybytes if self.rcvq is not None else 0
+        acknow = False
+        for ippkt in ippkts:
+            acknow |= self.__on_packet(ippkt)
+
+        # data we send carries the ACK as well
+        if self.established:
+            self.__transmit()
+
+        self.__tune()
+        if self.ackpolicy.pending:
+            if acknow:
+                self.__send_ack()
+            else:
+                self.__arm_delack_timer()
 
-            # out of order packet are added to list
-            if self.ack < tcppkt.seq <= self.ack + self.window:
-                self.__append_packet_to_list(tcppkt)
-            elif self.ack == tcppkt.seq:
-                success = True
+        if self.onrecv is not None and self.rcvq is not None and (self.rcvq.readybytes > before or self.finrecvd):
+            self.onrecv()
 
-                self.seq = tcppkt.ack
+    def __on_packet(self, ippkt):
+        """
+        Handles one received IP packet
 
-                if tcppkt.data is not None:
-                    self.ack = self.ack + len(tcppkt.data)
+        ippkt (IP) - received IP packet
 
-                exactseq_pktdata = tcppkt.data
+        return (bool) - whether an ACK has to be sent right away
+        """
+        if ippkt.proto != 6:
+            self.metrics.badsegments += 1
+            self.trace.record(self.loop.time(), pkttrace.IN, pkttrace.BADSEGMENT, self.sport, self.dport)
+            return False
+
+        # extract TCP packet from it
+        tcppkt = deserialize_tcp(ippkt.data)
+
+        if tcppkt.sport != self.dport or tcppkt.dport != self.sport:
+            self.metrics.badsegments += 1
+            self.trace.record(self.loop.time(), pkttrace.IN, pkttrace.BADSEGMENT, self.sport, self.dport, tcppkt.seq,
+                              tcppkt.ack, tcppkt.flags, tcppkt.window)
+            return False
+
+        self.metrics.segments_in += 1
+        nbytes = len(tcppkt.data) if tcppkt.data is not None else 0
+        self.metrics.bytes_in += nbytes
+        self.trace.record(self.loop.time(), pkttrace.IN, pkttrace.SEGMENT, self.sport, self.dport, tcppkt.seq,
+                          tcppkt.ack, tcppkt.flags, tcppkt.window, nbytes)
+
+        # exit if reset (we don't handle that). Right after the handshake, it likely means iptables weren't set
+        if tcppkt.flags & RST:
+            if self.rcvq is not None and self.rcvq.offset == 0:
+                sys.exit('Received reset after ACK in 3 way handshake. Maybe you forgot to edit iptables?')
+            sys.exit('Received reset from remote server')
+
+        # until the handshake is done, we are only waiting for the SYN-ACK. __connect completes the handshake
+        if self.rcvq is None:
+            if tcppkt.flags & SYN and tcppkt.flags & ACK:
+                self.synack = deserialize_tcp(bytes(ippkt.data))  # kept after the receive buffer is reused
+            return False
+
+        opts = None
+        if tcppkt.dataofs > 5:
+            try:
+                opts = tcppkt.parseoptions()
+            except RuntimeError:
+                self.metrics.badsegments += 1
+                self.trace.record(self.loop.time(), pkttrace.IN, pkttrace.BADSEGMENT, self.sport, self.dport,
+                                  tcppkt.seq, tcppkt.ack, tcppkt.flags, tcppkt.window, nbytes)
+                return False
+
+        if self.tsok and opts is not None and opts.tsecr and tcppkt.data is not None:
+            # data sent in response to a segment of ours echoes its timestamp
+            self.tuner.samplertt(((self.__tsnow() - opts.tsecr) % SEQMOD) / 1000)
+
+        if self.tsok and opts is not None and opts.tsval is not None:
+            # PAWS: a segment with an older timestamp than the last one is an old duplicate (RFC 7323 5.3)
+            if seqlt(opts.tsval, self.tsrecent):
+                self.metrics.paws += 1
+                self.trace.record(self.loop.time(), pkttrace.IN, pkttrace.PAWS, self.sport, self.dport, tcppkt.seq,
+                                  tcppkt.ack, tcppkt.flags, tcppkt.window, nbytes)
+                return tcppkt.seqlen() > 0 and self.ackpolicy.received(0, self.loop.time(), immediate=True)
+
+            if seqle(tcppkt.seq, self.lastacksent):
+                self.tsrecent = opts.tsval
+
+        # handle ack. may have to retransmit some packets
+        if tcppkt.flags & ACK:
+            self.__on_ack(tcppkt, opts)
+            self.__arm_rtx_timer()
+
+        self.advert_wnd = tcppkt.window << self.sndscale
+
+        immediate = self.__queue_data(tcppkt)
+
+        # the FIN takes up the sequence number after the data. it is only accepted once all data before it arrived
+        if tcppkt.flags & FIN:
+            immediate = True
+            if not self.finrecvd:
+                finseq = (tcppkt.seq + (len(tcppkt.data) if tcppkt.data is not None else 0)) % SEQMOD
+                if finseq == self.ack:
+                    self.ack = (self.ack + 1) % SEQMOD
+                    self.finrecvd = True
+
+        if tcppkt.seqlen() == 0:
+            return False
+        nbytes = len(tcppkt.data) if tcppkt.data is not None else 0
+        return self.ackpolicy.received(nbytes, self.loop.time(), immediate)
 
-            # ack last received packet
-            ackpkt = TCP(flags='A')
-            self.__send_packet(ackpkt)
+    def recv(self):
+        """
+        Runs the event loop until new in-order data is available and returns all of it as one bytes object. Returns
+        None once the server has sent a FIN and all data before it has been read
+        """
+        self.loop.run_until(lambda: self.finrecvd or (self.rcvq is not None and self.rcvq.readybytes > 0))
+        data = self.rcvq.read()
+        if data is not None:
+            self.tuner.read(len(data))
+            self.__tune()
+            if not self.finrecvd:
+                self.__window_update()
+        return data
+
+    def __queue_data(self, tcppkt):
+        """
+        Adds the payload of a received packet to the reassembly queue. In-order data, and any out of order data it makes
+        contiguous, becomes readable and advances our ack. Duplicates and data beyond our window are discarded
 
-        return self.__return_all_valid_packets(exactseq_pktdata)
+        tcppkt (TCP) - received TCP packet object
 
-    def __connect(self, data):
+        return (bool) - whether the segment has to be acknowledged right away: unless it was exactly the data we
+                        expected next, it was out of order, filled a hole, or was a duplicate or out of our window
+        """
+        if tcppkt.data is None:
+            return False
+
+        nxt = self.rcvq.nxt
+        rcvwnd = self.__rcvwnd()
+        event = None
+        if seqle((tcppkt.seq + len(tcppkt.data)) % SEQMOD, nxt):
+            self.metrics.duplicates += 1
+            event = pkttrace.DUPLICATE
+        elif not seqlt(tcppkt.seq, (nxt + rcvwnd) % SEQMOD):
+            self.metrics.outofwindow += 1
+            event = pkttrace.OUTOFWINDOW
+        elif seqlt(nxt, tcppkt.seq):
+            self.metrics.outoforder += 1
+            event = pkttrace.OUTOFORDER
+        if event is not None:
+            # the ack is the next byte we expected, the window the window field we advertised
+            self.trace.record(self.loop.time(), pkttrace.IN, event, self.sport, self.dport, tcppkt.seq, nxt,
+                              tcppkt.flags, min(rcvwnd >> self.rcvscale, 0xffff), len(tcppkt.data))
+
+        # the payload is a view of a receive buffer that is reused for the next batch, so the queue gets a copy
+        self.rcvq.insert(tcppkt.seq, bytes(tcppkt.data), rcvwnd)
+        if self.rcvq.ooobytes > self.metrics.ooomax:
+            self.metrics.ooomax = self.rcvq.ooobytes
+        if seqlt(self.rcvq.nxt, tcppkt.seq):
+            self.lastooo = tcppkt.seq
+        self.ack = self.rcvq.nxt
+
+        # the next byte expected is right after the segment only if it was in order and no hole was filled
+        return self.ack != (tcppkt.seq + len(tcppkt.data)) % SEQMOD
+
+    def __connect(self):
         """
-        Connects to the remote host by performing TCP's 3-way handshake, sending the given data with the final ACK
-        
-        data (bytearray) - data to be sent with final ACK
+        Connects to the remote host by performing TCP's 3-way handshake, sending the first buffered data with the final
+        ACK
         """
         if not self.ntwk.connected:
             self.ntwk.connect()
-
-        # 3 way handshake
-        syn = TCP(flags='S')
+        if self.onmetrics is not None:
+            self.metricstimer = self.loop.call_later(self.metricsinterval, self.__on_metrics_timer)
+
+        # the MSS we announce is what the MTU of the route to the server leaves for a segment (RFC 9293 3.7.1)
+        self.rcvmss = self.ntwk.pathmtu() - IPTCPLEN
+
+        # 3 way handshake. the SYN is retransmitted by the retransmission timer until the SYN-ACK arrives
+        synopts = TCPOptions(mss=self.rcvmss, sackok=self.usesack)
+        if self.usewscale:
+            synopts.wscale = windowshift(self.maxwindow)
+        if self.usetimestamps:
+            synopts.tsval = self.__tsnow()
+            synopts.tsecr = 0
+        syn = TCP(flags=SYN, options=synopts.serialize())
         self.__send_packet(syn)
-        synack_ip = self.ntwk.recv(self.debug)
-        synack = deserialize_tcp(synack_ip.data)
-
-        if self.debug:
-            synack.show()
+        if not self.loop.run_until(lambda: self.synack, self.timeout):
+            sys.exit('No SYN-ACK received after {} seconds'.format(self.timeout))
 
+        synack = self.synack
+        self.rtxq.ack(synack.ack, self.loop.time())
         self.seq = synack.ack
-        self.ack = synack.seq + 1
-
-        ackpkt = TCP(flags='A',
-                     data=data)
+        self.ack = (synack.seq + 1) % SEQMOD
+        self.__negotiate(synack.parseoptions())
+        self.advert_wnd = synack.window  # the window of a SYN is never scaled
+        self.rcvq = ReassemblyQueue(self.ack, budget=self.maxwindow)
+        self.rcvright = self.ack
+        self.tuner.samplertt(self.rtxq.rto.srtt)
+
+        # the ACK of our data, or the response itself, is handled by __on_packet
+        n = min(len(self.sndbuf), self.mss, self.cc.window(), self.advert_wnd)
+        ackpkt = TCP(flags=ACK if n < len(self.sndbuf) else ACK | PSH,
+                     options=self.__options(),
+                     data=self.sndbuf.take(n) if n > 0 else None)
         self.__send_packet(ackpkt)
-        resp = self.ntwk.recv(self.debug)   # ignore first packet received
-        tcpresp = deserialize_tcp(resp.data)
+        self.__transmit()
 
-        if self.debug:
-            tcpresp.show()
+    def __negotiate(self, opts):
+        """
+        Enables the options both sides offered, given the options of the SYN-ACK
+
+        opts (TCPOptions) - decoded options of the SYN-ACK
+        """
+        if self.usewscale and opts.wscale is not None:
+            self.rcvscale = windowshift(self.maxwindow)
+            self.sndscale = opts.wscale
+        self.sackok = self.usesack and opts.sackok
+        self.tsok = self.usetimestamps and opts.tsval is not None
+        if self.tsok:
+            self.tsrecent = opts.tsval
+
+        # the MSS of the server and the path MTU bound our segments, including the options we send in each of them
+        if opts.mss is not None:
+            self.mss = opts.mss
+        self.mss = min(self.mss, self.ntwk.pathmtu() - IPTCPLEN)
+        if self.tsok:
+            self.mss -= TSOPTLEN
+        self.cc.setmss(self.mss)
 
-        # alert if reset sent back. Likely means iptables weren't set
-        if 'R' in tcpresp.flags:
-            sys.exit('Received reset after ACK in 3 way handshake. Maybe you forgot to edit iptables?')
+        if self.debug:
+            print('negotiated mss {}, window scale {}/{}, sack {}, timestamps {}'.format(
+                self.mss, self.rcvscale, self.sndscale, self.sackok, self.tsok))
 
     def shutdown(self):
         """
-        Gracefully shuts down the connection to the remote server by sending a FIN packet, then ACKing all incoming
-        packets until a FIN is received from the server
+        Gracefully shuts down the connection to the remote server by sending a FIN packet once all buffered data has
+        been sent, then ACKing all incoming packets until a FIN is received from the server
         """
+        self.loop.run_until(lambda: not self.sndbuf, self.timeout)
+
         # send FIN
-        finpkt = TCP(flags='F')
+        finpkt = TCP(flags=FIN | ACK, options=self.__options())
         self.__send_packet(finpkt)
 
-        # read response
-        resp_ip = self.ntwk.recv(self.debug)
-        tcpresp = deserialize_tcp(resp_ip.data)
-
-        # ack all packets we receive until we see a FIN from the server
-        while True:
-            if self.ack == tcpresp.seq:
-                self.seq = tcpresp.ack
-
-            # ack last received packet
-            ackpkt = TCP(flags='A')
-            self.__send_packet(ackpkt)
-
-            resp_ip = self.ntwk.recv(self.debug)
-            tcpresp = deserialize_tcp(resp_ip.data)
-
-            if 'F' in tcpresp.flags:
-                break
-
-        self.ntwk.shutdown()
\ No newline at end of file
+        # __on_packet acks all packets we receive until we see a FIN from the server
+        self.loop.run_until(lambda: self.finrecvd, self.timeout)
+
+        if self.rtxtimer is not None:
+            self.rtxtimer.cancel()
+        if self.delacktimer is not None:
+            self.delacktimer.cancel()
+        if self.metricstimer is not None:
+            self.metricstimer.cancel()
+            self.metricstimer = None
+        if self.onmetrics is not None:
+            self.onmetrics(self.snapshot())
+        self.tuner.close()
+        if self.debug:
+            print('acknowledged {} segments with {} ACKs'.format(self.ackpolicy.segments, self.ackpolicy.acks))
+        self.ntwk.onpackets = None
+        self.ntwk.shutdown()
@@ -21,6 +21,13 @@ def spliturl(url):
     return domain, path
 
 
+def addscheme(url):
+    """Returns the url with http:// in front of it, unless it already starts with http:// or https://"""
+    if url.startswith('http://') or url.startswith('https://'):
+        return url
+    return 'http://' + url
+
+
 def filenamefromurl(url):
     if url == '' or url[-1] == '/':
         return 'index.html'
@@ -44,11 +51,27 @@ def getlocalip():
     return src_ip
 
 
+def getmtu(addr):
+    """
+    Returns the MTU of the route to the given IP address (given as a dot-separated string), which is the MTU of the
+    outgoing interface unless the kernel has learned a smaller path MTU. Falls back to the Ethernet MTU if the route
+    cannot be looked up
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect((addr, 1))  # Does not matter which port, nothing is sent
+        return s.getsockopt(socket.IPPROTO_IP, getattr(socket, 'IP_MTU', 14))
+    except OSError:
+        return 1500
+    finally:
+        s.close()
+
+
 def getpseudoheader(ip):
     """Extracts the pseudoheader using in the TCP checksum computation from an IP packet. Returns a bytearray"""
     pseudoheader = bytearray()
-    pseudoheader.extend(addrtobytearray(ip.src))
-    pseudoheader.extend(addrtobytearray(ip.dst))
+    pseudoheader.extend(serialize32(ip.src))
+    pseudoheader.extend(serialize32(ip.dst))
     pseudoheader.append(0)
     pseudoheader.append(ip.proto)
     pseudoheader.extend(serialize16(ip.len - ip.ihl*4))
@@ -82,6 +105,16 @@ def bytearraytoaddr(slz):
     return out
 
 
+def addrtoint(addr):
+    """Converts the given IP address (given as a dot-separated string) into a 32-bit integer"""
+    return int.from_bytes(addrtobytearray(addr), byteorder='big')
+
+
+def inttoaddr(value):
+    """Converts the given 32-bit integer to an IP address as a dot-separated string"""
+    return socket.inet_ntoa(value.to_bytes(4, byteorder='big'))
+
+
 def serialize16(value):
     """Returns the given 16-bit value as a bytearray of length 2"""
     return bytearray(value.to_bytes(2, byteorder='big', signed=False))
@@ -96,32 +129,68 @@ def deserializeint(value):
     return int.from_bytes(value, byteorder='big', signed=False)
 
 
+def onesadd16(a, b):
+    """Returns the one's complement sum of the two given 16-bit values"""
+    s = a + b
+    return (s & 0xffff) + (s >> 16)
+
+
+def onessum16(bytevec, initial=0):
+    """
+    Returns the (non-inverted) one's complement sum of all 16-bit words in the given bytes-like object, added to the
+    given initial sum. If the given buffer has an odd number of octets, then it is treated as right-padded with 0x00.
+
+    Partial sums of separate buffers can be combined with onesadd16 as long as every buffer except the last one starts
+    and ends on an even offset of the region being checksummed.
+
+    Rather than adding each word in a loop, the whole buffer is converted into a single integer. Because
+    2^16 = 1 (mod 0xffff), that integer is congruent to the sum of its 16-bit words modulo 0xffff, so one modulo
+    operation (which runs in C) yields the one's complement sum of the whole buffer.
+
+    bytevec (bytes-like) - buffer to sum. Not modified
+    initial (int) - sum of previous buffers, in the range [0, 0xffff]
+    """
+    value = int.from_bytes(bytevec, byteorder='big')
+    if len(bytevec) % 2 != 0:
+        value <<= 8
+
+    s = value % 0xffff
+    # the end-around carry sum of a nonzero buffer is never 0, but 0xffff (negative zero)
+    if s == 0 and value != 0:
+        s = 0xffff
+
+    if initial:
+        s = onesadd16(s, initial)
+
+    return s
+
+
 def checksum16(bytevec):
     """
     Computer a checksum for the given byte array. The checksum is the one's complement of the one's complement addition
     of all 16-bit words in the given bytearray. If the given array has an odd number of octets, then the array is
-    right-padded with 0x00.
+    treated as right-padded with 0x00.
     """
-    # check if len(bytevec) is multiple of 16. pad with zeroes if not
-    if len(bytevec) % 2 != 0:
-        bytevec.append(0x00)
+    return ~onessum16(bytevec) & 0xffff
 
-    # add up all 16-bit numbers in bytevec
-    sum = int.from_bytes(bytevec[0:2], byteorder='big')
 
-    for idx in range(2, len(bytevec) - 1, 2):
-        nextoctet = int.from_bytes(bytevec[idx:idx+2], byteorder='big')
-        #print('{} + {}'.format(sum, nextoctet))
-        sum += nextoctet
+def updatechecksum16(chksum, oldval, newval):
+    """
+    Incrementally updates a checksum after a 16-bit word covered by it changed from oldval to newval, following
+    equation 3 of RFC 1624: HC' = ~(~HC + ~m + m')
+
+    chksum (int) - checksum computed over the old data
+    oldval (int) - old value of the 16-bit word
+    newval (int) - new value of the 16-bit word
 
-        # check carry bits
-        if sum > 0xffff:
-            sum = sum - 0x10000 + 1
+    return - the checksum of the new data
+    """
+    s = onesadd16(~chksum & 0xffff, ~oldval & 0xffff)
+    s = onesadd16(s, newval)
+    return ~s & 0xffff
 
-    # flip all bits in the sum and return it
-    sum_bytes = serialize16(sum)
-    sum_bytes[0] ^= 0xff
-    sum_bytes[1] ^= 0xff
-    invertedsum = int.from_bytes(sum_bytes, byteorder='big', signed=False)
 
-    return invertedsum
+def updatechecksum32(chksum, oldval, newval):
+    """Same as updatechecksum16, but for a 32-bit field aligned on a 16-bit boundary (e.g. TCP seq and ack)"""
+    chksum = updatechecksum16(chksum, oldval >> 16, newval >> 16)
+    return updatechecksum16(chksum, oldval & 0xffff, newval & 0xffff)